@@ -0,0 +1,251 @@
+# coding: utf-8
+"""
+Microbenchmarks of statement building.
+
+    python benchmarks/bench.py                          # run and print
+    python benchmarks/bench.py --save baseline.json     # store the results as a baseline
+    python benchmarks/bench.py --compare baseline.json  # exit 1 on a regression against a baseline
+
+Every case builds its statement from scratch and renders it with `sql()`, the SQL cache is disabled
+unless `--cache` is given. The cases are run in `--repeat` rounds and the median of each metric over
+the rounds is reported. Latencies are per call, the peak memory is that of one call, as traced by
+tracemalloc (Python 3.4+). Timings are only comparable with a baseline made on the same machine and
+interpreter.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql_builder import sql as sql_module
+from sql_builder.sql import EmptyCond, InsertFromSelect, Select, Table
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+student = Table("student")
+class_ = Table("class")
+teacher = Table("teacher")
+teach = Table("teach")
+school = Table("school")
+snapshot = Table("student_snapshot")
+
+IDS_10K = list(range(10000))
+
+
+def point_select():
+    return student.select(student.id, student.name).where(student.id == 1)
+
+
+def join_5_way():
+    tables = teacher.join(teach, teach.teacher_id == teacher.id) \
+        .join(class_, class_.id == teach.class_id) \
+        .join(student, student.class_id == class_.id) \
+        .left_join(school, school.id == class_.school_id)
+    return Select(tables).select(teacher.name, class_.name, student.name, school.name) \
+        .where((school.city == "x") & (student.age > 18)).asc(teacher.id)[0:20]
+
+
+def or_chain_1k():
+    cond = EmptyCond()
+    for i in range(1000):
+        cond |= student.name == i
+    return student.select(student.id).where(cond)
+
+
+def in_list_10k():
+    return student.select(student.id).where(student.id.in_(IDS_10K))
+
+
+def subquery_as_table():
+    sub = student.select(student.class_id, student.age.max_("oldest")).where(student.age <= 20) \
+        .group(student.class_id).as_table("sub")
+    return student.inner_join(sub, (sub.class_id == student.class_id) & (sub.oldest == student.age)) \
+        .select(student.id, student.name)
+
+
+def insert_from_select():
+    sub = student.select(student.id, student.name, student.class_id, student.age) \
+        .where(student.name == "test").as_table("old_student")
+    return InsertFromSelect(snapshot, [snapshot.id, snapshot.name, snapshot.class_id, snapshot.age], sub) \
+        .on_duplicate_key_update(name=sub.name, age=sub.age)
+
+
+def multi_field_update():
+    return student.update(name="a", class_id=3).update(student.age.inc(1)) \
+        .where((student.id == 1) & (student.deleted == 0))
+
+
+CASES = collections.OrderedDict([
+    ("point_select", point_select),
+    ("join_5_way", join_5_way),
+    ("or_chain_1k", or_chain_1k),
+    ("in_list_10k", in_list_10k),
+    ("subquery_as_table", subquery_as_table),
+    ("insert_from_select", insert_from_select),
+    ("multi_field_update", multi_field_update),
+])
+
+METRICS = ["ops_per_sec", "p50_us", "p95_us", "p99_us", "peak_kib"]
+
+
+def _run_case(build):
+    return build().sql()
+
+
+def _percentile(sorted_values, pct):
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def measure(build, min_time=0.3, min_calls=20):
+    """Time single calls until `min_time` seconds are spent, at least `min_calls` of them."""
+    timer = timeit.default_timer
+    for _ in range(3):
+        _run_case(build)
+    timings = []
+    spent = 0.0
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while spent < min_time or len(timings) < min_calls:
+            started = timer()
+            _run_case(build)
+            elapsed = timer() - started
+            timings.append(elapsed)
+            spent += elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    timings.sort()
+    result = {
+        "calls": len(timings),
+        "ops_per_sec": len(timings) / spent,
+        "p50_us": _percentile(timings, 50) * 1e6,
+        "p95_us": _percentile(timings, 95) * 1e6,
+        "p99_us": _percentile(timings, 99) * 1e6,
+        "peak_kib": None,
+    }
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            _run_case(build)
+            result["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024.0
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run(names, min_time=0.3, cache=False, repeat=3):
+    """Measure the cases `repeat` times round-robin, keeping the median of every metric."""
+    cache_size = sql_module.sql_cache.maxsize
+    sql_module.set_sql_cache_size(cache_size if cache else 0)
+    try:
+        rounds = collections.defaultdict(list)
+        for _ in range(repeat):
+            for name in names:
+                rounds[name].append(measure(CASES[name], min_time))
+    finally:
+        sql_module.set_sql_cache_size(cache_size)
+    results = collections.OrderedDict()
+    for name in names:
+        results[name] = result = {}
+        for metric in ["calls"] + METRICS:
+            values = [each[metric] for each in rounds[name] if each[metric] is not None]
+            result[metric] = _median(values) if values else None
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Regressions against a baseline: latency (p50) or peak memory more than `threshold` (a ratio)
+    above the baseline. Returns a list of (case, metric, baseline, current).
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("p50_us", "peak_kib"):
+            if base.get(metric) is None or current.get(metric) is None:
+                continue
+            if current[metric] > base[metric] * (1 + threshold):
+                regressions.append((name, metric, base[metric], current[metric]))
+    return regressions
+
+
+def _format(value, width=10):
+    if value is None:
+        return "-".rjust(width)
+    return "{:{width}.1f}".format(value, width=width)
+
+
+def print_results(results, baseline=None):
+    print("{:<20}".format("case") + "".join(metric.rjust(12) for metric in METRICS))
+    for name, result in results.items():
+        line = "{:<20}".format(name) + "".join("  " + _format(result[metric]) for metric in METRICS)
+        base = (baseline or {}).get(name)
+        if base and base.get("p50_us"):
+            line += "  p50 {:+.1f}%".format((result["p50_us"] / base["p50_us"] - 1) * 100)
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of statement building.")
+    parser.add_argument("cases", nargs="*", help="cases to run, all by default: " + ", ".join(CASES))
+    parser.add_argument("--min-time", type=float, default=0.3, help="seconds spent on each case per round")
+    parser.add_argument("--repeat", type=int, default=3, help="rounds, the median of each metric is kept")
+    parser.add_argument("--cache", action="store_true", help="keep the SQL cache enabled")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare with a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.3,
+                        help="allowed slowdown / memory growth against the baseline, as a ratio")
+    options = parser.parse_args(argv)
+    for name in options.cases:
+        if name not in CASES:
+            parser.error("unknown case {!r}".format(name))
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)["results"]
+    results = run(options.cases or list(CASES), options.min_time, options.cache, options.repeat)
+    print_results(results, baseline)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "cache": options.cache,
+                "repeat": options.repeat,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if baseline is not None:
+        regressions = compare(results, baseline, options.threshold)
+        for name, metric, base, current in regressions:
+            print("REGRESSION {} {}: {:.1f} -> {:.1f}".format(name, metric, base, current))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,23 @@
 # coding: utf-8
 # Author: Allen Zou
 # 2017/4/15 下午10:07
+import sys
+
 __version__ = (0, 0, 25)
 
 from .sql import *
+from .in_list import InListStrategy, InListPlan
+from .optimizer import OptimizeReport, optimize
+from .dialects import Dialect, MySQLDialect, PostgreSQLDialect, SQLiteDialect, MYSQL, POSTGRESQL, SQLITE, dialect_for
+from .executor import ConnectionPool, Executor, PoolError, PoolTimeout, PoolClosed, placeholder_for
+from .chunked import ChunkedRunner, ChunkProgress
+from .profiling import QueryProfiler, QueryEvent
+from .stats import StatementStats, StatementStat
+from .result_cache import ResultCache
+from .routing import Router, Replica, RoutingSession
+from .sharding import ShardedTable, ShardRouter
+from .compiled import CompiledQuery
+from .columnar import ColumnarBatch
 
+if sys.version_info >= (3, 6):
+    from .aio import AsyncConnectionPool, ThreadedAsyncPool
@@ -0,0 +1,386 @@
+# coding: utf-8
+"""
+asyncio execution of built queries, Python 3.6+.
+
+    pool = ThreadedAsyncPool(ConnectionPool(pymysql, max_size=10, host="..."))
+    rows = await student.select().where(student.age > 20).fetch_all(pool)
+    async for row in student.select().iterate(pool):
+        ...
+    async with student.select().iterate(pool) as rows:  # the connection is released on exit
+        async for row in rows:
+            ...
+
+`AsyncConnectionPool` pools the connections of drivers with a native asyncio API (aiomysql-like
+connect/cursor/execute coroutines), `ThreadedAsyncPool` runs a blocking `ConnectionPool` in a
+bounded thread pool.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import inspect
+import threading
+import weakref
+
+from .executor import ConnectionPool, Executor, PoolTimeout, PoolClosed, placeholder_for, _empty_result, _row_count
+from .sql import Select, _Query, _execute_hooks, _run_hooks, _timer
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        value = await value
+    return value
+
+
+class AsyncConnectionPool(object):
+    """
+    A pool of connections of an asyncio driver. `connect(**connect_kwargs)` returns a connection or an
+    awaitable of one, cursor methods and commit/rollback/close may be plain calls or coroutines.
+    Queries are rendered for `dialect`, see `sql_builder.dialects`, by default for MySQL with the
+    placeholder of `paramstyle`.
+    """
+
+    def __init__(self, connect, paramstyle, max_size=10, timeout=30.0, dialect=None, **connect_kwargs):
+        assert max_size > 0
+        self._connect = connect
+        self._connect_kwargs = connect_kwargs
+        self.paramstyle = paramstyle
+        self.placeholder = placeholder_for(paramstyle)
+        self.dialect = dialect
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = collections.deque()
+        self._slots = None
+        self._closed = False
+
+    def _semaphore(self):
+        # created lazily so that it belongs to the running loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_size)
+        return self._slots
+
+    async def acquire(self, timeout=None):
+        if self._closed:
+            raise PoolClosed()
+        timeout = self.timeout if timeout is None else timeout
+        slots = self._semaphore()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout("no free connection within {:.3f}s".format(timeout))
+        if self._idle:
+            return self._idle.pop()
+        try:
+            return await _maybe_await(self._connect(**self._connect_kwargs))
+        except BaseException:
+            slots.release()
+            raise
+
+    async def release(self, connection):
+        """Roll back and put the connection back, it's closed if that fails or the pool is closed."""
+        try:
+            await _maybe_await(connection.rollback())
+        except Exception:
+            self.discard(connection)
+            return
+        if self._closed:
+            self.discard(connection)
+            return
+        self._idle.append(connection)
+        self._semaphore().release()
+
+    def discard(self, connection):
+        try:
+            result = connection.close()
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result)
+        except Exception:
+            pass
+        self._semaphore().release()
+
+    async def close(self):
+        self._closed = True
+        while self._idle:
+            connection = self._idle.pop()
+            try:
+                await _maybe_await(connection.close())
+            except Exception:
+                pass
+
+    async def _run(self, query, fetch):
+        assert isinstance(query, _Query)
+        if query.never_matches():
+            return _empty_result(fetch)
+        sql, args = query.sql(self.placeholder, self.dialect)
+        connection = await self.acquire()
+        started = _timer()
+        try:
+            cursor = await _maybe_await(connection.cursor())
+            try:
+                await _maybe_await(cursor.execute(sql, args))
+                if fetch == "all":
+                    result = await _maybe_await(cursor.fetchall())
+                elif fetch == "one":
+                    result = await _maybe_await(cursor.fetchone())
+                else:
+                    result = cursor.rowcount
+                if not isinstance(query, Select):
+                    await _maybe_await(connection.commit())
+            finally:
+                await _maybe_await(cursor.close())
+        except asyncio.CancelledError:
+            # the connection may be in the middle of a statement
+            self.discard(connection)
+            raise
+        except Exception:
+            await self.release(connection)
+            raise
+        await self.release(connection)
+        if _execute_hooks:
+            _run_hooks(_execute_hooks, query, sql, args, _timer() - started, _row_count(fetch, result))
+        return result
+
+    async def execute(self, query):
+        return await self._run(query, None)
+
+    async def fetch_all(self, query):
+        return await self._run(query, "all")
+
+    async def fetch_one(self, query):
+        return await self._run(query, "one")
+
+    async def iterate(self, query, batch_size=100):
+        assert isinstance(query, Select)
+        if query.never_matches():
+            return
+        sql, args = query.sql(self.placeholder, self.dialect)
+        connection = await self.acquire()
+        done = False
+        try:
+            cursor = await _maybe_await(connection.cursor())
+            try:
+                await _maybe_await(cursor.execute(sql, args))
+                while True:
+                    rows = await _maybe_await(cursor.fetchmany(batch_size))
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+                done = True
+            finally:
+                if done:
+                    await _maybe_await(cursor.close())
+        finally:
+            if done:
+                await self.release(connection)
+            else:
+                # stopped early or cancelled, unread rows may be pending on the connection
+                self.discard(connection)
+
+
+class _ThreadedCursor(object):
+    """A cursor on a pooled connection, every step runs in a worker thread."""
+
+    def __init__(self, pool, sql, args, batch_size):
+        self.pool = pool
+        self.sql = sql
+        self.args = args
+        self.batch_size = batch_size
+        self.connection = None
+        self.cursor = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        self.connection = self.pool.acquire()
+        self.cursor = self.connection.cursor()
+        self.cursor.execute(self.sql, self.args)
+
+    def fetch(self):
+        return self.cursor.fetchmany(self.batch_size)
+
+    def close(self):
+        # may be called by the iterator and by the closing pool, only the first call releases
+        with self._lock:
+            cursor, connection = self.cursor, self.connection
+            self.cursor = self.connection = None
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        if connection is not None:
+            self.pool.release(connection)
+
+
+class _ThreadedRows(object):
+    """
+    The rows of a Select run by a ThreadedAsyncPool, an async iterator. The connection goes back to the
+    pool when all the rows are read, on `aclose()`, on leaving `async with`, or when the pool is closed.
+    """
+
+    def __init__(self, pool, query, batch_size):
+        self._pool = pool
+        self._query = query
+        self._batch_size = batch_size
+        self._rows = collections.deque()
+        self._cursor = None
+        # the step running in a worker thread
+        self._pending = None
+        self._loop = None
+        self._slot = False
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._rows:
+            if self._closed:
+                raise StopAsyncIteration
+            try:
+                if self._cursor is None:
+                    await self._open()
+                    continue
+                rows = await self._step(self._cursor.fetch)
+            except BaseException:
+                # failed or cancelled, nothing more is read
+                self._close()
+                raise
+            if not rows:
+                await self.aclose()
+                raise StopAsyncIteration
+            self._rows.extend(rows)
+        return self._rows.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def _open(self):
+        pool = self._pool
+        if pool._closed:
+            raise PoolClosed()
+        if self._query.never_matches():
+            self._closed = True
+            return
+        sql, args = self._query.sql(pool.placeholder, pool.dialect)
+        await pool._semaphore().acquire()
+        self._loop = asyncio.get_event_loop()
+        self._slot = True
+        self._cursor = _ThreadedCursor(pool.pool, sql, args, self._batch_size)
+        pool._iterations.add(self)
+        await self._step(self._cursor.open)
+
+    async def _step(self, func):
+        self._pending = self._pool._threads.submit(func)
+        return await asyncio.wrap_future(self._pending)
+
+    def _close(self):
+        """Stop reading, returns a concurrent future of the release of the connection."""
+        self._closed = True
+        self._rows.clear()
+        cursor = self._cursor
+        pending = self._pending
+        closed = concurrent.futures.Future()
+
+        def close(_=None):
+            try:
+                cursor.close()
+            finally:
+                self._pool._iterations.discard(self)
+                if self._slot and not self._loop.is_closed():
+                    self._loop.call_soon_threadsafe(self._release_slot)
+                closed.set_result(None)
+
+        if cursor is None:
+            closed.set_result(None)
+        elif pending is not None and not pending.done():
+            # a step whose caller was cancelled may still be running, close after it in its thread
+            pending.add_done_callback(close)
+        else:
+            try:
+                self._pool._threads.submit(close)
+            except RuntimeError:
+                # the workers are gone
+                close()
+        return closed
+
+    def _release_slot(self):
+        if self._slot:
+            self._slot = False
+            self._pool._semaphore().release()
+
+    async def aclose(self):
+        if not self._closed:
+            await asyncio.wrap_future(self._close())
+
+    def __del__(self):
+        # left by a break out of `async for` without `async with`
+        if not self._closed and self._cursor is not None:
+            self._close()
+
+
+class ThreadedAsyncPool(object):
+    """
+    Runs a blocking `ConnectionPool` in a thread pool of `max_concurrency` workers, at most that many
+    queries are in flight. Cancelling a query doesn't interrupt its worker, the connection is released
+    as soon as the worker is done with it. Queries are rendered for `dialect` as by an `Executor`.
+    `result_cache` caches the results of `fetch_all` / `fetch_one`, see `sql_builder.result_cache`.
+    """
+
+    def __init__(self, pool, max_concurrency=None, result_cache=None, dialect=None):
+        assert isinstance(pool, ConnectionPool)
+        self.pool = pool
+        self.placeholder = pool.placeholder
+        self.dialect = dialect
+        self.max_concurrency = max_concurrency or pool.max_size
+        self._executor = Executor(pool, dialect=dialect, result_cache=result_cache)
+        self._threads = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self._slots = None
+        # the iterations holding a connection, those that are dropped close themselves
+        self._iterations = weakref.WeakSet()
+        self._closed = False
+
+    def _semaphore(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._slots
+
+    async def _call(self, func, *args):
+        slots = self._semaphore()
+        await slots.acquire()
+        loop = asyncio.get_event_loop()
+        try:
+            future = self._threads.submit(func, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # the slot is freed when the worker is done, not when the caller stops waiting
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+        return await asyncio.wrap_future(future)
+
+    async def execute(self, query):
+        return await self._call(self._executor.execute, query)
+
+    async def fetch_all(self, query):
+        return await self._call(self._executor.fetch_all, query)
+
+    async def fetch_one(self, query):
+        return await self._call(self._executor.fetch_one, query)
+
+    def iterate(self, query, batch_size=100):
+        """
+        The rows of a Select, read `batch_size` at a time: `async for row in pool.iterate(query)`. Use it
+        in `async with`, or call its `aclose()`, to release the connection when stopping early.
+        """
+        assert isinstance(query, Select)
+        return _ThreadedRows(self, query, batch_size)
+
+    def close(self, wait=True):
+        """Stop the workers, after releasing the connections of the iterations still open."""
+        self._closed = True
+        closing = [each._close() for each in list(self._iterations)]
+        if wait:
+            concurrent.futures.wait(closing)
+        self._threads.shutdown(wait=wait)
@@ -0,0 +1,123 @@
+# coding: utf-8
+"""
+Running a big DELETE / UPDATE / INSERT ... SELECT in key ranges.
+
+    runner = ChunkedRunner(executor, Delete(log).where(log.created < cutoff), log.id,
+                           target_duration=0.5, throttle_ratio=0.5, checkpoint=save_progress)
+    runner.run()
+
+Every chunk is the original statement with `key >= %s AND key < %s` added to its WHERE clause, run in
+sequence. The chunk size adapts so that a chunk takes about `target_duration` seconds, and the runner
+can sleep between chunks to let replicas catch up. After each chunk `checkpoint` is called with a
+`ChunkProgress`, whose `next_key` can be passed back as `resume_from` to continue an interrupted run.
+"""
+import collections
+import copy
+import time
+
+from .sql import Delete, InsertFromSelect, Select, Update, _SubQueryTable
+
+ChunkProgress = collections.namedtuple("ChunkProgress", ["lower", "upper", "next_key", "max_key", "rows",
+                                                         "total_rows", "chunks", "chunk_size", "duration"])
+
+
+class ChunkedRunner(object):
+    def __init__(self, executor, query, key, chunk_size=1000, min_chunk_size=10, max_chunk_size=100000,
+                 target_duration=0.5, throttle=0.0, throttle_ratio=0.0, checkpoint=None, resume_from=None):
+        """
+        :param executor: an `Executor`, or anything with its `execute` / `fetch_one`
+        :param query: a Delete, Update or InsertFromSelect
+        :param key: monotonically indexed column to split on, of the updated table, or of the selected
+            table for an InsertFromSelect
+        :param throttle: seconds to sleep after every chunk
+        :param throttle_ratio: also sleep this fraction of the duration of the last chunk
+        :param checkpoint: called with a ChunkProgress after every chunk
+        :param resume_from: the `next_key` of the last checkpoint
+        """
+        assert isinstance(query, (Delete, Update, InsertFromSelect))
+        assert 0 < min_chunk_size <= chunk_size <= max_chunk_size
+        assert target_duration > 0
+        self.executor = executor
+        self.query = query
+        self.key = key
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_duration = target_duration
+        self.throttle = throttle
+        self.throttle_ratio = throttle_ratio
+        self.checkpoint = checkpoint
+        self.resume_from = resume_from
+
+    def _source(self):
+        """The Select the key ranges apply to, for Delete / Update the statement itself."""
+        if isinstance(self.query, InsertFromSelect):
+            sub_query = self.query._sub_query
+            return sub_query._query if isinstance(sub_query, _SubQueryTable) else sub_query
+        return self.query
+
+    def bounds(self):
+        """(min, max) of the key among the rows the statement touches, (None, None) when there are none."""
+        source = self._source()
+        select = Select(source._tables).select(self.key.min_(), self.key.max_())
+        if source._where is not None:
+            select.where(source._where)
+        row = self.executor.fetch_one(select)
+        return tuple(row) if row else (None, None)
+
+    def chunk_query(self, lower, upper):
+        """The statement restricted to `lower <= key < upper`."""
+        source = copy.copy(self._source())
+        where = (self.key >= lower) & (self.key < upper)
+        if source._where is not None and not source._where.is_empty():
+            where = source._where & where
+        source._where = where
+        if not isinstance(self.query, InsertFromSelect):
+            return source
+        query = copy.copy(self.query)
+        if isinstance(query._sub_query, _SubQueryTable):
+            query._sub_query = _SubQueryTable(query._sub_query._alias, source)
+        else:
+            query._sub_query = source
+        return query
+
+    def _next_size(self, size, duration):
+        if duration <= 0:
+            size *= 2
+        else:
+            # move towards the target, at most by a factor of 2 per chunk
+            size = int(size * max(0.5, min(2.0, self.target_duration / duration)))
+        return max(self.min_chunk_size, min(self.max_chunk_size, size))
+
+    def chunks(self):
+        """Run the chunks one by one, yielding a ChunkProgress after each of them."""
+        lowest, highest = self.bounds()
+        if highest is None:
+            return
+        lower = lowest if self.resume_from is None else max(lowest, self.resume_from)
+        size = self.chunk_size
+        total = 0
+        count = 0
+        while lower <= highest:
+            upper = min(lower + size, highest + 1)
+            started = time.time()
+            rows = self.executor.execute(self.chunk_query(lower, upper))
+            duration = time.time() - started
+            total += max(rows or 0, 0)
+            count += 1
+            progress = ChunkProgress(lower, upper, upper, highest, rows, total, count, size, duration)
+            if self.checkpoint is not None:
+                self.checkpoint(progress)
+            yield progress
+            lower = upper
+            size = self._next_size(size, duration)
+            pause = self.throttle + self.throttle_ratio * duration
+            if pause > 0 and lower <= highest:
+                time.sleep(pause)
+
+    def run(self):
+        """Run all the chunks and return the total affected rows."""
+        total = 0
+        for progress in self.chunks():
+            total = progress.total_rows
+        return total
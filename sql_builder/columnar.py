@@ -0,0 +1,283 @@
+# coding: utf-8
+"""
+Columnar data in and out: executemany from lists or NumPy arrays per column, and Select results
+read into per-field buffers.
+
+    batch = student.insert_columns({"id": ids, "name": names, "age": ages})
+    batch.executemany(cursor)
+
+    student.update_columns({"id": ids, "name": names}, key="id").executemany(cursor)
+
+The statement is rendered once with a bind parameter per column, see `bindparam`. Row tuples are
+produced `chunk_size` rows at a time: NumPy arrays are sliced and converted to native Python values
+with `tolist()`, so neither the NumPy scalars nor all the rows exist at once.
+
+    columns = student.select(student.id, student.age).fetch_columns(connection)
+    columns["age"]  # array('q', [...]), array('l', [...]) on Python 2
+
+`fetch_columns` reads `fetchmany` batches and appends every field to an `array.array` (ints and
+floats) or a list (anything else), optionally turned into NumPy arrays. NumPy is optional.
+"""
+import array
+import collections
+import itertools
+
+import six
+
+from .compiled import CompiledQuery
+from .sql import BindParam, Column, Insert, Select, Update, _Query
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# datetime64 / timedelta64 units finer than microseconds, tolist() turns them into ints
+_FINE_UNITS = ("ns", "ps", "fs", "as")
+
+
+def _int_typecode():
+    """The typecode of 64-bit ints: "q", which Python 2 lacks, else "l" where it's 64-bit, else None for lists."""
+    for typecode in ("q", "l"):
+        try:
+            if array.array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+
+_INT_TYPECODE = _int_typecode()
+
+
+def _is_array(values):
+    return numpy is not None and isinstance(values, numpy.ndarray)
+
+
+def _as_column(values):
+    """A sliceable column: pandas Series and the like are turned into arrays, iterables into lists."""
+    if numpy is not None and not isinstance(values, numpy.ndarray) and hasattr(values, "to_numpy"):
+        return values.to_numpy()
+    if isinstance(values, (list, tuple)) or _is_array(values):
+        return values
+    return list(values)
+
+
+def to_native(array, nan_as_null=False):
+    """The values of a NumPy array as a list of Python ints, floats, strs, datetimes, ..."""
+    kind = array.dtype.kind
+    if kind in "Mm" and numpy.datetime_data(array.dtype)[0] in _FINE_UNITS:
+        array = array.astype("{}[us]".format("datetime64" if kind == "M" else "timedelta64"))
+    values = array.tolist()
+    if nan_as_null and kind in "fc":
+        missing = numpy.isnan(array)
+        if missing.any():
+            for i in numpy.flatnonzero(missing).tolist():
+                values[i] = None
+    return values
+
+
+class ColumnarBatch(object):
+    """
+    Rows of a statement given as columns. `columns` maps the names of the bind parameters of `query`
+    (or Columns, by name) to sequences or arrays of the same length.
+    """
+
+    def __init__(self, query, columns, chunk_size=10000, nan_as_null=False, placeholder="%s"):
+        assert chunk_size > 0
+        if isinstance(query, _Query):
+            query = CompiledQuery(query, placeholder)
+        assert isinstance(query, CompiledQuery)
+        self.compiled = query
+        self.chunk_size = chunk_size
+        self.nan_as_null = nan_as_null
+        self._columns = {}
+        for name, values in columns.items():
+            if isinstance(name, Column):
+                name = name.name
+            self._columns[name] = _as_column(values)
+        missing = set(query.params) - set(self._columns)
+        if missing:
+            raise ValueError("no column for the bind parameters {}".format(", ".join(sorted(missing))))
+        lengths = set(len(values) for values in self._columns.values())
+        if len(lengths) > 1:
+            raise ValueError("columns of different lengths: {}".format(sorted(lengths)))
+        self.size = lengths.pop() if lengths else 0
+        # what each arg of a row is made of: the name of a column, or a constant
+        self._layout = []
+        for arg in query._template:
+            if isinstance(arg, BindParam):
+                assert arg.index is None, "sized bind parameters can't be fed from columns"
+                self._layout.append((True, arg.name))
+            else:
+                self._layout.append((False, arg))
+
+    @property
+    def sql(self):
+        return self.compiled.sql
+
+    def __len__(self):
+        return self.size
+
+    def _slice(self, values, start, stop):
+        part = values[start:stop]
+        if _is_array(part):
+            return to_native(part, self.nan_as_null)
+        return part
+
+    def chunks(self):
+        """Lists of at most `chunk_size` row tuples, in the order of the statement args."""
+        for start in range(0, self.size, self.chunk_size):
+            stop = min(start + self.chunk_size, self.size)
+            parts = {}
+            sequences = []
+            for is_column, item in self._layout:
+                if not is_column:
+                    sequences.append(itertools.repeat(item, stop - start))
+                    continue
+                if item not in parts:
+                    parts[item] = self._slice(self._columns[item], start, stop)
+                sequences.append(parts[item])
+            yield list(six.moves.zip(*sequences))
+
+    def rows(self):
+        for chunk in self.chunks():
+            for row in chunk:
+                yield row
+
+    def executemany(self, cursor):
+        """One `executemany` per chunk, returns the sum of the row counts the cursor reports."""
+        total = 0
+        for chunk in self.chunks():
+            cursor.executemany(self.compiled.sql, chunk)
+            if cursor.rowcount is not None and cursor.rowcount > 0:
+                total += cursor.rowcount
+        return total
+
+
+def _names(columns):
+    return [name.name if isinstance(name, Column) else name for name in columns]
+
+
+def insert_columns(table, columns, **options):
+    """A ColumnarBatch of `INSERT INTO table(<columns>) VALUES(...)`."""
+    pairs = []
+    for name in _names(columns):
+        pairs.extend([getattr(table, name), BindParam(name)])
+    return ColumnarBatch(Insert(table, *pairs), columns, **options)
+
+
+def update_columns(table, columns, key, where=None, **options):
+    """
+    A ColumnarBatch of `UPDATE table SET <columns> WHERE key = ...`, the values of the `key` column
+    are among `columns`. `where` is ANDed with the key condition.
+    """
+    if isinstance(key, Column):
+        key = key.name
+    names = _names(columns)
+    assert key in names, "the key column {} has no values".format(key)
+    pairs = []
+    for name in names:
+        if name != key:
+            pairs.extend([getattr(table, name), BindParam(name)])
+    assert pairs, "nothing to update"
+    cond = getattr(table, key) == BindParam(key)
+    if where is not None:
+        cond = where & cond
+    return ColumnarBatch(Update(table, *pairs).where(cond), columns, **options)
+
+
+def _field_names(query, description):
+    """Names of the result fields: alias or name of the selected columns, else as the driver reports them."""
+    names = [each[0] for each in description]
+    if query._fields and len(query._fields) == len(names):
+        for i, field in enumerate(query._fields):
+            if isinstance(field, Column) and (field.alias or field.name):
+                names[i] = field.alias or field.name
+            elif getattr(field, "alias", None):
+                names[i] = field.alias
+    if len(set(names)) != len(names):
+        raise ValueError("duplicate field names {}, use aliases".format(names))
+    return names
+
+
+def _typecode(values):
+    """array.array typecode for a column starting with `values`, None for a list."""
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, six.integer_types):
+            return _INT_TYPECODE
+        if isinstance(value, float):
+            return "d"
+        return None
+    return None
+
+
+class _ColumnBuffer(object):
+    __slots__ = ("typecode", "values")
+
+    def __init__(self, typecode):
+        self.typecode = typecode
+        self.values = array.array(typecode) if typecode else []
+
+    def extend(self, values):
+        if self.typecode is None:
+            self.values.extend(values)
+            return
+        size = len(self.values)
+        try:
+            self.values.extend(values)
+        except (TypeError, OverflowError):
+            # NULLs, huge ints or mixed types: keep the column as a list of Python objects,
+            # dropping what the failed extend appended
+            self.values = self.values[:size].tolist()
+            self.values.extend(values)
+            self.typecode = None
+
+    def result(self, as_numpy):
+        if not as_numpy:
+            return self.values
+        if self.typecode is None:
+            column = numpy.empty(len(self.values), dtype=object)
+            column[:] = self.values
+            return column
+        # the typecodes of array.array are NumPy type characters too
+        return numpy.frombuffer(self.values, dtype=self.typecode)
+
+
+def fetch_columns(query, connection, batch_size=10000, types=None, as_numpy=False, placeholder=None,
+                  cursor=None):
+    """
+    Run a Select and return an OrderedDict of field name to the values of that field. `types` maps
+    field names to an array.array typecode, or None for a list, by default ints go to "q" ("l" on
+    Python 2), floats to "d" and the rest to lists. A numeric column holding NULLs falls back to a list.
+    """
+    from .executor import paramstyle_of, placeholder_for, server_side_cursor
+    assert isinstance(query, Select)
+    assert not as_numpy or numpy is not None, "NumPy isn't installed"
+    types = types or {}
+    if placeholder is None:
+        placeholder = placeholder_for(paramstyle_of(connection))
+    if cursor is None:
+        cursor = server_side_cursor(connection, batch_size)
+    sql, args = query.sql(placeholder)
+    try:
+        cursor.execute(sql, args)
+        names = _field_names(query, cursor.description)
+        buffers = None
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = list(six.moves.zip(*rows))
+            if buffers is None:
+                buffers = [_ColumnBuffer(types[name] if name in types else _typecode(column))
+                           for name, column in zip(names, columns)]
+            for buffer, column in zip(buffers, columns):
+                buffer.extend(column)
+    finally:
+        cursor.close()
+    if buffers is None:
+        buffers = [_ColumnBuffer(types.get(name)) for name in names]
+    return collections.OrderedDict((name, buffer.result(as_numpy)) for name, buffer in zip(names, buffers))
@@ -0,0 +1,94 @@
+# coding: utf-8
+"""
+Statements rendered once and run many times with other values.
+
+    by_id = student.select().where(student.id == bindparam("id")).compile()
+    cursor.execute(by_id.sql, by_id.args(id=3))
+
+    rename = student.update(name=bindparam("name")).where(student.id == bindparam("id")).compile()
+    rename.executemany(cursor, [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+
+The args of the rendered statement are turned into a generated function taking a dict of the bind
+values, or a tuple of them in the order of `params`, and returning the args list.
+"""
+import six
+
+from .sql import BindParam, _Query
+
+
+def _args_function(template, params, by_name):
+    namespace = {}
+    lines = ["def bind(values):"]
+    items = []
+    sized = {}
+    for i, arg in enumerate(template):
+        if not isinstance(arg, BindParam):
+            name = "c{:d}".format(i)
+            namespace[name] = arg
+            items.append(name)
+            continue
+        key = repr(arg.name) if by_name else "{:d}".format(params.index(arg.name))
+        if arg.index is None:
+            items.append("values[{}]".format(key))
+            continue
+        var = sized.get(arg.name)
+        if var is None:
+            var = sized[arg.name] = "p{:d}".format(len(sized))
+            lines.append("    {} = values[{}]".format(var, key))
+            lines.append("    if len({}) != {:d}:".format(var, arg.size))
+            lines.append("        raise ValueError({!r})".format(
+                "bind parameter {} takes {:d} values".format(arg.name, arg.size)))
+        items.append("{}[{:d}]".format(var, arg.index))
+    lines.append("    return [{}]".format(", ".join(items)))
+    six.exec_(compile("\n".join(lines), "<compiled query>", "exec"), namespace)
+    return namespace["bind"]
+
+
+class CompiledQuery(object):
+    """The SQL of a query rendered once, `args()` binds values to it. Returned by `query.compile()`."""
+
+    def __init__(self, query, placeholder="%s", dialect=None):
+        assert isinstance(query, _Query)
+        self.query = query
+        self.placeholder = placeholder if dialect is None else dialect.placeholder
+        self.dialect = dialect
+        self.sql, template = query.sql(placeholder, dialect)
+        self._template = template
+        self.params = []
+        sizes = {}
+        for arg in template:
+            if not isinstance(arg, BindParam):
+                continue
+            if arg.name not in sizes:
+                sizes[arg.name] = arg.size
+                self.params.append(arg.name)
+            elif sizes[arg.name] != arg.size:
+                raise ValueError("bind parameter {} is used with different sizes".format(arg.name))
+        self._from_mapping = _args_function(template, self.params, True)
+        self._from_sequence = _args_function(template, self.params, False)
+
+    def args(self, values=None, **kwargs):
+        """The args for a dict of bind values, a tuple of them in the order of `params`, or keywords."""
+        if values is None:
+            values = kwargs
+        elif kwargs:
+            values = dict(values, **kwargs)
+        if isinstance(values, dict):
+            return self._from_mapping(values)
+        if len(values) != len(self.params):
+            raise ValueError("{:d} bind values given, {:d} expected: {}".format(
+                len(values), len(self.params), ", ".join(self.params)))
+        return self._from_sequence(values)
+
+    def args_many(self, rows):
+        """The args of every row, for `executemany`."""
+        return [self.args(row) for row in rows]
+
+    def execute(self, cursor, values=None, **kwargs):
+        return cursor.execute(self.sql, self.args(values, **kwargs))
+
+    def executemany(self, cursor, rows):
+        return cursor.executemany(self.sql, self.args_many(rows))
+
+    def __repr__(self):
+        return "<CompiledQuery {!r} params={}>".format(self.sql, self.params)
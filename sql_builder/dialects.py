@@ -0,0 +1,247 @@
+# coding: utf-8
+"""
+The same queries rendered for MySQL, PostgreSQL or SQLite.
+
+    from sql_builder.dialects import POSTGRESQL, SQLITE, PostgreSQLDialect
+
+    query.sql(dialect=POSTGRESQL)  # SELECT "student"."id" FROM "student" ... LIMIT 20 OFFSET 40
+    query.sql(dialect=SQLITE)      # ... WHERE "student"."name" = ? LIMIT 20 OFFSET 40
+    query.sql(dialect=PostgreSQLDialect("dollar"))  # $1, $2, ... as asyncpg wants them
+
+Statements are built the MySQL way, a dialect only changes what differs: the quotes of identifiers,
+the placeholders, LIMIT / OFFSET, the upsert (`ON CONFLICT (...) DO UPDATE`, see `Insert.on_conflict`),
+derived tables of VALUES, INSERT ... SELECT from a derived table and the DDL of temporary tables.
+Identifiers are quoted by `quote_ident` as the nodes render them, the text of a RawSQLField is left
+as is. Placeholders are numbered once per query shape: every dialect keeps its own SQL cache, so the
+cached text of a query is reused as with `sql()`.
+"""
+from .sql import Column, ColumnUpdating, SQLCache, _SubQueryTable
+
+# stands for the placeholders of a text until they're numbered
+_MARK = "\x00"
+
+# numbered styles are format strings of the 1-based position of the arg
+PLACEHOLDERS = {
+    "qmark": "?",
+    "format": "%s",
+    "pyformat": "%s",
+    "numeric": ":{:d}",
+    "dollar": "${:d}",
+}
+
+
+class Dialect(object):
+    """MySQL, as the statements are built. The other dialects override what differs."""
+    name = "mysql"
+    quote = "`"
+    paramstyle = "format"
+    # the temporary tables of `InListStrategy`
+    create_temp_table = "CREATE TEMPORARY TABLE {table} ({column} {type})"
+    drop_temp_table = "DROP TEMPORARY TABLE IF EXISTS {table}"
+
+    def __init__(self, paramstyle=None, cache_size=1024):
+        paramstyle = paramstyle or self.paramstyle
+        if paramstyle not in PLACEHOLDERS:
+            raise ValueError("paramstyle {!r} is not supported".format(paramstyle))
+        self.paramstyle = paramstyle
+        self._numbered = "{" in PLACEHOLDERS[paramstyle]
+        # what the nodes render for each arg
+        self.placeholder = _MARK if self._numbered else PLACEHOLDERS[paramstyle]
+        self.cache = SQLCache(cache_size)
+
+    def __repr__(self):
+        return "<{} paramstyle={}>".format(type(self).__name__, self.paramstyle)
+
+    def render(self, query):
+        """The SQL text and args of a query, what `query.sql(dialect=...)` returns."""
+        if not query._cacheable or not self.cache.maxsize:
+            text, args = query._render(self.placeholder, self)
+            return self._finish(text), args
+        key = query._shape()
+        text = self.cache.get(key)
+        if text is None:
+            text, args = query._render(self.placeholder, self)
+            text = self._finish(text)
+            self.cache.put(key, text)
+            return text, args
+        args = []
+        query._collect_args(args)
+        return text, args
+
+    def quote_ident(self, name):
+        """An identifier in the quotes of the dialect, quotes in it are doubled."""
+        return "{0}{1}{0}".format(self.quote, name.replace(self.quote, self.quote * 2))
+
+    def _finish(self, text):
+        """The placeholders of the dialect in a rendered text."""
+        if self._numbered:
+            pieces = text.split(_MARK)
+            number = PLACEHOLDERS[self.paramstyle]
+            text = pieces[0] + "".join(number.format(i) + piece for i, piece in enumerate(pieces[1:], 1))
+        return text
+
+    def _compile_limit(self, c, offset, count):
+        c.parts.append(" LIMIT {:d}, {:d}".format(offset, count))
+
+    def _compile_upsert(self, c, query):
+        # the unique keys of the table decide, the conflict target isn't needed
+        c.parts.append(" ON DUPLICATE KEY UPDATE ")
+        for i, each in enumerate(query._on_duplicate_update_fields):
+            if i:
+                c.parts.append(", ")
+            each._compile(c)
+
+    def _compile_values_table(self, c, table):
+        row = "ROW({})".format(", ".join([c.placeholder] * table._width))
+        c.parts.append("(VALUES {}) AS {}".format(", ".join([row] * len(table._rows)), c.ident(table._alias)))
+        table._collect_args(c.args)
+
+    def _compile_insert_source(self, c, query):
+        if isinstance(query._sub_query, _SubQueryTable):
+            query._sub_query._compile_from(c)
+        else:
+            query._sub_query._compile(c)
+
+
+class MySQLDialect(Dialect):
+    pass
+
+
+def _of_sub_query(column, query):
+    """
+    Whether a column is of the derived table of an INSERT ... SELECT. Told by its alias: copies of the
+    statement, e.g. the chunks of a ChunkedRunner, have a new derived table with the same alias.
+    """
+    sub_query = getattr(query, "_sub_query", None)
+    table = column.table
+    return isinstance(sub_query, _SubQueryTable) and isinstance(table, _SubQueryTable) and \
+        table._alias == sub_query._alias
+
+
+def _excluded_names(query):
+    """Columns of the sub-query of an INSERT ... SELECT by name, mapped to the inserted columns."""
+    sub_query = getattr(query, "_sub_query", None)
+    if not isinstance(sub_query, _SubQueryTable):
+        return {}
+    names = {}
+    for i, field in enumerate(sub_query._query._fields):
+        name = getattr(field, "alias", None) or getattr(field, "name", None)
+        if name:
+            names[name] = query._fields[i].name if query._fields else name
+    return names
+
+
+class _StandardDialect(Dialect):
+    """What PostgreSQL and SQLite have in common."""
+    quote = '"'
+    drop_temp_table = "DROP TABLE IF EXISTS {table}"
+
+    def _compile_limit(self, c, offset, count):
+        c.parts.append(" LIMIT {:d}".format(count))
+        if offset:
+            c.parts.append(" OFFSET {:d}".format(offset))
+
+    def _compile_upsert(self, c, query):
+        if not query._conflict_target:
+            raise ValueError("an upsert for {} needs the unique columns, see on_conflict()".format(self.name))
+        parts = c.parts
+        parts.append(" ON CONFLICT ({}) DO UPDATE SET ".format(
+            ", ".join(c.ident(col.name) for col in query._conflict_target)))
+        excluded = _excluded_names(query)
+        for i, each in enumerate(query._on_duplicate_update_fields):
+            if i:
+                parts.append(", ")
+            # the row that was to be inserted is `excluded`, instead of VALUES(col) or the derived table
+            if each.op == ColumnUpdating.OP_VALUES:
+                name = each.column.name
+            elif isinstance(each.value, Column) and _of_sub_query(each.value, query):
+                name = excluded.get(each.value.name)
+                if name is None:
+                    raise ValueError("{} isn't a column of the inserted rows".format(each.value.raw_view))
+            else:
+                each._compile(c)
+                continue
+            col = c.ident(each.column.name)
+            value = "excluded.{}".format(c.ident(name))
+            if each.op == ColumnUpdating.OP_INC:
+                value = "{} + {}".format(col, value)
+            elif each.op == ColumnUpdating.OP_DEC:
+                value = "{} - {}".format(col, value)
+            parts.append("{} = {}".format(col, value))
+
+    def _compile_insert_source(self, c, query):
+        if isinstance(query._sub_query, _SubQueryTable):
+            # `INSERT ... (SELECT ...) AS alias` is MySQL only
+            c.parts.append("SELECT * FROM ")
+            query._sub_query._compile_from(c)
+        else:
+            query._sub_query._compile(c)
+
+
+class PostgreSQLDialect(_StandardDialect):
+    name = "postgresql"
+
+    def _compile_values_table(self, c, table):
+        row = "({})".format(", ".join([c.placeholder] * table._width))
+        c.parts.append("(VALUES {}) AS {}({})".format(
+            ", ".join([row] * len(table._rows)), c.ident(table._alias),
+            ", ".join(c.ident("column_{:d}".format(i)) for i in range(table._width))))
+        table._collect_args(c.args)
+
+
+class SQLiteDialect(_StandardDialect):
+    name = "sqlite"
+    paramstyle = "qmark"
+
+    def _compile_values_table(self, c, table):
+        # derived tables can't name their columns, those of VALUES are column1, column2, ...
+        row = "({})".format(", ".join([c.placeholder] * table._width))
+        c.parts.append("(SELECT {} FROM (VALUES {})) AS {}".format(
+            ", ".join("column{:d} AS {}".format(i + 1, c.ident("column_{:d}".format(i))) for i in range(table._width)),
+            ", ".join([row] * len(table._rows)), c.ident(table._alias)))
+        table._collect_args(c.args)
+
+    def _compile_insert_source(self, c, query):
+        if not query._on_duplicate_update_fields:
+            super(SQLiteDialect, self)._compile_insert_source(c, query)
+            return
+        # without a WHERE clause of its own, the ON CONFLICT of an INSERT ... SELECT is parsed as a join constraint
+        c.parts.append("SELECT * FROM ")
+        if isinstance(query._sub_query, _SubQueryTable):
+            query._sub_query._compile_from(c)
+        else:
+            c.parts.append("(")
+            query._sub_query._compile(c)
+            c.parts.append(")")
+        c.parts.append(" WHERE true")
+
+
+MYSQL = MySQLDialect()
+POSTGRESQL = PostgreSQLDialect()
+SQLITE = SQLiteDialect()
+
+# DB-API modules by the name of their top-level package
+_DRIVERS = {
+    "pymysql": MySQLDialect,
+    "MySQLdb": MySQLDialect,
+    "mysql": MySQLDialect,
+    "psycopg2": PostgreSQLDialect,
+    "psycopg": PostgreSQLDialect,
+    "pg8000": PostgreSQLDialect,
+    "sqlite3": SQLiteDialect,
+}
+_instances = {}
+
+
+def dialect_for(driver):
+    """The dialect of a DB-API module or connection, with its paramstyle. Instances are shared."""
+    from .executor import driver_module
+    module = driver if hasattr(driver, "connect") else driver_module(driver)
+    name = getattr(module, "__name__", "").split(".")[0]
+    if name not in _DRIVERS:
+        raise ValueError("unknown database driver {!r}".format(name))
+    key = (_DRIVERS[name], getattr(module, "paramstyle", None))
+    dialect = _instances.get(key)
+    if dialect is None:
+        dialect = _instances[key] = key[0](key[1])
+    return dialect
@@ -0,0 +1,376 @@
+# coding: utf-8
+"""
+Running built queries on a pool of DB-API connections.
+
+    pool = ConnectionPool(pymysql, min_size=2, max_size=20, host="...", user="...", db="...")
+    executor = Executor(pool)
+    rows = executor.fetch_all(student.select().where(student.age > 20))
+"""
+import collections
+import contextlib
+import itertools
+import sys
+import threading
+import time
+
+from .sql import Select, _Query, _execute_hooks, _run_hooks, _timer
+
+PARAMSTYLE_PLACEHOLDERS = {
+    "qmark": "?",
+    "format": "%s",
+    "pyformat": "%s",
+}
+
+
+def placeholder_for(paramstyle):
+    """The placeholder to pass to `sql()` for a DB-API `paramstyle`."""
+    try:
+        return PARAMSTYLE_PLACEHOLDERS[paramstyle]
+    except KeyError:
+        raise ValueError("paramstyle {!r} is not supported".format(paramstyle))
+
+
+def driver_module(connection):
+    """The DB-API module a connection comes from, e.g. `pymysql` for a `pymysql.connections.Connection`."""
+    return sys.modules.get(type(connection).__module__.split(".")[0])
+
+
+def paramstyle_of(connection):
+    return getattr(driver_module(connection), "paramstyle", "format")
+
+
+_cursor_names = itertools.count()
+
+
+def server_side_cursor(connection, batch_size=1000):
+    """
+    A cursor that doesn't buffer the whole result on the client when the driver has one: SSCursor for
+    pymysql / MySQLdb, a named cursor for psycopg2. Falls back to a plain cursor, read with fetchmany.
+    """
+    module = driver_module(connection)
+    cursor_class = getattr(getattr(module, "cursors", None), "SSCursor", None)
+    if cursor_class is not None:
+        return connection.cursor(cursor_class)
+    if module is not None and module.__name__.startswith("psycopg"):
+        cursor = connection.cursor(name="sql_builder_stream_{:d}".format(next(_cursor_names)))
+        cursor.itersize = batch_size
+        return cursor
+    return connection.cursor()
+
+
+def stream(connection, sql, args, batch_size=1000, cursor=None):
+    """Yield the rows of a statement in `fetchmany` batches, the cursor is closed when the generator is."""
+    if cursor is None:
+        cursor = server_side_cursor(connection, batch_size)
+    try:
+        cursor.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+
+
+def _row_count(fetch, result):
+    """Rows returned by a fetch, or affected by an execute."""
+    if fetch == "all":
+        return len(result)
+    if fetch == "one":
+        return 0 if result is None else 1
+    return result
+
+
+def _empty_result(fetch):
+    """The result of a query that matches no row, returned for `never_matches()` queries without running them."""
+    if fetch == "all":
+        return []
+    if fetch == "one":
+        return None
+    return 0
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class PoolClosed(PoolError):
+    pass
+
+
+def _ping(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of DB-API connections.
+
+    `creator` is either a DB-API module, whose `connect` is called with `connect_kwargs` and whose
+    `paramstyle` is used, or a callable returning a connection, `paramstyle` must then be given.
+    """
+    _Idle = collections.namedtuple("_Idle", ["connection", "since", "checked"])
+
+    def __init__(self, creator, min_size=1, max_size=10, timeout=30.0, max_idle_time=300.0,
+                 health_check=_ping, health_check_interval=30.0, paramstyle=None, **connect_kwargs):
+        """
+        :param min_size: connections opened upfront and kept even when idle
+        :param max_size: upper bound of open connections
+        :param timeout: seconds to wait for a free connection before raising PoolTimeout
+        :param max_idle_time: idle connections above `min_size` are closed after this many seconds
+        :param health_check: called with a connection that has been idle for `health_check_interval`
+            seconds before handing it out, it's replaced if this raises. None disables the check.
+        """
+        assert 0 <= min_size <= max_size and max_size > 0
+        if hasattr(creator, "connect"):
+            self._connect = creator.connect
+            paramstyle = paramstyle or getattr(creator, "paramstyle", None)
+        else:
+            assert callable(creator)
+            self._connect = creator
+        assert paramstyle, "paramstyle is required when creator isn't a DB-API module"
+        self.paramstyle = paramstyle
+        self.placeholder = placeholder_for(paramstyle)
+        self._connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle_time = max_idle_time
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = collections.deque()
+        self._size = 0
+        self._closed = False
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append(self._new_idle(self._create()))
+
+    @property
+    def size(self):
+        """Number of open connections, idle or in use."""
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _create(self):
+        try:
+            return self._connect(**self._connect_kwargs)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+    def _new_idle(self, connection):
+        now = time.time()
+        return ConnectionPool._Idle(connection, now, now)
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        """Close connections idle for too long, keeping `min_size` open. Called with the lock held."""
+        expired = []
+        # the oldest connections are on the left
+        while self._idle and self._size > self.min_size and now - self._idle[0].since > self.max_idle_time:
+            expired.append(self._idle.popleft().connection)
+            self._size -= 1
+        return expired
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        while True:
+            expired = []
+            try:
+                with self._lock:
+                    while True:
+                        if self._closed:
+                            raise PoolClosed()
+                        now = time.time()
+                        expired.extend(self._evict_idle(now))
+                        if self._idle:
+                            idle = self._idle.pop()
+                            break
+                        if self._size < self.max_size:
+                            self._size += 1
+                            idle = None
+                            break
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise PoolTimeout("no free connection within {:.3f}s".format(timeout))
+                        self._lock.wait(remaining)
+            finally:
+                for connection in expired:
+                    self._close_quietly(connection)
+            if idle is None:
+                return self._create()
+            if self.health_check is None or now - idle.checked < self.health_check_interval:
+                return idle.connection
+            try:
+                self.health_check(idle.connection)
+            except Exception:
+                self._discard(idle.connection)
+                continue
+            return idle.connection
+
+    def release(self, connection, discard=False):
+        """Put a connection back, its pending transaction is rolled back. Broken ones should be discarded."""
+        if not discard:
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._discard(connection)
+            return
+        with self._lock:
+            if not self._closed:
+                self._idle.append(self._new_idle(connection))
+                self._lock.notify()
+                return
+            self._size -= 1
+        self._close_quietly(connection)
+
+    def _discard(self, connection):
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+        self._close_quietly(connection)
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle = [each.connection for each in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._lock.notify_all()
+        for connection in idle:
+            self._close_quietly(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Executor(object):
+    """
+    Runs queries on a ConnectionPool, writes are committed unless `autocommit` is off. With `optimize`
+    the WHERE clauses are normalized first, see `sql_builder.optimizer`. Queries are rendered for
+    `dialect`, see `sql_builder.dialects`, by default for MySQL with the placeholder of the pool.
+    With a `result_cache` the results of `fetch_all` / `fetch_one` are cached and the writes invalidate
+    them once their transaction is over, see `sql_builder.result_cache`.
+    """
+
+    def __init__(self, pool, autocommit=True, optimize=False, dialect=None, result_cache=None):
+        assert isinstance(pool, ConnectionPool)
+        self.pool = pool
+        self.autocommit = autocommit
+        self.optimize = optimize
+        self.dialect = dialect
+        self.result_cache = result_cache
+
+    @property
+    def placeholder(self):
+        return self.pool.placeholder
+
+    def _run(self, query, fetch):
+        assert isinstance(query, _Query)
+        if self.optimize:
+            query = query.optimized()
+        if query.never_matches():
+            return _empty_result(fetch)
+        sql, args = query.sql(self.pool.placeholder, self.dialect)
+        cache = self.result_cache
+        if cache is not None and fetch is not None and isinstance(query, Select):
+            try:
+                key = (fetch, sql, tuple(args))
+                hash(key)
+            except TypeError:
+                # unhashable args, e.g. lists bound to JSON columns
+                pass
+            else:
+                from .result_cache import read_tables
+                return cache.get_or_load(key, lambda: read_tables(query),
+                                         lambda: self._query(query, sql, args, fetch))
+        return self._query(query, sql, args, fetch)
+
+    def _query(self, query, sql, args, fetch):
+        started = _timer()
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(sql, args)
+                    if fetch == "all":
+                        result = cursor.fetchall()
+                    elif fetch == "one":
+                        result = cursor.fetchone()
+                    else:
+                        result = cursor.rowcount
+                    if self.autocommit and not isinstance(query, Select):
+                        connection.commit()
+                finally:
+                    cursor.close()
+        finally:
+            # once the transaction is over, committed or rolled back when the connection is given back,
+            # so that the readers don't cache rows from before it; also when it failed, the write may be done
+            if self.result_cache is not None:
+                self.result_cache.invalidate_query(query)
+        if _execute_hooks:
+            _run_hooks(_execute_hooks, query, sql, args, _timer() - started, _row_count(fetch, result))
+        return result
+
+    def execute(self, query):
+        """Run any query and return the affected row count."""
+        return self._run(query, None)
+
+    def fetch_all(self, query):
+        return self._run(query, "all")
+
+    def fetch_one(self, query):
+        return self._run(query, "one")
+
+    def stream(self, query, batch_size=1000):
+        """Iterate the rows of a Select, holding a pooled connection until the generator is exhausted or closed."""
+        assert isinstance(query, Select)
+        if self.optimize:
+            query = query.optimized()
+        if query.never_matches():
+            return
+        sql, args = query.sql(self.pool.placeholder, self.dialect)
+        started = _timer()
+        rows = 0
+        with self.pool.connection() as connection:
+            for row in stream(connection, sql, args, batch_size):
+                rows += 1
+                yield row
+        if _execute_hooks:
+            _run_hooks(_execute_hooks, query, sql, args, _timer() - started, rows)
@@ -0,0 +1,304 @@
+# coding: utf-8
+"""
+Strategies for very large IN / NOT IN lists.
+
+`InListStrategy.plan(query)` looks for the largest literal IN / NOT IN list in the WHERE clause of a
+Select, Update or Delete and, depending on its length, keeps it inline, splits it into bounded chunks
+(several statements or an OR of chunks), or rewrites it against a VALUES derived table or a temporary
+table. The returned `InListPlan` holds the statement(s) to run and what was chosen, `run(cursor)`
+runs them and drops the temporary table even when one fails.
+
+Statements are rendered for the `dialect` given to `plan`, MySQL by default. Temporary tables are named
+after `temp_table` and a sequence number, so that the plans run on one connection don't collide.
+"""
+import collections
+import copy
+import itertools
+
+import six
+
+from .dialects import MYSQL, Dialect
+from .sql import (Condition, ConditionUnion, Count, Delete, InsertMany, Max, Min, Select, Table, TableJoin, Update,
+                  ValuesTable, _Compiler)
+
+PlannedStatement = collections.namedtuple("PlannedStatement", ["sql", "args", "role"])
+
+# numbers the temporary tables of the process
+_temp_tables = itertools.count(1)
+
+
+class InListPlan(object):
+    ROLE_SETUP = "setup"
+    ROLE_QUERY = "query"
+    ROLE_CLEANUP = "cleanup"
+
+    def __init__(self, strategy, condition, size, chunks, statements, rewrite=None):
+        self.strategy = strategy
+        self.condition = condition
+        self.size = size
+        self.chunks = chunks
+        self.statements = statements
+        # "join" or "subquery" for the VALUES / temporary table strategies
+        self.rewrite = rewrite
+
+    @property
+    def queries(self):
+        """The statements whose results make up the result of the original query."""
+        return [each for each in self.statements if each.role == InListPlan.ROLE_QUERY]
+
+    def __repr__(self):
+        return "<InListPlan strategy={} size={:d} chunks={:d} statements={:d}{}>".format(
+            self.strategy, self.size, self.chunks, len(self.statements),
+            " rewrite={}".format(self.rewrite) if self.rewrite else "")
+
+    def run(self, cursor):
+        """
+        Run the statements on a DB-API cursor. Returns the rows of the queries of a Select, else the
+        number of rows they changed. The cleanup statements run whether the others succeed or not.
+        """
+        rows = []
+        changed = 0
+        selected = False
+        failed = True
+        try:
+            for sql, args, role in self.statements:
+                if role == InListPlan.ROLE_CLEANUP:
+                    continue
+                cursor.execute(sql, args)
+                if role != InListPlan.ROLE_QUERY:
+                    continue
+                if cursor.description is not None:
+                    selected = True
+                    rows.extend(cursor.fetchall())
+                elif cursor.rowcount > 0:
+                    changed += cursor.rowcount
+            failed = False
+        finally:
+            for sql, args, role in self.statements:
+                if role != InListPlan.ROLE_CLEANUP:
+                    continue
+                try:
+                    cursor.execute(sql, args)
+                except Exception:
+                    # the first error tells what went wrong, e.g. PostgreSQL refuses any statement once
+                    # the transaction failed, and rolling it back drops the table anyway
+                    if not failed:
+                        raise
+        return rows if selected else changed
+
+
+class InListStrategy(object):
+    INLINE = "inline"
+    OR_CHUNKS = "or_chunks"
+    SPLIT = "split"
+    VALUES = "values"
+    TEMP_TABLE = "temp_table"
+    strategies = [
+        INLINE,
+        OR_CHUNKS,
+        SPLIT,
+        VALUES,
+        TEMP_TABLE
+    ]
+
+    def __init__(self, chunk_size=1000, join_threshold=10000, join_method=TEMP_TABLE, prefer_split=True,
+                 temp_table="_in_list", column_type=None, insert_rows=InsertMany.MAX_ROWS,
+                 max_packet_size=InsertMany.MAX_PACKET_SIZE):
+        """
+        :param chunk_size: lists up to this length stay inline, longer ones are cut in chunks of this size
+        :param join_threshold: lists longer than this are rewritten with `join_method`
+        :param join_method: VALUES or TEMP_TABLE
+        :param prefer_split: split into several statements rather than an OR of chunks when that's safe
+        :param temp_table: prefix of the names of the temporary tables, also used as alias of the VALUES table
+        :param column_type: SQL type of the temporary table column, guessed from the values by default
+        """
+        assert chunk_size > 0
+        assert join_threshold >= chunk_size
+        assert join_method in (InListStrategy.VALUES, InListStrategy.TEMP_TABLE)
+        self.chunk_size = chunk_size
+        self.join_threshold = join_threshold
+        self.join_method = join_method
+        self.prefer_split = prefer_split
+        self.temp_table = temp_table
+        self.column_type = column_type
+        self.insert_rows = insert_rows
+        self.max_packet_size = max_packet_size
+
+    def plan(self, query, placeholder="%s", strategy=None, dialect=None):
+        """The plan of a query, rendered with `placeholder`, or for `dialect`, a `Dialect`, when given."""
+        assert isinstance(query, (Select, Update, Delete))
+        assert strategy is None or strategy in self.strategies
+        if dialect is not None and not isinstance(dialect, Dialect):
+            raise ValueError("{!r} isn't a dialect of sql_builder.dialects".format(dialect))
+        if dialect is not None:
+            placeholder = dialect.placeholder
+        cond = _largest_in_list(query._where)
+        if cond is None:
+            return InListPlan(InListStrategy.INLINE, None, 0, 0, [_query_statement(query, placeholder, dialect)])
+        size = len(cond.value)
+        if strategy is None:
+            strategy = self._choose(query, cond, size)
+        if strategy == InListStrategy.SPLIT and not _splittable(query, cond):
+            raise ValueError("the IN list can't be split into several statements")
+        if strategy == InListStrategy.INLINE:
+            return InListPlan(strategy, cond, size, 1, [_query_statement(query, placeholder, dialect)])
+        if strategy in (InListStrategy.OR_CHUNKS, InListStrategy.SPLIT):
+            return self._plan_chunks(query, cond, strategy, placeholder, dialect)
+        return self._plan_join(query, cond, strategy, placeholder, dialect)
+
+    def _choose(self, query, cond, size):
+        if size <= self.chunk_size:
+            return InListStrategy.INLINE
+        if size > self.join_threshold:
+            return self.join_method
+        if self.prefer_split and _splittable(query, cond):
+            return InListStrategy.SPLIT
+        return InListStrategy.OR_CHUNKS
+
+    def _chunks(self, values):
+        values = list(values)
+        return [values[i:i + self.chunk_size] for i in range(0, len(values), self.chunk_size)]
+
+    def _plan_chunks(self, query, cond, strategy, placeholder, dialect):
+        chunks = self._chunks(cond.value)
+        if strategy == InListStrategy.SPLIT:
+            statements = [_query_statement(_with_where(query, _replace(query._where, cond,
+                                                                       Condition(cond.column, cond.op, chunk))),
+                                           placeholder, dialect)
+                          for chunk in chunks]
+        else:
+            # NOT IN chunks must all hold, IN chunks any of them
+            op = ConditionUnion.OP_OR if cond.op == Condition.OP_IN else ConditionUnion.OP_AND
+            union = ConditionUnion._from_list([Condition(cond.column, cond.op, chunk) for chunk in chunks], op)
+            statements = [_query_statement(_with_where(query, _replace(query._where, cond, union)), placeholder,
+                                           dialect)]
+        return InListPlan(strategy, cond, len(cond.value), len(chunks), statements)
+
+    def _plan_join(self, query, cond, strategy, placeholder, dialect):
+        values = _unique(cond.value)
+        setup = []
+        cleanup = []
+        if strategy == InListStrategy.VALUES:
+            table = ValuesTable(self.temp_table, values)
+            column = table.column_0
+        else:
+            table = Table("{}_{:d}".format(self.temp_table, next(_temp_tables)))
+            column = table.v
+            syntax = dialect or MYSQL
+            c = _Compiler(placeholder, dialect)
+            create = syntax.create_temp_table.format(table=table._raw(c), column=c.ident(column.name),
+                                                     type=self._column_type(values))
+            drop = syntax.drop_temp_table.format(table=table._raw(c))
+            setup.append(PlannedStatement(create, [], InListPlan.ROLE_SETUP))
+            for sql, args in InsertMany(table, [column], [(value,) for value in values]).statements(
+                    placeholder, max_rows=self.insert_rows, max_packet_size=self.max_packet_size, dialect=dialect):
+                setup.append(PlannedStatement(sql, args, InListPlan.ROLE_SETUP))
+            cleanup.append(PlannedStatement(drop, [], InListPlan.ROLE_CLEANUP))
+        if _joinable(query, cond):
+            rewritten = copy.copy(query)
+            rewritten._tables = TableJoin(query._tables).inner_join(table, column == cond.column)
+            rewritten._where = _remove(query._where, cond)
+            rewrite = "join"
+        else:
+            sub_query = Select(table).select(column)
+            rewritten = _with_where(query, _replace(query._where, cond, Condition(cond.column, cond.op, sub_query)))
+            rewrite = "subquery"
+        statements = setup + [_query_statement(rewritten, placeholder, dialect)] + cleanup
+        return InListPlan(strategy, cond, len(cond.value), 1, statements, rewrite)
+
+    def _column_type(self, values):
+        if self.column_type:
+            return self.column_type
+        if all(isinstance(value, six.integer_types) and not isinstance(value, bool) for value in values):
+            return "BIGINT PRIMARY KEY"
+        width = max(len(value) if isinstance(value, (six.text_type, six.binary_type)) else len(str(value))
+                    for value in values)
+        if width <= 191:
+            return "VARCHAR({:d}) PRIMARY KEY".format(max(width, 1))
+        return "VARCHAR({:d})".format(width)
+
+
+def _query_statement(query, placeholder, dialect=None):
+    sql, args = query.sql(placeholder, dialect)
+    return PlannedStatement(sql, args, InListPlan.ROLE_QUERY)
+
+
+def _unique(values):
+    seen = set()
+    unique = []
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            unique.append(value)
+    return unique
+
+
+def _largest_in_list(where):
+    found = None
+    stack = [where] if where is not None else []
+    while stack:
+        item = stack.pop()
+        if isinstance(item, ConditionUnion):
+            stack.extend(item.conds)
+        elif isinstance(item, Condition) and item.op in (Condition.OP_IN, Condition.OP_NIN) and \
+                isinstance(item.value, (list, tuple)):
+            if found is None or len(item.value) > len(found.value):
+                found = item
+    return found
+
+
+def _is_conjunct(where, cond):
+    if where is cond:
+        return True
+    return isinstance(where, ConditionUnion) and where.op == ConditionUnion.OP_AND and \
+        any(each is cond for each in where.conds)
+
+
+def _has_aggregate(query):
+    return any(isinstance(field, (Max, Min, Count)) for field in query._fields)
+
+
+def _splittable(query, cond):
+    """Whether running one statement per chunk and concatenating the results is equivalent."""
+    if cond.op != Condition.OP_IN or not _is_conjunct(query._where, cond):
+        return False
+    if isinstance(query, Select):
+        return not (query._sort or query._group or query._count or _has_aggregate(query))
+    return True
+
+
+def _joinable(query, cond):
+    # an explicit field list keeps the columns of the joined table out of the result
+    return isinstance(query, Select) and cond.op == Condition.OP_IN and bool(query._fields) and \
+        _is_conjunct(query._where, cond)
+
+
+def _with_where(query, where):
+    query = copy.copy(query)
+    query._where = where
+    return query
+
+
+def _replace(where, target, replacement):
+    if where is target:
+        return replacement
+    if not isinstance(where, ConditionUnion):
+        return where
+    conds = []
+    for each in where.conds:
+        each = _replace(each, target, replacement)
+        if isinstance(each, ConditionUnion) and each.op == where.op:
+            conds.extend(each.conds)
+        else:
+            conds.append(each)
+    return ConditionUnion._from_list(conds, where.op)
+
+
+def _remove(where, target):
+    """Drop a top-level conjunct from the WHERE clause."""
+    if where is target:
+        return None
+    conds = [each for each in where.conds if each is not target]
+    if len(conds) == 1:
+        return conds[0]
+    return ConditionUnion._from_list(conds, where.op)
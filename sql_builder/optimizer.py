@@ -0,0 +1,383 @@
+# coding: utf-8
+"""
+Normalization of WHERE clauses assembled from optional filters.
+
+    query, report = optimize(student.select().where(cond))
+    print(report)  # <OptimizeReport terms=9->4 flatten=1 dedupe=1 in_merge=1 range=1>
+
+The Condition / ConditionUnion tree of the WHERE clause of a Select, Update or Delete is rewritten
+bottom-up:
+
+- nested ANDs and ORs are flattened, `EmptyCond`s dropped and `TrueCond` / `FalseCond` terms absorbed,
+- repeated terms are dropped, and so are repeated values of IN lists,
+- `a = 1 OR a = 2 OR a IN (3, 4)` becomes `a IN (1, 2, 3, 4)`,
+- the comparisons ANDed on one column are intersected: `age >= 20 AND age >= 18` becomes `age >= 20`
+  and `a IN (1, 5, 9) AND a > 3 AND a != 9` becomes `a = 5`,
+- a conjunction no row satisfies, e.g. `a = 1 AND a = 2` or `age > 30 AND age < 20`, becomes a
+  `FalseCond`: `never_matches()` of the query is then true and the executors return an empty result
+  without running it.
+
+Ranges and contradictions are only derived from numbers, dates and times: how strings compare depends
+on the collation of the column. `query.optimized()` and `Executor(pool, optimize=True)` run the pass
+before `sql()`.
+"""
+import collections
+import datetime
+import decimal
+import numbers
+
+from .sql import (BindParam, Column, Condition, ConditionUnion, EmptyCond, FalseCond, RowCondition, TrueCond, _Query,
+                  _Where)
+
+FLATTEN = "flatten"
+DEDUPE = "dedupe"
+IN_MERGE = "in_merge"
+RANGE = "range"
+CONTRADICTION = "contradiction"
+kinds = [
+    FLATTEN,
+    DEDUPE,
+    IN_MERGE,
+    RANGE,
+    CONTRADICTION
+]
+
+# `column` is the column the rewrite is about, if any, `before` / `after` count the terms involved
+Rewrite = collections.namedtuple("Rewrite", ["kind", "column", "before", "after"])
+
+_COMPARISONS = frozenset([Condition.OP_EQ, Condition.OP_NE, Condition.OP_GE, Condition.OP_GT, Condition.OP_LE,
+                          Condition.OP_LT])
+_LISTS = frozenset([Condition.OP_IN, Condition.OP_NIN])
+
+
+class OptimizeReport(object):
+    def __init__(self):
+        self.rewrites = []
+        self.terms_before = 0
+        self.terms_after = 0
+
+    @property
+    def changed(self):
+        return bool(self.rewrites)
+
+    @property
+    def contradiction(self):
+        """Whether the clause was found to match no row."""
+        return any(each.kind == CONTRADICTION for each in self.rewrites)
+
+    def counts(self):
+        """Number of rewrites per kind, in the order of `kinds`."""
+        counts = collections.OrderedDict((kind, 0) for kind in kinds)
+        for each in self.rewrites:
+            counts[each.kind] += 1
+        return counts
+
+    def _add(self, kind, column, before, after):
+        self.rewrites.append(Rewrite(kind, column, before, after))
+
+    def __repr__(self):
+        return "<OptimizeReport terms={:d}->{:d}{}>".format(
+            self.terms_before, self.terms_after,
+            "".join(" {}={:d}".format(kind, count) for kind, count in self.counts().items() if count))
+
+
+def _terms(where):
+    if where is None or where.is_empty():
+        return 0
+    if isinstance(where, ConditionUnion):
+        return sum(_terms(each) for each in where.conds)
+    return 1
+
+
+def _value_key(value):
+    """A hashable key telling equal values apart from merely equal-looking ones, e.g. 1 and "1"."""
+    if isinstance(value, (list, tuple)):
+        return ("list",) + tuple(_value_key(each) for each in value)
+    if isinstance(value, Column):
+        return "column", value.where_view
+    if isinstance(value, BindParam):
+        return "bind", value.name, value.size
+    try:
+        hash(value)
+    except TypeError:
+        return "id", id(value)
+    return "value", type(value), value
+
+
+def _term_key(cond):
+    if isinstance(cond, Condition):
+        return "cond", cond.column.where_view, cond.op, _value_key(cond.value)
+    if isinstance(cond, RowCondition):
+        return "row", tuple(col.where_view for col in cond.columns), cond.op, _value_key(cond.values)
+    if isinstance(cond, ConditionUnion):
+        return (cond.op,) + tuple(_term_key(each) for each in cond.conds)
+    return "id", id(cond)
+
+
+def _is_literal(value):
+    if value is None or isinstance(value, (Column, BindParam, _Where, _Query, list, tuple, dict)):
+        return False
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _order_class(value):
+    """Values of the same class can be ordered the way the database orders them, None for the others."""
+    if isinstance(value, (numbers.Real, decimal.Decimal)):
+        # NaN compares false to everything
+        return "number" if value == value else None
+    for cls in (datetime.datetime, datetime.date, datetime.time, datetime.timedelta):
+        if isinstance(value, cls):
+            return cls
+    return None
+
+
+def _values(cond):
+    return cond.value if cond.op in _LISTS else (cond.value,)
+
+
+def _unique(values):
+    seen = set()
+    unique = []
+    for value in values:
+        key = _value_key(value)
+        if key not in seen:
+            seen.add(key)
+            unique.append(value)
+    return unique
+
+
+def _is_in_term(cond):
+    """`col = value` or `col IN (values)`, with literal values."""
+    if not isinstance(cond, Condition):
+        return False
+    if cond.op == Condition.OP_EQ:
+        return _is_literal(cond.value)
+    return cond.op == Condition.OP_IN and isinstance(cond.value, (list, tuple)) and \
+        all(_is_literal(value) for value in cond.value)
+
+
+def _is_range_term(cond):
+    """A comparison, IN or NOT IN of a column with literal values."""
+    if not isinstance(cond, Condition):
+        return False
+    if cond.op in _COMPARISONS:
+        return _is_literal(cond.value)
+    return cond.op in _LISTS and isinstance(cond.value, (list, tuple)) and \
+        all(_is_literal(value) for value in cond.value)
+
+
+class _Optimizer(object):
+    def __init__(self, report):
+        self.report = report
+
+    def run(self, where):
+        self.report.terms_before = _terms(where)
+        result = self._visit(where)
+        self.report.terms_after = _terms(result)
+        return result
+
+    def _visit(self, where):
+        """The rewritten condition, `where` itself when unchanged, None for no condition."""
+        if where is None or where.is_empty():
+            return None
+        if isinstance(where, ConditionUnion):
+            return self._visit_union(where)
+        if isinstance(where, Condition) and where.op in _LISTS and isinstance(where.value, (list, tuple)):
+            values = _unique(where.value)
+            if len(values) < len(where.value):
+                self.report._add(DEDUPE, where.column.where_view, len(where.value), len(values))
+                return Condition(where.column, where.op, values)
+        return where
+
+    def _visit_union(self, union):
+        conds = []
+        for each in union.conds:
+            visited = self._visit(each)
+            if visited is None:
+                self.report._add(FLATTEN, None, 1, 0)
+            elif isinstance(visited, ConditionUnion) and visited.op == union.op:
+                self.report._add(FLATTEN, None, len(visited.conds), len(visited.conds))
+                conds.extend(visited.conds)
+            else:
+                conds.append(visited)
+        if union.op == ConditionUnion.OP_AND:
+            if any(isinstance(each, FalseCond) for each in conds):
+                return FalseCond()
+            conds = [each for each in conds if not isinstance(each, TrueCond)]
+            if not conds:
+                return TrueCond()
+            conds = self._intersect(self._dedupe(conds))
+        else:
+            if any(isinstance(each, TrueCond) for each in conds):
+                return TrueCond()
+            conds = [each for each in conds if not isinstance(each, FalseCond)]
+            if not conds:
+                return FalseCond()
+            conds = self._merge_in(self._dedupe(conds))
+        if len(conds) == 1:
+            return conds[0]
+        if not conds:
+            return None
+        if len(conds) == union._size and all(a is b for a, b in zip(conds, union.conds)):
+            return union
+        return ConditionUnion._from_list(conds, union.op)
+
+    def _dedupe(self, conds):
+        seen = set()
+        unique = []
+        for cond in conds:
+            key = _term_key(cond)
+            if key not in seen:
+                seen.add(key)
+                unique.append(cond)
+        if len(unique) < len(conds):
+            self.report._add(DEDUPE, None, len(conds), len(unique))
+        return unique
+
+    def _merge_in(self, conds):
+        """`a = 1 OR a IN (2, 3)` -> `a IN (1, 2, 3)`."""
+        groups = collections.OrderedDict()
+        for i, cond in enumerate(conds):
+            if _is_in_term(cond):
+                groups.setdefault(cond.column.where_view, []).append(i)
+        replaced = {}
+        for view, indexes in groups.items():
+            if len(indexes) < 2:
+                continue
+            values = _unique(value for i in indexes for value in _values(conds[i]))
+            column = conds[indexes[0]].column
+            if len(values) == 1:
+                merged = Condition(column, Condition.OP_EQ, values[0])
+            else:
+                merged = Condition(column, Condition.OP_IN, values)
+            self.report._add(IN_MERGE, view, len(indexes), 1)
+            replaced[indexes[0]] = [merged]
+            for i in indexes[1:]:
+                replaced[i] = []
+        if not replaced:
+            return conds
+        return [each for i, cond in enumerate(conds) for each in replaced.get(i, [cond])]
+
+    def _intersect(self, conds):
+        """Reduce the comparisons ANDed on each column, [FalseCond] if they can't all hold."""
+        groups = collections.OrderedDict()
+        for i, cond in enumerate(conds):
+            if _is_range_term(cond):
+                groups.setdefault(cond.column.where_view, []).append(i)
+        replaced = {}
+        for view, indexes in groups.items():
+            terms = [conds[i] for i in indexes]
+            classes = set(_order_class(value) for term in terms for value in _values(term))
+            if len(terms) < 2 or len(classes) != 1 or None in classes:
+                continue
+            try:
+                reduced = _reduce(terms)
+            except TypeError:
+                # e.g. naive and aware datetimes
+                continue
+            if reduced is None:
+                self.report._add(CONTRADICTION, view, len(terms), 0)
+                return [FalseCond()]
+            if len(reduced) == len(terms):
+                continue
+            self.report._add(RANGE, view, len(terms), len(reduced))
+            replaced[indexes[0]] = reduced
+            for i in indexes[1:]:
+                replaced[i] = []
+        if not replaced:
+            return conds
+        return [each for i, cond in enumerate(conds) for each in replaced.get(i, [cond])]
+
+
+def _reduce(terms):
+    """The fewest conditions equivalent to the AND of `terms` on one column, None if they can't all hold."""
+    column = terms[0].column
+    equal = None
+    in_values = None
+    lower = upper = None
+    excluded = []
+    for cond in terms:
+        op = cond.op
+        value = cond.value
+        if op == Condition.OP_EQ:
+            if equal is None:
+                equal = cond
+            elif equal.value != value:
+                return None
+        elif op == Condition.OP_IN:
+            if in_values is None:
+                in_values = list(value)
+            else:
+                values = set(value)
+                in_values = [each for each in in_values if each in values]
+        elif op == Condition.OP_NE:
+            excluded.append(value)
+        elif op == Condition.OP_NIN:
+            excluded.extend(value)
+        elif op in (Condition.OP_GE, Condition.OP_GT):
+            if lower is None or value > lower.value or value == lower.value and op == Condition.OP_GT:
+                lower = cond
+        elif upper is None or value < upper.value or value == upper.value and op == Condition.OP_LT:
+            upper = cond
+
+    def in_range(value):
+        if lower is not None and (value < lower.value or value == lower.value and lower.op == Condition.OP_GT):
+            return False
+        return upper is None or not (value > upper.value or value == upper.value and upper.op == Condition.OP_LT)
+
+    excluded_set = set(excluded)
+    if equal is not None:
+        if in_values is not None and equal.value not in in_values:
+            return None
+        candidates = [equal.value]
+    elif in_values is not None:
+        candidates = in_values
+    elif lower is not None and upper is not None and lower.value == upper.value:
+        # `a >= 3 AND a <= 3`, or empty when either is strict
+        candidates = [lower.value]
+    else:
+        candidates = None
+    if candidates is not None:
+        kept = [value for value in candidates if in_range(value) and value not in excluded_set]
+        if not kept:
+            return None
+        if equal is not None:
+            return [equal]
+        if len(kept) == 1:
+            return [Condition(column, Condition.OP_EQ, kept[0])]
+        return [Condition(column, Condition.OP_IN, kept)]
+    if lower is not None and upper is not None and lower.value > upper.value:
+        return None
+    reduced = [each for each in (lower, upper) if each is not None]
+    # exclusions outside of the range are implied by it
+    kept = _unique(value for value in excluded if in_range(value))
+    if len(kept) == 1:
+        reduced.append(Condition(column, Condition.OP_NE, kept[0]))
+    elif kept:
+        reduced.append(Condition(column, Condition.OP_NIN, kept))
+    return reduced
+
+
+def optimize(target):
+    """
+    Normalize a WHERE clause, or the WHERE clause of a query. Returns the rewritten clause or query and an
+    OptimizeReport, the original is left untouched. A query is returned as is when nothing changed.
+    """
+    report = OptimizeReport()
+    if isinstance(target, _Query):
+        where = getattr(target, "_where", None)
+        if where is None:
+            return target, report
+        rewritten = _Optimizer(report).run(where)
+        if rewritten is where:
+            return target, report
+        query = target._copy()
+        query._where = rewritten
+        return query, report
+    assert target is None or isinstance(target, _Where)
+    rewritten = _Optimizer(report).run(target)
+    return (EmptyCond() if rewritten is None else rewritten), report
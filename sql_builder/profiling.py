@@ -0,0 +1,138 @@
+# coding: utf-8
+"""
+Timing of statement building and execution.
+
+    profiler = QueryProfiler()
+    with profiling.hooked(profiler):
+        handle_request()
+    print(profiler.report(10))
+
+Callbacks registered with `add_hook` get a `QueryEvent` after every `sql()` of a statement (phase
+BUILD) and after every execution by an `Executor` or an asyncio pool (phase EXECUTE). With no callback
+registered the only cost is a check of an empty list.
+"""
+import collections
+import contextlib
+import threading
+
+from . import sql as _sql
+
+BUILD = "build"
+EXECUTE = "execute"
+
+# `statement` is the class name of the query, `shape_id` identifies its shape within the process,
+# `rows` is None for BUILD and the row count returned or affected for EXECUTE
+QueryEvent = collections.namedtuple("QueryEvent", ["phase", "statement", "shape_id", "arg_count", "sql_length",
+                                                   "duration", "rows", "sql", "query"])
+
+_lock = threading.Lock()
+_registered = {}
+
+
+def shape_id(query):
+    """Identifier of the shape of a query: same statement text for any values. Not stable across processes."""
+    return "{:016x}".format(hash(query._shape()) & 0xffffffffffffffff)
+
+
+def _event_hook(callback, phase):
+    def hook(query, sql, args, duration, rows):
+        callback(QueryEvent(phase, type(query).__name__, shape_id(query), len(args), len(sql), duration, rows, sql,
+                            query))
+
+    return hook
+
+
+def add_hook(callback, build=True, execute=True):
+    """Call `callback(event)` for the phases enabled. A callback is registered at most once."""
+    assert build or execute
+    with _lock:
+        assert callback not in _registered, "already registered"
+        hooks = []
+        if build:
+            hooks.append((_sql._build_hooks, _event_hook(callback, BUILD)))
+        if execute:
+            hooks.append((_sql._execute_hooks, _event_hook(callback, EXECUTE)))
+        for hook_list, hook in hooks:
+            hook_list.append(hook)
+        _registered[callback] = hooks
+
+
+def remove_hook(callback):
+    with _lock:
+        for hook_list, hook in _registered.pop(callback, []):
+            hook_list.remove(hook)
+
+
+@contextlib.contextmanager
+def hooked(callback, build=True, execute=True):
+    """Register `callback` for the duration of the block."""
+    add_hook(callback, build, execute)
+    try:
+        yield callback
+    finally:
+        remove_hook(callback)
+
+
+ShapeStats = collections.namedtuple("ShapeStats", ["phase", "statement", "shape_id", "calls", "total", "mean",
+                                                   "max", "rows", "arg_count", "sql"])
+
+
+class QueryProfiler(object):
+    """
+    A callback for `add_hook` that aggregates the events per phase and shape. At most `max_shapes`
+    shapes are tracked, the events of the others only count in `dropped`.
+    """
+
+    def __init__(self, max_shapes=1000, sql_length=200):
+        self.max_shapes = max_shapes
+        self.sql_length = sql_length
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, event):
+        key = (event.phase, event.shape_id)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_shapes:
+                    self.dropped += 1
+                    return
+                # calls, total, max, rows, statement, arg count, sample sql
+                stats = self._stats[key] = [0, 0.0, 0.0, 0, event.statement, event.arg_count,
+                                            event.sql[:self.sql_length]]
+            stats[0] += 1
+            stats[1] += event.duration
+            stats[2] = max(stats[2], event.duration)
+            stats[3] += event.rows or 0
+
+    def stats(self, phase=None):
+        with self._lock:
+            items = [(key, list(stats)) for key, stats in self._stats.items()]
+        return [ShapeStats(key[0], stats[4], key[1], stats[0], stats[1], stats[1] / stats[0], stats[2], stats[3],
+                           stats[5], stats[6])
+                for key, stats in items if phase is None or key[0] == phase]
+
+    def top(self, n=10, phase=EXECUTE, by="total"):
+        """The `n` shapes with the largest `by` ("total", "mean", "max" or "calls")."""
+        assert by in ("total", "mean", "max", "calls")
+        return sorted(self.stats(phase), key=lambda each: getattr(each, by), reverse=True)[:n]
+
+    def report(self, n=10, by="total"):
+        lines = []
+        for phase in (BUILD, EXECUTE):
+            top = self.top(n, phase, by)
+            if not top:
+                continue
+            lines.append("{} (top {:d} by {})".format(phase, len(top), by))
+            lines.append("{:>8} {:>12} {:>12} {:>12}  {:<16} {}".format("calls", "total ms", "mean ms", "max ms",
+                                                                          "statement", "sql"))
+            for each in top:
+                lines.append("{:>8d} {:>12.3f} {:>12.3f} {:>12.3f}  {:<16} {}".format(
+                    each.calls, each.total * 1000, each.mean * 1000, each.max * 1000, each.statement, each.sql))
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.dropped = 0
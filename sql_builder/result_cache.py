@@ -0,0 +1,291 @@
+# coding: utf-8
+"""
+Results of read-mostly Selects kept in memory, in front of execution.
+
+    cache = ResultCache(maxsize=10000, ttl=60.0, max_bytes=64 * 1024 * 1024)
+    executor = Executor(pool, result_cache=cache)
+    executor.fetch_all(teacher.select().where(teacher.id == 3))  # run once, then served from the cache
+    executor.execute(teacher.update(name="x").where(teacher.id == 3))  # drops the cached teacher results
+
+Results are keyed by the SQL text and args, and tagged with every table the Select reads: its FROM
+tables, joined tables and the tables of its sub-queries. An Insert, InsertMany, Update, UpdateMany,
+Delete or InsertFromSelect run by the executor drops the results of the tables it writes. With
+`install()` the writes run by any executor or asyncio pool do too. Entries are dropped when their
+`ttl` has passed, and least recently used ones when there are more than `maxsize` entries or when
+their estimated size goes over `max_bytes`.
+
+Concurrent misses on the same key run the query once, the other callers wait for its result. A load
+that is still running when its tables are written isn't cached, it may have read the old rows.
+Cached rows are shared by the callers, they mustn't be changed in place.
+"""
+import collections
+import sys
+import threading
+
+import six
+
+from . import profiling
+from .sql import (Condition, ConditionUnion, Delete, Insert, InsertFromSelect, InsertMany, Select, Table, TableJoin,
+                  Update, UpdateMany, _Query, _SubQueryTable, _timer)
+
+_WRITES = (Insert, InsertMany, InsertFromSelect, Update, UpdateMany, Delete)
+
+
+def table_tag(table):
+    """The name a table is tagged with, its alias aside: `name` or `db.name`."""
+    if isinstance(table, six.string_types):
+        return table
+    assert isinstance(table, Table)
+    if table._b_db:
+        return "{}.{}".format(table._b_db, table._b_name)
+    return table._b_name
+
+
+def read_tables(query):
+    """The tags of the tables a query reads: FROM, joins and the sub-queries in them and in WHERE."""
+    tags = set()
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Table):
+            tags.add(table_tag(node))
+        elif isinstance(node, TableJoin):
+            stack.append(node.base)
+            for each in node.join_items:
+                stack.append(each.table)
+                stack.append(each.condition)
+        elif isinstance(node, _SubQueryTable):
+            stack.append(node._query)
+        elif isinstance(node, ConditionUnion):
+            stack.extend(node.conds)
+        elif isinstance(node, Condition):
+            if isinstance(node.value, Select):
+                stack.append(node.value)
+        elif isinstance(node, InsertFromSelect):
+            stack.append(node._sub_query)
+        elif isinstance(node, _Query):
+            stack.append(node._tables)
+            if getattr(node, "_where", None) is not None:
+                stack.append(node._where)
+    return frozenset(tags)
+
+
+def written_tables(query):
+    """The tags of the tables a write changes, empty for a Select."""
+    if not isinstance(query, _WRITES):
+        return frozenset()
+    # the FROM of a Delete may be a join, all its tables are taken
+    return read_tables(query._tables)
+
+
+def _size_of(value):
+    """Rough size in memory of a result: the list of rows, the rows and the values in them."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return size
+    for each in value:
+        size += _size_of(each)
+    return size
+
+
+class _Flight(object):
+    """A load of a key in progress, the callers missing the same key wait on it."""
+    __slots__ = ("tags", "done", "result", "error", "stale")
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # set when the tables are written while loading
+        self.stale = False
+
+
+_Entry = collections.namedtuple("_Entry", ["value", "tags", "size", "expires"])
+
+
+class ResultCache(object):
+    """
+    A thread-safe LRU cache of query results with a TTL and a byte budget, see the module docstring.
+    `ttl` is in seconds, None to keep results until they're evicted or invalidated.
+    """
+    CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "waits", "evictions", "expirations",
+                                                     "invalidations", "maxsize", "currsize", "max_bytes",
+                                                     "currbytes"])
+
+    def __init__(self, maxsize=10000, ttl=60.0, max_bytes=64 * 1024 * 1024):
+        assert maxsize > 0 and max_bytes > 0
+        assert ttl is None or ttl > 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        # tag -> keys of the entries tagged with it
+        self._tagged = {}
+        self._flights = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # callers that got the result of a load started by another one
+        self.waits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value, tags=(), ttl=None):
+        """Cache `value` under `key`, until one of the `tags` is invalidated."""
+        size = _size_of(value)
+        with self._lock:
+            self._store(key, value, frozenset(tags), size, ttl)
+
+    def get_or_load(self, key, tags, load, ttl=None):
+        """
+        The cached value of `key`, else the result of `load()`, cached with `tags`, or what `tags()`
+        returns when it's callable. Only one caller runs `load` for a key at a time, the others get
+        its result or its exception.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry.value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[key] = _Flight(frozenset(tags() if callable(tags) else tags))
+            else:
+                self.waits += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        value = size = None
+        try:
+            flight.result = value = load()
+            size = _size_of(value)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                # stored before the flight is gone, so that no caller loads the key again in between
+                if flight.error is None and not flight.stale:
+                    self._store(key, value, flight.tags, size, ttl)
+            flight.done.set()
+        return value
+
+    def invalidate(self, *tables):
+        """Drop the results reading any of `tables`, Tables or tags. Returns the number of entries dropped."""
+        tags = set(table_tag(table) for table in tables)
+        dropped = 0
+        with self._lock:
+            for tag in tags:
+                for key in self._tagged.pop(tag, ()):
+                    entry = self._data.get(key)
+                    if entry is not None:
+                        self._remove(key)
+                        dropped += 1
+            for key, flight in list(self._flights.items()):
+                if flight.tags & tags:
+                    flight.stale = True
+                    # the next callers load again instead of waiting for what may be old rows
+                    del self._flights[key]
+            self.invalidations += dropped
+        return dropped
+
+    def invalidate_query(self, query):
+        """Drop the results reading the tables that a write query changes."""
+        tags = written_tables(query)
+        if not tags:
+            return 0
+        return self.invalidate(*tags)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tagged.clear()
+            for flight in self._flights.values():
+                flight.stale = True
+            self._flights.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.waits = 0
+            self.evictions = self.expirations = self.invalidations = 0
+
+    def info(self):
+        return ResultCache.CacheInfo(self.hits, self.misses, self.waits, self.evictions, self.expirations,
+                                     self.invalidations, self.maxsize, len(self._data), self.max_bytes, self._bytes)
+
+    def __call__(self, event):
+        if event.phase == profiling.EXECUTE:
+            self.invalidate_query(event.query)
+
+    def install(self):
+        """Invalidate on the writes of all executors and asyncio pools, through `sql_builder.profiling`."""
+        profiling.add_hook(self, build=False)
+
+    def uninstall(self):
+        profiling.remove_hook(self)
+
+    def _lookup(self, key):
+        """The live entry of `key`, made the most recently used. Called with the lock held."""
+        try:
+            entry = self._data.pop(key)
+        except KeyError:
+            return None
+        if entry.expires is not None and entry.expires <= _timer():
+            self._untag(key, entry)
+            self._bytes -= entry.size
+            self.expirations += 1
+            return None
+        self._data[key] = entry
+        return entry
+
+    def _store(self, key, value, tags, size, ttl):
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = _Entry(value, tags, size, None if ttl is None else _timer() + ttl)
+        self._bytes += size
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+        while len(self._data) > self.maxsize or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        self._untag(key, entry)
+
+    def _untag(self, key, entry):
+        for tag in entry.tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
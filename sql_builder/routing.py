@@ -0,0 +1,226 @@
+# coding: utf-8
+"""
+Reads on replicas, writes on the primary.
+
+    router = Router(ConnectionPool(pymysql, host="primary"),
+                    [ConnectionPool(pymysql, host="replica1"), Replica(ConnectionPool(pymysql, host="replica2"), 2)],
+                    sticky_window=2.0)
+    router.fetch_all(student.select())                               # on a replica
+    router.execute(student.update(name="a").where(student.id == 1))  # on the primary
+    router.fetch_all(student.select())                               # on the primary, for 2 seconds
+    router.fetch_all(student.select().use_primary())                 # always on the primary
+
+Selects run on a replica drawn at random, in proportion to its weight divided by its latency and by
+the number of its queries in flight: a replica twice as slow gets half the reads, but still gets some
+and its latency keeps being measured. Latencies are moving averages of the reads run on the replica.
+A replica whose pool times out or is closed is left out for `retry_interval` seconds, and a read tries
+every replica at most once: it goes to the primary when no replica is left.
+
+Everything else runs on the primary. After a write, the reads of the written tables by the same
+session go to the primary for `sticky_window` seconds, so that they see the write whatever the
+replication lag. `router.session()` starts a session, the methods of the router use one per thread.
+"""
+import random
+import threading
+
+from .executor import ConnectionPool, Executor, PoolError
+from .result_cache import read_tables, written_tables
+from .sql import Select, _timer
+
+# weight of the last duration in the latency of a replica
+_DECAY = 0.2
+
+
+class Replica(object):
+    """A replica pool with its weight, and the load and latency that the router balances on."""
+
+    def __init__(self, pool, weight=1.0):
+        assert isinstance(pool, ConnectionPool)
+        assert weight > 0
+        self.pool = pool
+        self.weight = weight
+        # moving average of the durations of the reads in seconds, None until one ran
+        self.latency = None
+        self.in_flight = 0
+        self.reads = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self.executor = None
+
+    def __repr__(self):
+        return "<Replica weight={} latency={} in_flight={:d} reads={:d} failures={:d}>".format(
+            self.weight, self.latency, self.in_flight, self.reads, self.failures)
+
+
+def _draw(replicas):
+    """A replica drawn at random in proportion to its weight over its latency and load."""
+    latencies = [each.latency for each in replicas if each.latency is not None]
+    # replicas that haven't been read yet count as the fastest one
+    unknown = min(latencies) if latencies else 1.0
+    shares = []
+    for each in replicas:
+        latency = unknown if each.latency is None else max(each.latency, 1e-6)
+        shares.append(each.weight / (latency * (each.in_flight + 1)))
+    point = random.uniform(0, sum(shares))
+    for each, share in zip(replicas, shares):
+        point -= share
+        if point <= 0:
+            return each
+    return replicas[-1]
+
+
+class RoutingSession(object):
+    """
+    The queries of one unit of work, e.g. a request: reads of the tables it wrote go to the primary for
+    the `sticky_window` of the router. A session isn't thread-safe.
+    """
+
+    def __init__(self, router):
+        self.router = router
+        # table tag -> time of the last write
+        self._written = {}
+
+    def on_primary(self, query):
+        """Whether the query runs on the primary."""
+        router = self.router
+        if not isinstance(query, Select) or query._primary or not router.replicas:
+            return True
+        if not self._written:
+            return False
+        now = _timer()
+        self._written = dict((tag, at) for tag, at in self._written.items() if now - at < router.sticky_window)
+        return any(tag in self._written for tag in read_tables(query))
+
+    def _route(self, method, query, *args):
+        if not self.on_primary(query):
+            return self.router._read(method, query, *args)
+        try:
+            return getattr(self.router.primary, method)(query, *args)
+        finally:
+            # also when it fails, the write may have been done
+            if self.router.sticky_window:
+                now = _timer()
+                for tag in written_tables(query):
+                    self._written[tag] = now
+
+    def execute(self, query):
+        return self._route("execute", query)
+
+    def fetch_all(self, query):
+        return self._route("fetch_all", query)
+
+    def fetch_one(self, query):
+        return self._route("fetch_one", query)
+
+    def stream(self, query, batch_size=1000):
+        if self.on_primary(query):
+            return self.router.primary.stream(query, batch_size)
+        return self.router._stream(query, batch_size)
+
+
+class Router(object):
+    """Sends Selects to the replicas and the other queries to the primary, see the module docstring."""
+
+    def __init__(self, primary, replicas=(), sticky_window=1.0, retry_interval=5.0, **executor_options):
+        """
+        :param primary: ConnectionPool of the primary
+        :param replicas: ConnectionPools or Replicas, a pool has a weight of 1
+        :param sticky_window: seconds during which the reads of a session go to the primary once it has
+            written their tables, 0 to always read on the replicas
+        :param retry_interval: seconds a replica whose pool failed is left out
+        :param executor_options: for the Executor of every pool, e.g. `dialect` or `result_cache`
+        """
+        assert isinstance(primary, ConnectionPool)
+        assert sticky_window >= 0 and retry_interval >= 0
+        self.primary = Executor(primary, **executor_options)
+        self.replicas = [each if isinstance(each, Replica) else Replica(each) for each in replicas]
+        for replica in self.replicas:
+            replica.executor = Executor(replica.pool, **executor_options)
+        self.sticky_window = sticky_window
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def session(self):
+        return RoutingSession(self)
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = RoutingSession(self)
+        return session
+
+    def _choose(self, tried=()):
+        """The replica to read on, counted as in flight, or None when all are down or `tried`."""
+        now = _timer()
+        with self._lock:
+            up = [each for each in self.replicas if each.down_until <= now and each not in tried]
+            if not up:
+                return None
+            replica = _draw(up)
+            replica.in_flight += 1
+            return replica
+
+    def _done(self, replica, duration=None, failed=False):
+        with self._lock:
+            replica.in_flight -= 1
+            if failed:
+                replica.failures += 1
+                replica.down_until = _timer() + self.retry_interval
+                return
+            replica.reads += 1
+            if duration is not None:
+                if replica.latency is None:
+                    replica.latency = duration
+                else:
+                    replica.latency += _DECAY * (duration - replica.latency)
+
+    def _read(self, method, query, *args):
+        # each replica is tried once per read, even when retry_interval doesn't leave it out
+        tried = []
+        while True:
+            replica = self._choose(tried)
+            if replica is None:
+                return getattr(self.primary, method)(query, *args)
+            started = _timer()
+            try:
+                result = getattr(replica.executor, method)(query, *args)
+            except PoolError:
+                self._done(replica, failed=True)
+                tried.append(replica)
+                continue
+            except BaseException:
+                self._done(replica)
+                raise
+            self._done(replica, _timer() - started)
+            return result
+
+    def _stream(self, query, batch_size):
+        replica = self._choose()
+        if replica is None:
+            for row in self.primary.stream(query, batch_size):
+                yield row
+            return
+        failed = False
+        try:
+            for row in replica.executor.stream(query, batch_size):
+                yield row
+        except PoolError:
+            failed = True
+            raise
+        finally:
+            # the duration of a stream depends on its reader, it doesn't count in the latency
+            self._done(replica, failed=failed)
+
+    def execute(self, query):
+        """Run a query in the session of the current thread."""
+        return self._session().execute(query)
+
+    def fetch_all(self, query):
+        return self._session().fetch_all(query)
+
+    def fetch_one(self, query):
+        return self._session().fetch_one(query)
+
+    def stream(self, query, batch_size=1000):
+        return self._session().stream(query, batch_size)
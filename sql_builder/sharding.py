@@ -0,0 +1,377 @@
+# coding: utf-8
+"""
+Tables split across shards by a key column.
+
+    orders = ShardedTable("orders", key="user_id", shards=4)
+    router = ShardRouter([Executor(pool) for pool in shard_pools])
+    router.execute(orders.insert(id=1, user_id=42, total=10))                 # on shard 42 % 4
+    router.fetch_all(orders.select().where(orders.user_id.in_([1, 2, 5])))    # shard 1 for 1 and 5, 2 for 2
+    router.fetch_all(orders.select(orders.id, orders.total).desc(orders.total)[0:20])  # all shards
+
+The shards a query touches are read from its WHERE clause: `key = value` and `key IN (...)` pick
+shards, AND intersects them, OR joins them, anything else on the key or no condition on it means all
+shards. The IN lists on the key are split, every shard only gets its own values. Sharded tables
+joined in a query are expected to be sharded alike, joined tables that aren't sharded to be copied on
+every shard.
+
+The statements of a query run in parallel on a thread pool, one per shard. The rows of a Select are
+merged in the order of its ORDER BY (the ORDER BY columns have to be selected) and its LIMIT applies
+to the merged rows: every shard is asked for `offset + count` rows. Aggregates without GROUP BY
+(COUNT, MAX, MIN) are combined, GROUP BY can't be merged and needs a query on a single shard.
+Inserts go to the shard of their key value, rows of an InsertMany are split by shard.
+"""
+import heapq
+import itertools
+import multiprocessing.pool
+import threading
+import zlib
+
+import six
+
+from .executor import _empty_result
+from .sql import (BindParam, Column, Condition, ConditionUnion, Count, Delete, FalseCond, Insert, InsertFromSelect,
+                  InsertMany, Max, Min, Select, Sort, Table, TableJoin, Update, UpdateMany, _Query)
+
+
+def shard_by_modulo(value, shards):
+    """The default shard function: ints modulo the number of shards, the CRC32 of anything else."""
+    if isinstance(value, six.integer_types) and not isinstance(value, bool):
+        return value % shards
+    if isinstance(value, six.text_type):
+        value = value.encode("utf-8")
+    elif not isinstance(value, six.binary_type):
+        value = str(value).encode("utf-8")
+    return (zlib.crc32(value) & 0xffffffff) % shards
+
+
+class ShardedTable(Table):
+    """
+    A table whose rows are on `shards` databases, by the value of the `key` column.
+    `function(value, shards)` returns the index of the shard of a key value.
+    """
+
+    def __init__(self, name, key, shards, function=shard_by_modulo, db=None, alias=None):
+        super(ShardedTable, self).__init__(name, db, alias)
+        assert shards > 0
+        self.shard_key = key.name if isinstance(key, Column) else key
+        self.shards = shards
+        self.shard_function = function
+
+    def copy(self):
+        return ShardedTable(self._b_name, self.shard_key, self.shards, self.shard_function, self._b_db,
+                            self._b_alias)
+
+    def shard_of(self, value):
+        shard = self.shard_function(value, self.shards)
+        assert 0 <= shard < self.shards, "shard {!r} of {!r} out of range".format(shard, value)
+        return shard
+
+    def _is_key(self, column):
+        return column.name == self.shard_key and (column.table is None or column.table is self)
+
+
+def _sharded_tables(tables):
+    """The sharded tables of a FROM, not looking into derived tables."""
+    if isinstance(tables, ShardedTable):
+        return [tables]
+    if isinstance(tables, TableJoin):
+        found = _sharded_tables(tables.base)
+        for each in tables.join_items:
+            found.extend(_sharded_tables(each.table))
+        return found
+    return []
+
+
+def _is_value(value):
+    return value is not None and not isinstance(value, (Column, BindParam, Select))
+
+
+def _shards_of(cond, table):
+    """The shards holding the rows that match `cond`, None when it can be any of them."""
+    if isinstance(cond, FalseCond):
+        return frozenset()
+    if isinstance(cond, Condition):
+        if not table._is_key(cond.column):
+            return None
+        if cond.op == Condition.OP_EQ and _is_value(cond.value):
+            return frozenset([table.shard_of(cond.value)])
+        if cond.op == Condition.OP_IN and isinstance(cond.value, (list, tuple)):
+            return frozenset(table.shard_of(value) for value in cond.value)
+        return None
+    if isinstance(cond, ConditionUnion):
+        parts = [_shards_of(each, table) for each in cond.conds]
+        if cond.op == ConditionUnion.OP_AND:
+            known = [each for each in parts if each is not None]
+            return frozenset.intersection(*known) if known else None
+        if any(each is None for each in parts):
+            return None
+        return frozenset().union(*parts)
+    return None
+
+
+def _restrict(cond, table, shard):
+    """`cond` with the IN lists on the key of `table` cut to the values of `shard`."""
+    if isinstance(cond, Condition):
+        if cond.op != Condition.OP_IN or not isinstance(cond.value, (list, tuple)) or not table._is_key(cond.column):
+            return cond
+        values = [value for value in cond.value if table.shard_of(value) == shard]
+        if not values:
+            return FalseCond()
+        if len(values) == len(cond.value):
+            return cond
+        return Condition(cond.column, cond.op, values)
+    if isinstance(cond, ConditionUnion):
+        conds = [_restrict(each, table, shard) for each in cond.conds]
+        if all(new is old for new, old in zip(conds, cond.conds)):
+            return cond
+        return ConditionUnion._from_list(conds, cond.op)
+    return cond
+
+
+class _Reversed(object):
+    """A sort key ordered the other way, for DESC columns."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _sort_key(query):
+    """The merge key of a row of a Select, NULLs come first in ascending order as in MySQL."""
+    try:
+        values = query._seek_key()
+    except ValueError:
+        raise ValueError("the ORDER BY columns have to be selected to merge the rows of the shards")
+    descending = [method == Sort.DESC for _, method in query._sort._tuples]
+
+    def key(row):
+        return tuple(_Reversed((value is not None, value)) if desc else (value is not None, value)
+                     for value, desc in zip(values(row), descending))
+
+    return key
+
+
+def _merge(results, key):
+    """k-way merge of rows sorted by `key`, rows with the same key in the order of the shards."""
+    iterators = [iter(rows) for rows in results]
+    heap = []
+    for i, rows in enumerate(iterators):
+        for row in rows:
+            heap.append((key(row), i, row))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, i, row = heap[0]
+        yield row
+        for row in iterators[i]:
+            heapq.heapreplace(heap, (key(row), i, row))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def _combine(fields, rows):
+    """The row of aggregates over all the shards from the row of every shard."""
+    rows = [row for row in rows if row is not None]
+    first = rows[0]
+    names = list(first.keys()) if isinstance(first, dict) else None
+    values = []
+    for i, field in enumerate(fields):
+        column = [row[names[i]] if names else row[i] for row in rows]
+        present = [value for value in column if value is not None]
+        if isinstance(field, Count):
+            values.append(sum(present))
+        elif not present:
+            values.append(None)
+        else:
+            values.append(max(present) if isinstance(field, Max) else min(present))
+    if names:
+        return dict(zip(names, values))
+    return tuple(values)
+
+
+class ShardRouter(object):
+    """
+    Runs queries on sharded tables on the executors of the shards, in the order of the shard indexes.
+    An executor is an `Executor` or anything with its methods, e.g. a `sql_builder.routing.Router`.
+    The statements of a query run in parallel on up to `max_workers` threads, one per shard by default.
+    """
+
+    def __init__(self, executors, max_workers=None):
+        assert executors
+        self.executors = list(executors)
+        self.max_workers = max_workers or len(self.executors)
+        self._threads = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            threads, self._threads = self._threads, None
+        if threads is not None:
+            threads.close()
+            threads.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _tables_of(self, query):
+        tables = _sharded_tables(query._tables)
+        if not tables:
+            raise ValueError("{} isn't on a sharded table".format(type(query).__name__))
+        for table in tables:
+            if table.shards != len(self.executors):
+                raise ValueError("{} has {:d} shards, the router {:d}".format(
+                    table.raw_view, table.shards, len(self.executors)))
+        return tables
+
+    def shards_for(self, query):
+        """The indexes of the shards a Select, Update or Delete runs on."""
+        assert isinstance(query, (Select, Update, Delete))
+        shards = None
+        where = query._where
+        for table in self._tables_of(query):
+            found = _shards_of(where, table) if where is not None else None
+            if found is not None:
+                shards = found if shards is None else shards & found
+        if shards is None:
+            return list(range(len(self.executors)))
+        return sorted(shards)
+
+    def _on_shard(self, query, shard):
+        """The query as sent to a shard: the IN lists on the keys cut to its values."""
+        where = query._where
+        if where is None:
+            return query
+        for table in _sharded_tables(query._tables):
+            where = _restrict(where, table, shard)
+        if where is query._where:
+            return query
+        query = query._copy()
+        query._where = where
+        return query
+
+    def _scatter(self, method, queries):
+        """Run `method` of the executors with their (shard, query) in parallel, the results in that order."""
+        if len(queries) <= 1:
+            if not queries:
+                return []
+            shard, query = queries[0]
+            return [getattr(self.executors[shard], method)(query)]
+        threads = self._threads
+        if threads is None:
+            with self._lock:
+                # the first queries of several threads would each start a pool
+                if self._threads is None:
+                    self._threads = multiprocessing.pool.ThreadPool(self.max_workers)
+                threads = self._threads
+        return threads.map(lambda item: getattr(self.executors[item[0]], method)(item[1]), queries)
+
+    def fetch_all(self, query):
+        assert isinstance(query, Select)
+        return self._select(query, False)
+
+    def fetch_one(self, query):
+        assert isinstance(query, Select)
+        return self._select(query, True)
+
+    def _select(self, query, one):
+        shards = self.shards_for(query)
+        aggregates = bool(query._fields) and all(isinstance(field, (Count, Max, Min)) for field in query._fields)
+        if aggregates and not query._group and not shards:
+            # aggregates of no row are a row
+            shards = [0]
+        if len(shards) == 1:
+            return getattr(self.executors[shards[0]], "fetch_one" if one else "fetch_all")(
+                self._on_shard(query, shards[0]))
+        if not shards:
+            return _empty_result("one" if one else "all")
+        if query._group:
+            raise ValueError("GROUP BY can't be merged across shards, the query has to pick a single shard")
+        if aggregates:
+            row = _combine(query._fields, self._scatter("fetch_one", [(shard, self._on_shard(query, shard))
+                                                                       for shard in shards]))
+            return row if one else [row]
+        if any(isinstance(field, (Count, Max, Min)) for field in query._fields):
+            raise ValueError("aggregates mixed with columns can't be merged across shards")
+        offset, count = query._offset, query._count
+        if one:
+            count = min(count, 1) if count else 1
+        queries = []
+        for shard in shards:
+            each = self._on_shard(query, shard)
+            if count:
+                if each is query:
+                    each = query._copy()
+                # the first offset + count rows of the merge can all come from any shard
+                each._offset = 0
+                each._count = offset + count
+            queries.append((shard, each))
+        results = self._scatter("fetch_all", queries)
+        rows = _merge(results, _sort_key(query)) if query._sort else itertools.chain.from_iterable(results)
+        if count:
+            rows = itertools.islice(rows, offset, offset + count)
+        rows = list(rows)
+        if one:
+            return rows[0] if rows else None
+        return rows
+
+    def execute(self, query):
+        """Run a write on the shards it's about, returns the sum of the affected row counts."""
+        assert isinstance(query, _Query)
+        if isinstance(query, InsertFromSelect):
+            raise ValueError("INSERT ... SELECT can't be routed to the shards")
+        table = self._tables_of(query)[0]
+        if isinstance(query, Insert):
+            return self._scatter("execute", [(self._insert_shard(query, table), query)])[0]
+        if isinstance(query, InsertMany):
+            return sum(self._scatter("execute", self._split_rows(query, table)))
+        if isinstance(query, UpdateMany):
+            if query._key.name == table.shard_key:
+                return sum(self._scatter("execute", self._split_rows(query, table)))
+            return sum(self._scatter("execute", [(shard, query) for shard in range(len(self.executors))]))
+        if isinstance(query, Update):
+            for pair in query._pairs:
+                if pair.column.name == table.shard_key:
+                    raise ValueError("the shard key {} can't be updated".format(table.shard_key))
+        return sum(self._scatter("execute", [(shard, self._on_shard(query, shard))
+                                             for shard in self.shards_for(query)]))
+
+    def _insert_shard(self, query, table):
+        for pair in query._pairs:
+            if pair.field.name == table.shard_key:
+                if not _is_value(pair.value):
+                    raise ValueError("the shard key {} needs a value".format(table.shard_key))
+                return table.shard_of(pair.value)
+        raise ValueError("an insert into {} needs its shard key {}".format(table.raw_view, table.shard_key))
+
+    def _split_rows(self, query, table):
+        """(shard, query) pairs of an InsertMany or UpdateMany with the rows of each shard."""
+        by_shard = {}
+        if isinstance(query, InsertMany):
+            names = [field.name for field in query._fields]
+            if table.shard_key not in names:
+                raise ValueError("an insert into {} needs its shard key {}".format(table.raw_view, table.shard_key))
+            position = names.index(table.shard_key)
+            for row in query._rows:
+                by_shard.setdefault(table.shard_of(query._row_values(row)[position]), []).append(row)
+        else:
+            for row in query._rows:
+                by_shard.setdefault(table.shard_of(row[0]), []).append(row)
+        queries = []
+        for shard in sorted(by_shard):
+            each = query._copy()
+            each._rows = by_shard[shard]
+            queries.append((shard, each))
+        return queries
@@ -2,7 +2,12 @@
 # Author: Allen Zou
 # 2017/4/6 下午2:38
 import collections
+import copy
+import hashlib
+import itertools
 import sys
+import threading
+import timeit
 import weakref
 
 import six
@@ -13,7 +18,131 @@ if sys.version_info >= (3, 0):
     basestring = str
 
 
+_in_placeholders_cache = {}
+
+
+def _in_placeholders(placeholder, count):
+    """`(%s,%s,...)` for an IN list of `count` items, cached per placeholder and length."""
+    key = (placeholder, count)
+    try:
+        return _in_placeholders_cache[key]
+    except KeyError:
+        if len(_in_placeholders_cache) >= 1024:
+            _in_placeholders_cache.clear()
+        value = _in_placeholders_cache[key] = "({})".format(",".join([placeholder] * count))
+        return value
+
+
+class _Compiler(object):
+    """
+    Output of a statement being rendered: nodes append their SQL fragments and args to the shared
+    lists in `_compile`, the text is joined once at the end.
+    """
+    __slots__ = ("placeholder", "parts", "args", "dialect", "quote")
+
+    def __init__(self, placeholder="%s", dialect=None):
+        self.placeholder = placeholder
+        self.parts = []
+        self.args = []
+        # None renders MySQL, the nodes that differ between databases defer to a `sql_builder.dialects` Dialect
+        self.dialect = dialect
+        # quotes identifiers, None for the backticks of the views of the nodes
+        self.quote = dialect.quote_ident if dialect is not None and dialect.quote != "`" else None
+
+    def ident(self, name):
+        """A quoted identifier."""
+        if self.quote is None:
+            return "`{}`".format(name)
+        return self.quote(name)
+
+    def aliased(self, view, alias):
+        """`view AS alias`, or `view` without an alias."""
+        if not alias:
+            return view
+        return "{} AS {}".format(view, self.ident(alias))
+
+    def result(self):
+        return "".join(self.parts), self.args
+
+
+def _compiled(node, placeholder, dialect=None):
+    c = _Compiler(placeholder, dialect)
+    node._compile(c)
+    return c.result()
+
+
+def _compiled_from(table, placeholder):
+    c = _Compiler(placeholder)
+    table._compile_from(c)
+    return c.result()
+
+
+class BindParam(object):
+    """
+    A named value given when a compiled query runs, see `_Query.compile`. With a `size` it stands for
+    that many values, e.g. `col.in_(bindparam("ids", 3))`. The args of `sql()` hold the BindParam
+    itself, or one BindParam with an `index` per value of a sized one.
+    """
+    __slots__ = ("name", "size", "index")
+
+    def __init__(self, name, size=None, index=None):
+        assert name and isinstance(name, basestring)
+        assert size is None or size > 0
+        self.name = name
+        self.size = size
+        self.index = index
+
+    def _expanded(self):
+        return [BindParam(self.name, self.size, i) for i in range(self.size)]
+
+    def __repr__(self):
+        if self.index is not None:
+            return "bindparam({!r})[{:d}]".format(self.name, self.index)
+        if self.size is not None:
+            return "bindparam({!r}, {:d})".format(self.name, self.size)
+        return "bindparam({!r})".format(self.name)
+
+
+def bindparam(name, size=None):
+    return BindParam(name, size)
+
+
+# whether `Column.startswith` renders a range instead of LIKE by default, see `set_prefix_range_scan`
+_prefix_range_scan = False
+
+
+def set_prefix_range_scan(enabled):
+    """Render `startswith` as `col >= prefix AND col < successor` unless told otherwise per call."""
+    global _prefix_range_scan
+    _prefix_range_scan = bool(enabled)
+
+
+def _prefix_successor(prefix):
+    """The smallest string greater than all the strings starting with `prefix`, None if there's none."""
+    if isinstance(prefix, six.binary_type):
+        chars = bytearray(prefix)
+        while chars and chars[-1] == 0xff:
+            chars.pop()
+        if not chars:
+            return None
+        chars[-1] += 1
+        return bytes(chars)
+    chars = list(prefix)
+    while chars and ord(chars[-1]) >= sys.maxunicode:
+        chars.pop()
+    if not chars:
+        return None
+    code = ord(chars[-1]) + 1
+    if 0xd800 <= code <= 0xdfff:
+        # surrogates can't be encoded
+        code = 0xe000
+    chars[-1] = six.unichr(code)
+    return u"".join(chars)
+
+
 class _Column(object):
+    __slots__ = ()
+
     @property
     def field_view(self):
         raise NotImplemented
@@ -34,8 +163,21 @@ class _Column(object):
     def raw_view(self):
         raise NotImplemented
 
+    def _ref(self, c):
+        """The raw view, quoted for the compiler `c`."""
+        return self.raw_view
+
+    def _field(self, c):
+        """The field view, quoted for the compiler `c`."""
+        return self.field_view
+
+    def _shape(self):
+        return type(self).__name__, self.field_view
+
 
 class RawSQLField(_Column):
+    __slots__ = ("piece",)
+
     def __init__(self, piece):
         self.piece = piece
 
@@ -43,14 +185,29 @@ class RawSQLField(_Column):
     def field_view(self):
         return self.piece
 
+    def _shape(self):
+        return "raw", self.piece
+
 
 class Column(_Column):
+    __slots__ = ("name", "alias", "_table", "_raw", "_key")
+
     def __init__(self, table, name=None, alias=None):
         self.name = name
         self.alias = alias
         self._table = None
+        self._raw = None
+        self._key = None
         self.table = table
 
+    def _precompute(self):
+        """Compute the views of a column interned by its table, done again when the table gets a new alias."""
+        self._raw = None
+        self._key = None
+        if self.name:
+            self._raw = self.raw_view
+        self._key = self._shape()
+
     def __hash__(self):
         return hash(self.raw_view)
 
@@ -70,6 +227,8 @@ class Column(_Column):
 
     @property
     def raw_view(self):
+        if self._raw is not None:
+            return self._raw
         if not self.name:
             raise ValueError()
         s = "`{}`".format(self.name)
@@ -101,9 +260,35 @@ class Column(_Column):
     def update_view(self):
         return self.raw_view
 
+    def _ref(self, c):
+        if c.quote is None:
+            return self.raw_view
+        if not self.name:
+            raise ValueError()
+        table = self.table
+        if table is None:
+            return c.quote(self.name)
+        return "{}.{}".format(table._ref(c), c.quote(self.name))
+
+    def _field(self, c):
+        if c.quote is None:
+            return self.field_view
+        if not self.name:
+            table = self.table
+            return "{}.*".format(table._ref(c)) if table else "*"
+        return c.aliased(self._ref(c), self.alias)
+
+    def _shape(self):
+        if self._key is not None:
+            return self._key
+        table = self.table
+        return "col", table._ref_shape() if table else None, self.name, self.alias
+
     def as_(self, alias):
-        self.alias = alias
-        return self
+        table = self.table
+        if table is not None:
+            return table._interned(self.name, alias)
+        return Column(None, self.name, alias)
 
     def __gt__(self, other):
         return Condition(self, Condition.OP_GT, other)
@@ -153,8 +338,23 @@ class Column(_Column):
     def unlike(self, value):
         return Condition(self, Condition.OP_NOT_LIKE, value)
 
-    def startswith(self, value):
-        return Condition(self, Condition.OP_PREFIX, value)
+    def startswith(self, value, range_scan=None):
+        """
+        `col LIKE 'value%'`, or with `range_scan` `col >= 'value' AND col < 'valuf'`, which engines can
+        always run as an index range scan and which matches `%` and `_` in the value literally. The range
+        assumes the collation of the column orders strings by code point, as binary collations do.
+        `range_scan` defaults to `set_prefix_range_scan`.
+        """
+        if range_scan is None:
+            range_scan = _prefix_range_scan
+        if not range_scan:
+            return Condition(self, Condition.OP_PREFIX, value)
+        assert isinstance(value, basestring) and len(value) > 0
+        lower = Condition(self, Condition.OP_GE, value)
+        upper = _prefix_successor(value)
+        if upper is None:
+            return lower
+        return lower & Condition(self, Condition.OP_LT, upper)
 
     def endswith(self, value):
         return Condition(self, Condition.OP_SUFFIX, value)
@@ -177,15 +377,21 @@ class Column(_Column):
     def dec(self, step=1):
         return ColumnUpdating(self, step, ColumnUpdating.OP_DEC)
 
+    def values(self):
+        return ColumnUpdating(self, None, ColumnUpdating.OP_VALUES)
+
 
 class ColumnUpdating(object):
+    __slots__ = ("column", "op", "value")
     OP_ASSIGN = "="
     OP_INC = "$inc"
     OP_DEC = "$dec"
+    OP_VALUES = "$values"
     ops = [
         OP_ASSIGN,
         OP_INC,
-        OP_DEC
+        OP_DEC,
+        OP_VALUES
     ]
 
     def __init__(self, column, value, op=OP_ASSIGN):
@@ -196,19 +402,39 @@ class ColumnUpdating(object):
         self.value = value
 
     def sql(self, placeholder="%s"):
-        if self.op == self.OP_ASSIGN:
-            tpl = "{col} = {placeholder}"
-        elif self.op == self.OP_INC:
-            tpl = "{col} = {col} + {placeholder}"
-        else:
-            tpl = "{col} = {col} - {placeholder}"
-        col = "`{}`".format(self.column.name)
+        return _compiled(self, placeholder)
+
+    def _compile(self, c):
+        parts = c.parts
+        col = c.ident(self.column.name)
+        if self.op == self.OP_VALUES:
+            parts.append("{col} = VALUES({col})".format(col=col))
+            return
+        parts.append(col)
+        parts.append(" = ")
+        if self.op == self.OP_INC:
+            parts.append(col)
+            parts.append(" + ")
+        elif self.op == self.OP_DEC:
+            parts.append(col)
+            parts.append(" - ")
         if isinstance(self.value, Column):
-            return tpl.format(col=col, placeholder=self.value.raw_view), []
-        return tpl.format(col=col, placeholder=placeholder), [self.value]
+            parts.append(self.value._ref(c))
+        else:
+            parts.append(c.placeholder)
+            c.args.append(self.value)
+
+    def _shape(self):
+        return self.op, self.column.name, _value_shape(self.value)
+
+    def _collect_args(self, args):
+        if self.op != self.OP_VALUES and not isinstance(self.value, Column):
+            args.append(self.value)
 
 
 class Max(_Column):
+    __slots__ = ("column", "alias")
+
     def __init__(self, column, alias=None):
         assert isinstance(column, Column)
         self.column = column
@@ -234,8 +460,19 @@ class Max(_Column):
             return "{} AS `{}`".format(self.raw_view, self.alias)
         return self.raw_view
 
+    def _ref(self, c):
+        return "MAX({})".format(self.column._ref(c))
+
+    def _field(self, c):
+        return c.aliased(self._ref(c), self.alias)
+
+    def _shape(self):
+        return type(self).__name__, self.column._shape(), self.alias
+
 
 class Min(_Column):
+    __slots__ = ("column", "alias")
+
     def __init__(self, column, alias=None):
         assert isinstance(column, Column)
         self.column = column
@@ -254,8 +491,19 @@ class Min(_Column):
             return "{} AS `{}`".format(self.raw_view, self.alias)
         return self.raw_view
 
+    def _ref(self, c):
+        return "MIN({})".format(self.column._ref(c))
+
+    def _field(self, c):
+        return c.aliased(self._ref(c), self.alias)
+
+    def _shape(self):
+        return type(self).__name__, self.column._shape(), self.alias
+
 
 class Count(_Column):
+    __slots__ = ("column", "alias")
+
     def __init__(self, column, alias=None):
         assert isinstance(column, Column)
         self.column = column
@@ -274,17 +522,49 @@ class Count(_Column):
             return "{} AS `{}`".format(self.raw_view, self.alias)
         return self.raw_view
 
+    def _ref(self, c):
+        return "COUNT({})".format(self.column._ref(c))
+
+    def _field(self, c):
+        return c.aliased(self._ref(c), self.alias)
+
+    def _shape(self):
+        return type(self).__name__, self.column._shape(), self.alias
+
 
 class _Table(object):
+    MAX_INTERNED_COLUMNS = 4096
+
     def __getattr__(self, column):
         return self[column]
 
     def __getitem__(self, column):
-        return Column(name=column, table=self)
+        return self._interned(column, None)
 
     @property
     def builtin_all(self):
-        return Column(table=self)
+        return self._interned(None, None)
+
+    def _interned(self, name, alias):
+        """The column shared by every lookup of (name, alias) on this table, its views are computed once."""
+        columns = self._columns()
+        key = (name, alias)
+        try:
+            return columns[key]
+        except KeyError:
+            pass
+        col = Column(self, name, alias)
+        col._precompute()
+        if len(columns) < self.MAX_INTERNED_COLUMNS:
+            columns[key] = col
+        return col
+
+    def _columns(self):
+        # looked up in __dict__ directly, __getattr__ would return a column
+        columns = self.__dict__.get("_interned_columns")
+        if columns is None:
+            columns = self.__dict__["_interned_columns"] = {}
+        return columns
 
     @property
     def raw_view(self):
@@ -295,21 +575,54 @@ class _Table(object):
         raise NotImplemented()
 
     def from_view(self, placeholder="%s"):
+        return _compiled_from(self, placeholder)
+
+    def _compile_from(self, c):
         raise NotImplemented()
 
     @property
     def where_view(self):
         raise NotImplemented()
 
+    def _ref(self, c):
+        """How the columns of the table refer to it, quoted for the compiler `c`."""
+        return self.where_view
+
+    def _shape(self):
+        raise NotImplemented()
+
+    def _ref_shape(self):
+        """Shape of the table as seen by the columns referring to it."""
+        return self._shape()
+
+    def _collect_args(self, args):
+        pass
+
     def select(self, *fields):
         return Select(self, fields=fields)
 
     def update(self, *pairs, **pairs_kwargs):
         return Update(self, *pairs, **pairs_kwargs)
 
+    def update_many(self, key, rows=None):
+        return UpdateMany(self, key, rows)
+
     def insert(self, *pairs, **pairs_kwargs):
         return Insert(self, *pairs, **pairs_kwargs)
 
+    def insert_many(self, fields, rows=None):
+        return InsertMany(self, fields, rows)
+
+    def insert_columns(self, columns, **options):
+        """executemany of an INSERT from a mapping of column to sequence / array, see `sql_builder.columnar`."""
+        from .columnar import insert_columns
+        return insert_columns(self, columns, **options)
+
+    def update_columns(self, columns, key, where=None, **options):
+        """executemany of an UPDATE by `key` from a mapping of column to sequence / array."""
+        from .columnar import update_columns
+        return update_columns(self, columns, key, where, **options)
+
     def delete(self, where=None):
         return Delete(self, where)
 
@@ -320,9 +633,20 @@ class _SubQueryTable(_Table):
         self._alias = alias
         self._query = query
 
-    def from_view(self, placeholder="%s"):
-        sub_query_sql, sub_query_args = self._query.sql(placeholder)
-        return "({}) AS `{}`".format(sub_query_sql, self._alias), sub_query_args
+    def _compile_from(self, c):
+        c.parts.append("(")
+        self._query._compile(c)
+        c.parts.append(") AS ")
+        c.parts.append(c.ident(self._alias))
+
+    def _shape(self):
+        return "sub", self._alias, self._query._shape()
+
+    def _ref_shape(self):
+        return "sub", self._alias
+
+    def _collect_args(self, args):
+        self._query._collect_args(args)
 
     @property
     def field_view(self):
@@ -332,32 +656,102 @@ class _SubQueryTable(_Table):
     def where_view(self):
         return "`{}`".format(self._alias)
 
+    def _ref(self, c):
+        return c.ident(self._alias)
+
+
+class ValuesTable(_Table):
+    """
+    A derived table of literal rows: `(VALUES ROW(%s, ...), ...) AS alias`.
+    Its columns are named `column_0`, `column_1`, ... as MySQL does.
+    """
+
+    def __init__(self, alias, rows):
+        self._alias = alias
+        self._rows = [tuple(row) if isinstance(row, (list, tuple)) else (row,) for row in rows]
+        assert self._rows
+        self._width = len(self._rows[0])
+        for row in self._rows:
+            assert len(row) == self._width
+
+    def _compile_from(self, c):
+        if c.dialect is not None:
+            c.dialect._compile_values_table(c, self)
+            return
+        row_tpl = "ROW({})".format(", ".join([c.placeholder] * self._width))
+        c.parts.append("(VALUES {}) AS {}".format(", ".join([row_tpl] * len(self._rows)), c.ident(self._alias)))
+        args = c.args
+        for row in self._rows:
+            args.extend(row)
+
+    @property
+    def field_view(self):
+        return "`{}`".format(self._alias)
+
+    @property
+    def where_view(self):
+        return "`{}`".format(self._alias)
+
+    def _ref(self, c):
+        return c.ident(self._alias)
+
+    def _shape(self):
+        return "values", self._alias, self._width, len(self._rows)
+
+    def _ref_shape(self):
+        return "sub", self._alias
+
+    def _collect_args(self, args):
+        for row in self._rows:
+            args.extend(row)
+
 
 class Table(_Table):
+    _frozen = False
+
     def __init__(self, name, db=None, alias=None):
         self._b_name = name
         self._b_db = db
         self._b_alias = alias
+        s = "`{}`".format(name)
+        if db:
+            s = "`{}`.{}".format(db, s)
+        self._b_raw = s
 
     def __hash__(self):
-        return hash(self.raw_view)
+        return hash(self._b_raw)
 
     def __contains__(self, item):
         return hash(item) == hash(item)
 
     def as_(self, alias):
-        self._b_alias = alias
-        return self
+        """
+        The table under an alias: this one, with the columns taken from it, or a new frozen table when
+        it's frozen, whose columns keep referring to it.
+        """
+        table = self
+        if self._frozen:
+            table = self.copy()
+            table._frozen = True
+        table._b_alias = alias
+        for col in table._columns().values():
+            col._precompute()
+        return table
+
+    def frozen(self):
+        """A copy of the table that `as_` leaves untouched, so that it can be shared like a frozen query."""
+        if self._frozen:
+            return self
+        table = self.copy()
+        table._frozen = True
+        return table
 
     def copy(self):
         return Table(name=self._b_name, db=self._b_db, alias=self._b_alias)
 
     @property
     def raw_view(self):
-        s = "`{}`".format(self._b_name)
-        if self._b_db:
-            s = "`{}`.{}".format(self._b_db, s)
-        return s
+        return self._b_raw
 
     def insert_from_select(self, fields, select):
         return InsertFromSelect(self, fields, select)
@@ -368,10 +762,24 @@ class Table(_Table):
             return "`{}`".format(self._b_alias)
         return self.raw_view
 
-    def from_view(self, placeholder="%s"):
+    def _raw(self, c):
+        """The raw view, quoted for the compiler `c`."""
+        if c.quote is None:
+            return self._b_raw
+        if self._b_db:
+            return "{}.{}".format(c.quote(self._b_db), c.quote(self._b_name))
+        return c.quote(self._b_name)
+
+    def _ref(self, c):
         if self._b_alias:
-            return "{} AS `{}`".format(self.raw_view, self._b_alias), []
-        return self.raw_view, []
+            return c.ident(self._b_alias)
+        return self._raw(c)
+
+    def _compile_from(self, c):
+        c.parts.append(c.aliased(self._raw(c), self._b_alias))
+
+    def _shape(self):
+        return "tbl", self._b_name, self._b_db, self._b_alias
 
     @property
     def where_view(self):
@@ -435,21 +843,33 @@ class TableJoin(_Table):
     def full_join(self, table, condition):
         return self.join(table, condition, TableJoin.FULL_JOIN)
 
-    def from_view(self, placeholder="%s"):
-        args = []
-        base_sql, base_args = self.base.from_view(placeholder)
-        pieces = [base_sql]
-        args.extend(base_args)
+    def _compile_from(self, c):
+        parts = c.parts
+        self.base._compile_from(c)
+        for each in self.join_items:
+            parts.append(" ")
+            parts.append(each.method)
+            parts.append(" ")
+            each.table._compile_from(c)
+            parts.append(" ON ")
+            each.condition._compile(c)
+
+    def _shape(self):
+        return ("join", self.base._shape()) + tuple(
+            (each.method, each.table._shape(), each.condition._shape()) for each in self.join_items)
+
+    def _collect_args(self, args):
+        self.base._collect_args(args)
         for each in self.join_items:
-            tbl_sql, tbl_args = each.table.from_view(placeholder)
-            args.extend(tbl_args)
-            cond_sql, cond_args = each.condition.sql(placeholder)
-            args.extend(cond_args)
-            pieces.append("{} {} ON {}".format(each.method, tbl_sql, cond_sql))
-        return " ".join(pieces), args
+            each.table._collect_args(args)
+            each.condition._collect_args(args)
 
 
 class _Where(object):
+    __slots__ = ()
+    # rendered without parentheses inside AND / OR
+    _atomic = False
+
     def __and__(self, other):
         pass
 
@@ -462,11 +882,24 @@ class _Where(object):
     def sql(self, placeholder="%s"):
         return
 
+    def _compile(self, c):
+        sql, args = self.sql(c.placeholder)
+        c.parts.append(sql)
+        c.args.extend(args)
+
     def is_empty(self):
         return False
 
+    def _shape(self):
+        return None
+
+    def _collect_args(self, args):
+        pass
+
 
 class EmptyCond(_Where):
+    __slots__ = ()
+
     def is_empty(self):
         return True
 
@@ -480,7 +913,63 @@ class EmptyCond(_Where):
         return self
 
 
+class _ConstantCond(_Where):
+    """A condition that holds for all rows or for none, combined away by AND / OR."""
+    __slots__ = ()
+    _atomic = True
+    _text = None
+    # whether the constant is the result of an AND with it, else it's the result of an OR
+    _absorbs_and = None
+
+    def sql(self, placeholder="%s"):
+        return self._text, []
+
+    def _compile(self, c):
+        c.parts.append(self._text)
+
+    def _combined(self, other, and_):
+        """This constant ANDed / ORed with `other`, on either side."""
+        assert isinstance(other, _Where)
+        if and_ == self._absorbs_and or other.is_empty():
+            return self
+        return other
+
+    def __and__(self, other):
+        return self._combined(other, True)
+
+    def __or__(self, other):
+        return self._combined(other, False)
+
+
+class FalseCond(_ConstantCond):
+    """A condition no row satisfies, what `optimize` turns contradictions into. Rendered `1 = 0`."""
+    __slots__ = ()
+    _text = "1 = 0"
+    _absorbs_and = True
+
+    def _shape(self):
+        return "false",
+
+    def __invert__(self):
+        return TrueCond()
+
+
+class TrueCond(_ConstantCond):
+    """A condition every row satisfies, the negation of FalseCond. Rendered `1 = 1`."""
+    __slots__ = ()
+    _text = "1 = 1"
+    _absorbs_and = False
+
+    def _shape(self):
+        return "true",
+
+    def __invert__(self):
+        return FalseCond()
+
+
 class Condition(_Where):
+    __slots__ = ("column", "op", "value", "_pattern")
+    _atomic = True
     OP_EQ = "="
     OP_NE = "!="
     OP_GE = ">="
@@ -501,12 +990,14 @@ class Condition(_Where):
         self.column = column
         self.op = op
         if op in (Condition.OP_IN, Condition.OP_NIN):
-            assert isinstance(value, (list, tuple)) and len(value) > 0 or isinstance(value, Select)
+            assert isinstance(value, (list, tuple)) and len(value) > 0 or isinstance(value, Select) or \
+                isinstance(value, BindParam) and value.size
         if op in (Condition.OP_LIKE, Condition.OP_NOT_LIKE, Condition.OP_PREFIX,
                   Condition.OP_SUFFIX):
             assert isinstance(value, basestring)
             assert len(value) > 0
         self.value = value
+        self._pattern = None
 
     def _op_2_sql(self, op):
         if op == Condition.OP_EQ: return "="
@@ -524,149 +1015,311 @@ class Condition(_Where):
         if op == Condition.OP_SUFFIX: return "LIKE"
         if op == Condition.OP_NOT_SUFFIX: return "NOT LIKE"
 
+    @staticmethod
+    def _negate_op(op):
+        if op == Condition.OP_EQ: return Condition.OP_NE
+        if op == Condition.OP_NE: return Condition.OP_EQ
+        if op == Condition.OP_GE: return Condition.OP_LT
+        if op == Condition.OP_GT: return Condition.OP_LE
+        if op == Condition.OP_LE: return Condition.OP_GT
+        if op == Condition.OP_LT: return Condition.OP_GE
+        if op == Condition.OP_IN: return Condition.OP_NIN
+        if op == Condition.OP_NIN: return Condition.OP_IN
+        if op == Condition.OP_LIKE: return Condition.OP_NOT_LIKE
+        if op == Condition.OP_NOT_LIKE: return Condition.OP_LIKE
+        if op == Condition.OP_PREFIX: return Condition.OP_NOT_PREFIX
+        if op == Condition.OP_NOT_PREFIX: return Condition.OP_PREFIX
+        if op == Condition.OP_SUFFIX: return Condition.OP_NOT_SUFFIX
+        if op == Condition.OP_NOT_SUFFIX: return Condition.OP_SUFFIX
+        raise ValueError()
+
     def __invert__(self):
-        if self.op == Condition.OP_EQ:
-            self.op = Condition.OP_NE
-        elif self.op == Condition.OP_NE:
-            self.op = Condition.OP_EQ
-        elif self.op == Condition.OP_GE:
-            self.op = Condition.OP_LT
-        elif self.op == Condition.OP_GT:
-            self.op = Condition.OP_LE
-        elif self.op == Condition.OP_LE:
-            self.op = Condition.OP_GT
-        elif self.op == Condition.OP_LT:
-            self.op = Condition.OP_GE
-        elif self.op == Condition.OP_IN:
-            self.op = Condition.OP_NIN
-        elif self.op == Condition.OP_NIN:
-            self.op = Condition.OP_IN
-        elif self.op == Condition.OP_LIKE:
-            self.op = Condition.OP_NOT_LIKE
-        elif self.op == Condition.OP_NOT_LIKE:
-            self.op = Condition.OP_LIKE
-        elif self.op == Condition.OP_PREFIX:
-            self.op = Condition.OP_NOT_PREFIX
-        elif self.op == Condition.OP_NOT_PREFIX:
-            self.op = Condition.OP_PREFIX
-        elif self.op == Condition.OP_SUFFIX:
-            self.op = Condition.OP_NOT_SUFFIX
-        elif self.op == Condition.OP_NOT_SUFFIX:
-            self.op = Condition.OP_SUFFIX
-        else:
-            raise ValueError()
+        return self._negated()
+
+    def _negated(self):
+        """A negated copy, leaving this condition untouched."""
+        return Condition(self.column, self._negate_op(self.op), self.value)
 
     def sql(self, placeholder="%s"):
-        key = self.column.where_view
-        op = self._op_2_sql(self.op)
-        # sql_pieces = [self.column.where_view, self._op_2_sql(self.op)]
-        args = []
-        sub_sql, sub_args = self.value.sql(placeholder) if isinstance(self.value, Select) else ("", [])
-        if self.op in [Condition.OP_IN, Condition.OP_NIN]:
-            if isinstance(self.value, Select):
-                value = "({})".format(sub_sql)
-                args.extend(sub_args)
-            else:
-                value = "({})".format(",".join(placeholder for _ in self.value))
-                args.extend(self.value)
-        elif self.op in [Condition.OP_LIKE, Condition.OP_NOT_LIKE]:
-            value = placeholder
-            arg = self.value
-            if isinstance(arg, six.text_type):
-                arg = self.value.encode('utf-8')
-            args.append("%{}%".format(arg))
-        elif self.op in [Condition.OP_PREFIX, Condition.OP_NOT_PREFIX]:
-            value = placeholder
-            arg = self.value
-            if isinstance(arg, six.text_type):
-                arg = self.value.encode('utf-8')
-            args.append("{}%".format(arg))
-        elif self.op in [Condition.OP_SUFFIX, Condition.OP_NOT_SUFFIX]:
-            value = placeholder
-            arg = self.value
-            if isinstance(arg, six.text_type):
-                arg = self.value.encode('utf-8')
-            args.append("%{}".format(arg))
-        elif self.op in [Condition.OP_EQ, Condition.OP_NE]:
-            if self.value is None:
-                op = "IS" if self.op == Condition.OP_EQ else "IS NOT"
-                value = "NULL"
-            elif isinstance(self.value, Column):
-                value = self.value.where_view
-            elif isinstance(self.value, Select):
-                value = "({})".format(sub_sql)
-                args.extend(sub_args)
-            else:
-                value = placeholder
-                args.append(self.value)
+        return _compiled(self, placeholder)
+
+    def _pattern_arg(self):
+        """The LIKE pattern for OP_LIKE / OP_PREFIX / OP_SUFFIX and their negations, built once."""
+        if self._pattern is not None:
+            return self._pattern
+        arg = self.value
+        if python_version == 2 and isinstance(arg, six.text_type):
+            arg = arg.encode('utf-8')
+        if self.op in (Condition.OP_LIKE, Condition.OP_NOT_LIKE):
+            pattern = "%{}%".format(arg)
+        elif self.op in (Condition.OP_PREFIX, Condition.OP_NOT_PREFIX):
+            pattern = "{}%".format(arg)
         else:
-            if isinstance(self.value, Column):
-                value = self.value.where_view
-            elif isinstance(self.value, Select):
-                value = "({})".format(sub_sql)
-                args.extend(sub_args)
-            else:
-                value = placeholder
-                args.append(self.value)
-        return " ".join([key, op, value]), args
+            pattern = "%{}".format(arg)
+        self._pattern = pattern
+        return pattern
+
+    def _compile(self, c):
+        parts = c.parts
+        op = self.op
+        value = self.value
+        parts.append(self.column._ref(c))
+        if op in _PATTERN_OPS:
+            parts.append(_SQL_OPS[op])
+            parts.append(c.placeholder)
+            c.args.append(self._pattern_arg())
+        elif isinstance(value, Select):
+            parts.append(_SQL_OPS[op])
+            parts.append("(")
+            value._compile(c)
+            parts.append(")")
+        elif op in (Condition.OP_IN, Condition.OP_NIN):
+            if isinstance(value, BindParam):
+                value = value._expanded()
+            parts.append(_SQL_OPS[op])
+            parts.append(_in_placeholders(c.placeholder, len(value)))
+            c.args.extend(value)
+        elif value is None and op in (Condition.OP_EQ, Condition.OP_NE):
+            parts.append(" IS NULL" if op == Condition.OP_EQ else " IS NOT NULL")
+        elif isinstance(value, Column):
+            parts.append(_SQL_OPS[op])
+            parts.append(value._ref(c))
+        else:
+            parts.append(_SQL_OPS[op])
+            parts.append(c.placeholder)
+            c.args.append(value)
+
+    def _shape(self):
+        return "cond", self.column._shape(), self.op, _value_shape(self.value)
+
+    def _collect_args(self, args):
+        value = self.value
+        if self.op in _PATTERN_OPS:
+            args.append(self._pattern_arg())
+        elif isinstance(value, Select):
+            value._collect_args(args)
+        elif self.op in (Condition.OP_IN, Condition.OP_NIN):
+            args.extend(value._expanded() if isinstance(value, BindParam) else value)
+        elif isinstance(value, Column):
+            pass
+        elif value is None and self.op in (Condition.OP_EQ, Condition.OP_NE):
+            pass
+        else:
+            args.append(value)
 
     def __and__(self, other):
         assert isinstance(other, _Where)
         if isinstance(other, EmptyCond):
             return self
+        if isinstance(other, _ConstantCond):
+            return other._combined(self, True)
         return ConditionUnion(self, other, ConditionUnion.OP_AND)
 
     def __or__(self, other):
         assert isinstance(other, _Where)
         if isinstance(other, EmptyCond):
             return self
+        if isinstance(other, _ConstantCond):
+            return other._combined(self, False)
+        return ConditionUnion(self, other, ConditionUnion.OP_OR)
+
+
+# operators with the spaces around them, as rendered by Condition
+_SQL_OPS = {
+    Condition.OP_EQ: " = ",
+    Condition.OP_NE: " != ",
+    Condition.OP_GE: " >= ",
+    Condition.OP_GT: " > ",
+    Condition.OP_LE: " <= ",
+    Condition.OP_LT: " < ",
+    Condition.OP_IN: " IN ",
+    Condition.OP_NIN: " NOT IN ",
+    Condition.OP_LIKE: " LIKE ",
+    Condition.OP_NOT_LIKE: " NOT LIKE ",
+    Condition.OP_PREFIX: " LIKE ",
+    Condition.OP_NOT_PREFIX: " NOT LIKE ",
+    Condition.OP_SUFFIX: " LIKE ",
+    Condition.OP_NOT_SUFFIX: " NOT LIKE ",
+}
+_PATTERN_OPS = frozenset([Condition.OP_LIKE, Condition.OP_NOT_LIKE, Condition.OP_PREFIX, Condition.OP_NOT_PREFIX,
+                          Condition.OP_SUFFIX, Condition.OP_NOT_SUFFIX])
+
+
+class RowCondition(_Where):
+    """Row value comparison: `(a, b) > (%s, %s)`."""
+    __slots__ = ("columns", "op", "values")
+    _atomic = True
+    ops = [
+        Condition.OP_EQ,
+        Condition.OP_NE,
+        Condition.OP_GE,
+        Condition.OP_GT,
+        Condition.OP_LE,
+        Condition.OP_LT
+    ]
+
+    def __init__(self, columns, op, values):
+        assert op in self.ops
+        assert len(columns) == len(values) > 0
+        for col in columns:
+            assert isinstance(col, Column)
+        self.columns = tuple(columns)
+        self.op = op
+        self.values = tuple(values)
+
+    def sql(self, placeholder="%s"):
+        return _compiled(self, placeholder)
+
+    def _compile(self, c):
+        c.parts.append("({}) {} ({})".format(", ".join(col._ref(c) for col in self.columns), self.op,
+                                             ", ".join([c.placeholder] * len(self.values))))
+        c.args.extend(self.values)
+
+    def _shape(self):
+        return "row", tuple(col._shape() for col in self.columns), self.op, len(self.values)
+
+    def _collect_args(self, args):
+        args.extend(self.values)
+
+    def _negated(self):
+        return RowCondition(self.columns, Condition._negate_op(self.op), self.values)
+
+    def __invert__(self):
+        return self._negated()
+
+    def __and__(self, other):
+        assert isinstance(other, _Where)
+        if other.is_empty():
+            return self
+        if isinstance(other, _ConstantCond):
+            return other._combined(self, True)
+        return ConditionUnion(self, other, ConditionUnion.OP_AND)
+
+    def __or__(self, other):
+        assert isinstance(other, _Where)
+        if other.is_empty():
+            return self
+        if isinstance(other, _ConstantCond):
+            return other._combined(self, False)
         return ConditionUnion(self, other, ConditionUnion.OP_OR)
 
 
 class ConditionUnion(_Where):
+    """
+    N-ary AND/OR node. Children combined with the same operator are absorbed into one flat list,
+    so conditions chained in a loop don't grow a deep tree.
+    """
+    __slots__ = ("op", "_conds", "_size", "_tail")
     OP_AND = "$and"
     OP_OR = "$or"
 
     def __init__(self, left_conf, right_cond, op):
         assert isinstance(left_conf, _Where) and not isinstance(left_conf, EmptyCond)
         assert isinstance(right_cond, _Where) and not isinstance(right_cond, EmptyCond)
-        self.left = left_conf
-        self.right = right_cond
+        assert op in (ConditionUnion.OP_AND, ConditionUnion.OP_OR)
         self.op = op
+        self._conds = []
+        self._absorb(left_conf)
+        self._absorb(right_cond)
+        self._size = len(self._conds)
+        # whoever pops this token may append to `_conds` in place, see `_combine`
+        self._tail = [True]
+
+    @classmethod
+    def _from_list(cls, conds, op):
+        union = cls.__new__(cls)
+        union.op = op
+        union._conds = conds
+        union._size = len(conds)
+        union._tail = [True]
+        return union
+
+    @property
+    def conds(self):
+        return self._conds[:self._size]
+
+    def _absorb(self, cond):
+        if isinstance(cond, ConditionUnion) and cond.op == self.op:
+            self._conds.extend(cond.conds)
+        else:
+            self._conds.append(cond)
+
+    def _combine(self, other, op):
+        assert isinstance(other, _Where)
+        if other.is_empty():
+            return self
+        if isinstance(other, _ConstantCond):
+            return other._combined(self, op == ConditionUnion.OP_AND)
+        if op != self.op:
+            return ConditionUnion(self, other, op)
+        try:
+            # the list is shared with the unions derived from this one, only the first one
+            # extending it may append in place, the others get a copy
+            self._tail.pop()
+            conds = self._conds
+        except IndexError:
+            conds = self._conds[:self._size]
+        if isinstance(other, ConditionUnion) and other.op == op:
+            conds.extend(other.conds)
+        else:
+            conds.append(other)
+        return ConditionUnion._from_list(conds, op)
 
     def __and__(self, other):
-        return ConditionUnion(self, other, ConditionUnion.OP_AND)
+        return self._combine(other, ConditionUnion.OP_AND)
 
     def __or__(self, other):
-        return ConditionUnion(self, other, ConditionUnion.OP_OR)
+        return self._combine(other, ConditionUnion.OP_OR)
 
     def __invert__(self):
         if self.op == ConditionUnion.OP_AND:
-            return ConditionUnion(~self.left, ~self.right, ConditionUnion.OP_OR)
+            op = ConditionUnion.OP_OR
         elif self.op == ConditionUnion.OP_OR:
-            return ConditionUnion(~self.left, ~self.right, ConditionUnion.OP_AND)
+            op = ConditionUnion.OP_AND
         else:
             raise ValueError()
+        return ConditionUnion._from_list(
+            [~cond for cond in self.conds], op)
 
     def sql(self, placeholder="%s"):
-        args = []
-        left_sql, left_args = self.left.sql(placeholder)
-        right_sql, right_args = self.right.sql(placeholder)
-        args.extend(left_args)
-        args.extend(right_args)
-        left_sql = ("{}" if isinstance(self.left, Condition) else "({})").format(left_sql)
-        right_sql = ("{}" if isinstance(self.right, Condition) else "({})").format(right_sql)
-        if self.op == ConditionUnion.OP_AND:
-            tpl = "{} AND {}"
-        else:
-            tpl = "{} OR {}"
-        return tpl.format(left_sql, right_sql), args
+        return _compiled(self, placeholder)
+
+    def _compile(self, c):
+        pieces = c.parts
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, basestring):
+                pieces.append(item)
+            elif isinstance(item, ConditionUnion):
+                sep = " AND " if item.op == ConditionUnion.OP_AND else " OR "
+                conds = item._conds
+                for i in range(item._size - 1, -1, -1):
+                    cond = conds[i]
+                    if cond._atomic:
+                        stack.append(cond)
+                    else:
+                        stack.append(")")
+                        stack.append(cond)
+                        stack.append("(")
+                    if i:
+                        stack.append(sep)
+            else:
+                item._compile(c)
+
+    def _shape(self):
+        return (self.op,) + tuple(cond._shape() for cond in self.conds)
+
+    def _collect_args(self, args):
+        for cond in self.conds:
+            cond._collect_args(args)
 
     def __str__(self):
         return "{}: {} {}".format(super(ConditionUnion, self).__str__(), *self.sql())
 
 
 class Sort(object):
+    __slots__ = ("_tuples",)
     ASC = "ASC"
     DESC = "DESC"
 
@@ -675,6 +1328,11 @@ class Sort(object):
         assert order in [Sort.ASC, Sort.DESC]
         self._tuples = [[col, order]]
 
+    def __copy__(self):
+        sort = Sort.__new__(Sort)
+        sort._tuples = list(self._tuples)
+        return sort
+
     def asc(self, col):
         assert isinstance(col, Column)
         self._tuples.append([col, Sort.ASC])
@@ -687,8 +1345,16 @@ class Sort(object):
     def sql(self):
         return ", ".join("{} {}".format(col.raw_view, method) for col, method in self._tuples)
 
+    def _compile(self, c):
+        c.parts.append(", ".join("{} {}".format(col._ref(c), method) for col, method in self._tuples))
+
+    def _shape(self):
+        return tuple((col._shape(), method) for col, method in self._tuples)
+
 
 class GroupBy(object):
+    __slots__ = ("_cols",)
+
     def __init__(self, *cols):
         assert cols
         for col in cols:
@@ -699,16 +1365,348 @@ class GroupBy(object):
     def sql(self):
         return ", ".join(col.raw_view for col in self._cols)
 
+    def _compile(self, c):
+        c.parts.append(", ".join(col._ref(c) for col in self._cols))
+
+    def _shape(self):
+        return tuple(col._shape() for col in self._cols)
+
+
+def _value_shape(value):
+    if value is None:
+        return "null"
+    if isinstance(value, Column):
+        return value._shape()
+    if isinstance(value, Select):
+        return "select", value._shape()
+    if isinstance(value, (list, tuple)):
+        return "list", len(value)
+    if isinstance(value, BindParam) and value.size:
+        return "list", value.size
+    return "?"
+
+
+def _normalized_shape(shape):
+    """The shape without the parts that only depend on values: IN list lengths, LIMIT numbers and row counts."""
+    if not isinstance(shape, tuple) or not shape:
+        return shape
+    tag = shape[0]
+    if tag == "list" and len(shape) == 2 and isinstance(shape[1], int):
+        return "list",
+    items = tuple(_normalized_shape(each) for each in shape)
+    if tag == "select" and len(items) == 9 and isinstance(items[6], int) and isinstance(items[7], int):
+        return items[:6] + (items[7] > 0,) + items[8:]
+    if tag == "values" and len(items) == 4 and isinstance(items[3], int):
+        return items[:3]
+    if tag == "insert_many" and len(items) >= 5:
+        return items[:3] + items[4:]
+    if tag == "update_many" and len(items) == 6 and isinstance(items[4], int):
+        return items[:4] + items[5:]
+    return items
+
+
+def _feed_shape(digest, shape):
+    # a canonical serialization: the same on Python 2 and 3 and for str / unicode names
+    if isinstance(shape, tuple):
+        digest.update(b"(")
+        for each in shape:
+            _feed_shape(digest, each)
+        digest.update(b")")
+    elif shape is None:
+        digest.update(b"n")
+    elif isinstance(shape, bool):
+        digest.update(b"t" if shape else b"f")
+    elif isinstance(shape, six.integer_types):
+        digest.update("i{:d};".format(shape).encode("ascii"))
+    else:
+        if isinstance(shape, six.text_type):
+            shape = shape.encode("utf-8")
+        elif not isinstance(shape, six.binary_type):
+            shape = str(shape).encode("utf-8")
+        digest.update("s{:d}:".format(len(shape)).encode("ascii"))
+        digest.update(shape)
+
+
+_fingerprint_cache = {}
+
+
+def _fingerprint(shape):
+    try:
+        return _fingerprint_cache[shape]
+    except KeyError:
+        digest = hashlib.sha1()
+        _feed_shape(digest, _normalized_shape(shape))
+        if len(_fingerprint_cache) >= 4096:
+            _fingerprint_cache.clear()
+        value = _fingerprint_cache[shape] = digest.hexdigest()[:16]
+        return value
+
+
+class SQLCache(object):
+    """
+    A bounded LRU cache of rendered SQL texts, keyed by the structural shape of the query
+    and the placeholder. Only the bound values differ between queries of the same shape,
+    so a hit just collects the args.
+    """
+    CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+    def __init__(self, maxsize=1024):
+        assert maxsize >= 0
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        self._maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def get(self, key):
+        with self._lock:
+            try:
+                text = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = text
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = text
+            self._evict()
+
+    def resize(self, maxsize):
+        assert maxsize >= 0
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return SQLCache.CacheInfo(self.hits, self.misses, self.evictions, self._maxsize, len(self._data))
+
+    def _evict(self):
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+sql_cache = SQLCache()
+
+
+def set_sql_cache_size(maxsize):
+    """Resize the shared SQL cache, 0 disables it."""
+    sql_cache.resize(maxsize)
+
+
+# `hook(query, sql, args, duration, rows)` callbacks, run after every `sql()` of a statement and after
+# every execution by an executor. Managed by `sql_builder.profiling`.
+_build_hooks = []
+_execute_hooks = []
+_timer = timeit.default_timer
+
+
+def _run_hooks(hooks, query, sql, args, duration, rows=None):
+    for hook in tuple(hooks):
+        hook(query, sql, args, duration, rows)
+
 
 class _Query(object):
     UpdatePair = collections.namedtuple("UpdatePair", ["field", "value"])
+    _frozen = False
+    # containers that builder methods change in place, copied when a frozen query is derived
+    _mutables = ()
+    # whether the text only depends on the shape and can be kept in the SQL caches
+    _cacheable = True
 
     def __init__(self, tables):
         assert isinstance(tables, _Table)
         self._tables = tables
 
+    def frozen(self):
+        """
+        An immutable version of the query: its builder methods leave it untouched and return a new
+        query sharing the unchanged parts with it, so it can be built once and specialized from many
+        threads. Frozen queries are hashable and equal when they render the same SQL and args.
+        The conditions, tables and sub-queries it refers to are shared, not copied.
+        """
+        if self._frozen:
+            return self
+        query = self._copy()
+        query._frozen = True
+        return query
+
+    def _derive(self):
+        """The query a builder method changes: this one, or a copy when it's frozen."""
+        if not self._frozen:
+            return self
+        return self._copy()
+
+    def _copy(self):
+        query = copy.copy(self)
+        for name in self._mutables:
+            setattr(query, name, copy.copy(getattr(self, name)))
+        return query
+
+    def __copy__(self):
+        query = self.__class__.__new__(self.__class__)
+        query.__dict__.update(self.__dict__)
+        # the cached hash of a frozen query doesn't hold for a copy that is going to be changed
+        query.__dict__.pop("_hash", None)
+        return query
+
+    def _identity(self):
+        args = []
+        self._collect_args(args)
+        return type(self), self._shape(), args
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not (self._frozen and isinstance(other, _Query) and other._frozen):
+            return False
+        return self._identity() == other._identity()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        if not self._frozen:
+            return id(self) >> 4
+        value = self.__dict__.get("_hash")
+        if value is None:
+            cls, shape, args = self._identity()
+            try:
+                value = hash((cls, shape, tuple(args)))
+            except TypeError:
+                # unhashable args, e.g. lists bound to JSON columns
+                value = hash((cls, shape))
+            self._hash = value
+        return value
+
+    def sql(self, placeholder="%s", dialect=None):
+        """
+        The SQL text and args of the query. With a `dialect` of `sql_builder.dialects` the text is
+        rendered for that database and with its placeholders, `placeholder` is ignored.
+        """
+        if not _build_hooks:
+            return self._sql(placeholder) if dialect is None else dialect.render(self)
+        started = _timer()
+        sql, args = self._sql(placeholder) if dialect is None else dialect.render(self)
+        _run_hooks(_build_hooks, self, sql, args, _timer() - started)
+        return sql, args
+
+    def _sql(self, placeholder):
+        if not sql_cache.maxsize or not self._cacheable:
+            return self._render(placeholder)
+        key = (self._shape(), placeholder)
+        text = sql_cache.get(key)
+        if text is None:
+            text, args = self._render(placeholder)
+            sql_cache.put(key, text)
+            return text, args
+        args = []
+        self._collect_args(args)
+        return text, args
+
+    def compile(self, placeholder="%s", dialect=None):
+        """
+        Render the query once, for running it many times with the values of its `bindparam`s:
+        returns a `CompiledQuery` whose `args(values)` builds the args of the statement.
+        """
+        from .compiled import CompiledQuery
+        return CompiledQuery(self, placeholder, dialect)
+
+    def optimized(self):
+        """
+        A copy of the query with its WHERE clause normalized by `sql_builder.optimizer.optimize`,
+        or this query when there's nothing to change.
+        """
+        from .optimizer import optimize
+        return optimize(self)[0]
+
+    def never_matches(self):
+        """Whether running the query is known to select or change no row, see `optimized`."""
+        return isinstance(getattr(self, "_where", None), FalseCond)
+
+    def fingerprint(self):
+        """
+        A stable identifier of the statement: the same for any bound values, IN list lengths and
+        LIMIT / OFFSET numbers, and across processes and Python versions.
+        """
+        return _fingerprint(self._shape())
+
+    def execute(self, executor):
+        """
+        Run the query with an `Executor`, or with an asyncio pool from `sql_builder.aio`
+        in which case the result has to be awaited. Returns the affected row count.
+        """
+        return executor.execute(self)
+
+    def fetch_all(self, executor):
+        return executor.fetch_all(self)
+
+    def fetch_one(self, executor):
+        return executor.fetch_one(self)
+
+    def _render(self, placeholder="%s", dialect=None):
+        return _compiled(self, placeholder, dialect)
+
+    def _compile(self, c):
+        raise NotImplementedError()
+
+    def _shape(self):
+        raise NotImplementedError()
+
+    def _collect_args(self, args):
+        raise NotImplementedError()
+
+
+def _compile_upsert(c, query):
+    """The ON DUPLICATE KEY UPDATE clause of an insert, or its equivalent in the dialect."""
+    if c.dialect is not None:
+        c.dialect._compile_upsert(c, query)
+        return
+    c.parts.append(" ON DUPLICATE KEY UPDATE ")
+    for i, each in enumerate(query._on_duplicate_update_fields):
+        if i:
+            c.parts.append(", ")
+        each._compile(c)
+
+
+def _conflict_shape(query):
+    # left out when there's none, so that the fingerprints of the other inserts don't change
+    if not query._conflict_target:
+        return ()
+    return ("conflict",) + tuple(col.name for col in query._conflict_target),
+
+
+def _conflict_target(table, columns):
+    target = []
+    for col in columns:
+        if isinstance(col, basestring):
+            col = getattr(table, col)
+        assert isinstance(col, Column) and col.name
+        target.append(col)
+    return tuple(target)
+
 
 class Insert(_Query):
+    _mutables = ("_pairs", "_on_duplicate_update_fields")
+    _conflict_target = ()
+
     def __init__(self, table, *pairs, **pairs_kwargs):
         assert isinstance(table, Table)
         super(Insert, self).__init__(tables=table)
@@ -724,59 +1722,246 @@ class Insert(_Query):
         self._on_duplicate_update_fields = []
 
     def add_fields(self, *pairs, **pairs_kwargs):
+        query = self._derive()
         assert len(pairs) % 2 == 0
         for cursor in range(0, len(pairs), 2):
             key, val = pairs[cursor:cursor + 2]
             assert isinstance(key, Column)
-            assert key.table is None or key.table is self._tables
-            self._pairs.append(_Query.UpdatePair(key, val))
+            assert key.table is None or key.table is query._tables
+            query._pairs.append(_Query.UpdatePair(key, val))
         for key, val in pairs_kwargs.items():
-            self._pairs.append(_Query.UpdatePair(getattr(self._tables, key), val))
-        return self
+            query._pairs.append(_Query.UpdatePair(getattr(query._tables, key), val))
+        return query
 
     def on_duplicate_key_fields(self, *pairs, **pairs_kwargs):
+        query = self._derive()
         assert len(pairs) % 2 == 0
         for cursor in range(0, len(pairs), 2):
             key, val = pairs[cursor:cursor + 2]
             assert isinstance(key, Column)
-            self._on_duplicate_update_fields.append(ColumnUpdating(key, val))
+            query._on_duplicate_update_fields.append(ColumnUpdating(key, val))
         for key, val in pairs_kwargs.items():
-            self._on_duplicate_update_fields.append(ColumnUpdating(getattr(self._tables, key), val))
-        return self
+            query._on_duplicate_update_fields.append(ColumnUpdating(getattr(query._tables, key), val))
+        return query
 
     def on_duplicate_key_update(self, *updating):
+        query = self._derive()
         for each in updating:
             assert isinstance(each, ColumnUpdating)
-            self._on_duplicate_update_fields.append(each)
-        return self
+            query._on_duplicate_update_fields.append(each)
+        return query
+
+    def on_conflict(self, *columns):
+        """
+        The unique columns the ON DUPLICATE KEY UPDATE is about, PostgreSQL and SQLite render it as
+        `ON CONFLICT (columns) DO UPDATE`. MySQL ignores them.
+        """
+        query = self._derive()
+        query._conflict_target = _conflict_target(query._tables, columns)
+        return query
+
+    def _compile(self, c):
+        parts = c.parts
+        parts.append("INSERT INTO {table}({fields}) VALUES({placeholders})".format(
+            table=self._tables._raw(c), fields=", ".join(c.ident(pair.field.name) for pair in self._pairs),
+            placeholders=", ".join([c.placeholder] * len(self._pairs))))
+        c.args.extend(pair.value for pair in self._pairs)
+        if self._on_duplicate_update_fields:
+            _compile_upsert(c, self)
 
-    def sql(self, placeholder="%s"):
-        sql_pieces = ["INSERT INTO {table}({fields}) VALUES({placeholders})".format(table=self._tables.raw_view,
-                                                                                    fields=", ".join(
-                                                                                        pair.field.insert_view for pair
-                                                                                        in self._pairs),
-                                                                                    placeholders=", ".join(
-                                                                                        [placeholder] * len(
-                                                                                            self._pairs)))]
-        args = [pair.value for pair in self._pairs]
+    def _shape(self):
+        return ("insert", self._tables._shape(), tuple(pair.field.name for pair in self._pairs),
+                tuple(each._shape() for each in self._on_duplicate_update_fields)) + _conflict_shape(self)
+
+    def _collect_args(self, args):
+        args.extend(pair.value for pair in self._pairs)
+        for each in self._on_duplicate_update_fields:
+            each._collect_args(args)
+
+
+def _estimate_arg_size(value):
+    """Rough upper bound of the bytes a value takes once the driver escapes it into the statement."""
+    if value is None:
+        return 4
+    if isinstance(value, six.text_type):
+        value = value.encode('utf-8')
+    if isinstance(value, six.binary_type):
+        return len(value) + 2 + sum(value.count(c) for c in (b"\\", b"'", b'"', b"\0", b"\n", b"\r", b"\x1a"))
+    if isinstance(value, (bool, six.integer_types, float)):
+        return len(repr(value))
+    return len(str(value)) + 2
+
+
+class InsertMany(_Query):
+    """
+    INSERT of many rows at once. Rows are dicts keyed by field name or tuples in the order of `fields`,
+    `statements()` splits them into multi-row statements bounded by row count and estimated packet size.
+    """
+    MAX_ROWS = 1000
+    MAX_PACKET_SIZE = 4 * 1024 * 1024
+    _mutables = ("_on_duplicate_update_fields",)
+    _conflict_target = ()
+    # the text depends on the number of rows
+    _cacheable = False
+
+    def __init__(self, table, fields, rows=None):
+        assert isinstance(table, Table)
+        super(InsertMany, self).__init__(tables=table)
+        assert fields and isinstance(fields, (list, tuple))
+        self._fields = []
+        for field in fields:
+            if isinstance(field, basestring):
+                field = getattr(table, field)
+            assert isinstance(field, Column)
+            assert field.table is None or field.table is table
+            self._fields.append(field)
+        self._rows = []
+        self._on_duplicate_update_fields = []
+        if rows is not None:
+            self.add_rows(rows)
+
+    def add_rows(self, rows):
+        """Rows may be any iterable, a generator is consumed lazily by `statements()`."""
+        query = self._derive()
+        if isinstance(query._rows, list) and not query._rows:
+            query._rows = rows
+        else:
+            query._rows = itertools.chain(query._rows, rows)
+        return query
+
+    def on_duplicate_key_fields(self, *pairs, **pairs_kwargs):
+        query = self._derive()
+        assert len(pairs) % 2 == 0
+        for cursor in range(0, len(pairs), 2):
+            key, val = pairs[cursor:cursor + 2]
+            assert isinstance(key, Column)
+            query._on_duplicate_update_fields.append(ColumnUpdating(key, val))
+        for key, val in pairs_kwargs.items():
+            query._on_duplicate_update_fields.append(ColumnUpdating(getattr(query._tables, key), val))
+        return query
+
+    def on_duplicate_key_update(self, *updating):
+        query = self._derive()
+        for each in updating:
+            assert isinstance(each, ColumnUpdating)
+            query._on_duplicate_update_fields.append(each)
+        return query
+
+    def on_duplicate_key_values(self, *fields):
+        """`col = VALUES(col)` for the given fields, all inserted fields by default."""
+        query = self._derive()
+        for field in fields or query._fields:
+            if isinstance(field, basestring):
+                field = getattr(query._tables, field)
+            assert isinstance(field, Column)
+            query._on_duplicate_update_fields.append(field.values())
+        return query
+
+    def on_conflict(self, *columns):
+        """
+        The unique columns the ON DUPLICATE KEY UPDATE is about, PostgreSQL and SQLite render it as
+        `ON CONFLICT (columns) DO UPDATE`. MySQL ignores them.
+        """
+        query = self._derive()
+        query._conflict_target = _conflict_target(query._tables, columns)
+        return query
+
+    def frozen(self):
+        # a generator of rows can only be consumed once
+        if not isinstance(self._rows, list):
+            self._rows = list(self._rows)
+        return super(InsertMany, self).frozen()
+
+    def _row_values(self, row):
+        if isinstance(row, dict):
+            return [row[field.name] for field in self._fields]
+        row = list(row)
+        assert len(row) == len(self._fields)
+        return row
+
+    def _pieces(self, placeholder, dialect=None):
+        c = _Compiler(placeholder, dialect)
+        head = "INSERT INTO {table}({fields}) VALUES".format(
+            table=self._tables._raw(c), fields=", ".join(c.ident(field.name) for field in self._fields))
+        row_tpl = "({})".format(", ".join([placeholder] * len(self._fields)))
+        tail = ""
+        tail_args = []
         if self._on_duplicate_update_fields:
-            ts = []
-            update_args = []
-            for each in self._on_duplicate_update_fields:
-                s, a = each.sql(placeholder)
-                ts.append(s)
-                update_args.extend(a)
-            sql_pieces.append("ON DUPLICATE KEY UPDATE {}".format(
-                ", ".join(ts)
-            ))
-            args.extend(update_args)
-            # sql_pieces.append("ON DUPLICATE KEY UPDATE {}".format(
-            #     ", ".join("{}={}".format(pair.field.insert_view, placeholder) for pair in self._on_duplicate_update_fields)))
-            # args.extend([pair.value for pair in self._on_duplicate_update_fields])
-        return " ".join(sql_pieces), args
+            _compile_upsert(c, self)
+            tail, tail_args = c.result()
+        return head, row_tpl, tail, tail_args
+
+    def statements(self, placeholder="%s", max_rows=MAX_ROWS, max_packet_size=MAX_PACKET_SIZE, dialect=None):
+        """
+        Yield (sql, args) of multi-row INSERTs with at most `max_rows` rows each, and whose estimated
+        size, SQL text plus escaped args, doesn't exceed `max_packet_size` bytes. With a `dialect` its
+        placeholders are used instead of `placeholder`.
+        """
+        assert max_rows > 0
+        if dialect is not None:
+            placeholder = dialect.placeholder
+        head, row_tpl, tail, tail_args = self._pieces(placeholder, dialect)
+
+        def text(rows):
+            sql = "{}{}{}".format(head, ", ".join([row_tpl] * rows), tail)
+            return sql if dialect is None else dialect._finish(sql)
+
+        base_size = len(head) + len(tail) + sum(_estimate_arg_size(arg) for arg in tail_args)
+        row_tpl_size = len(row_tpl) + 2
+        full_sql = None
+        args = []
+        rows = 0
+        size = base_size
+        for row in self._rows:
+            values = self._row_values(row)
+            row_size = row_tpl_size + sum(_estimate_arg_size(value) for value in values)
+            if base_size + row_size > max_packet_size:
+                raise ValueError("a single row exceeds the max packet size {:d}".format(max_packet_size))
+            if rows and (rows >= max_rows or size + row_size > max_packet_size):
+                if rows == max_rows:
+                    if full_sql is None:
+                        full_sql = text(rows)
+                    yield full_sql, args + tail_args
+                else:
+                    yield text(rows), args + tail_args
+                args = []
+                rows = 0
+                size = base_size
+            args.extend(values)
+            rows += 1
+            size += row_size
+        if rows:
+            yield text(rows), args + tail_args
+
+    def _shape(self):
+        return ("insert_many", self._tables._shape(), tuple(field.name for field in self._fields),
+                len(self._rows) if isinstance(self._rows, list) else None,
+                tuple(each._shape() for each in self._on_duplicate_update_fields)) + _conflict_shape(self)
+
+    def _render(self, placeholder="%s", dialect=None):
+        if not isinstance(self._rows, list):
+            self._rows = list(self._rows)
+        assert self._rows
+        head, row_tpl, tail, tail_args = self._pieces(placeholder, dialect)
+        args = []
+        for row in self._rows:
+            args.extend(self._row_values(row))
+        args.extend(tail_args)
+        return "{}{}{}".format(head, ", ".join([row_tpl] * len(self._rows)), tail), args
+
+    def _collect_args(self, args):
+        if not isinstance(self._rows, list):
+            self._rows = list(self._rows)
+        for row in self._rows:
+            args.extend(self._row_values(row))
+        for each in self._on_duplicate_update_fields:
+            each._collect_args(args)
 
 
 class InsertFromSelect(_Query):
+    _mutables = ("_on_duplicate_update_fields",)
+    _conflict_target = ()
+
     def __init__(self, table, fields, sub_query):
         assert isinstance(table, Table)
         super(InsertFromSelect, self).__init__(table)
@@ -790,56 +1975,68 @@ class InsertFromSelect(_Query):
         self._on_duplicate_update_fields = []
 
     def on_duplicate_key_fields(self, *pairs):
-        if not isinstance(self._sub_query, _SubQueryTable):
+        query = self._derive()
+        if not isinstance(query._sub_query, _SubQueryTable):
             raise TypeError("The sub-query must be used as a table")
         assert pairs and len(pairs) % 2 == 0
         for cursor in range(0, len(pairs), 2):
             key, val = pairs[cursor:cursor + 2]
             assert isinstance(key, Column)
-            assert key.table is self._tables
+            assert key.table is query._tables
             assert isinstance(val, Column)
-            assert val.table is self._sub_query
-            self._on_duplicate_update_fields.append(ColumnUpdating(key, val))
-        return self
+            assert val.table is query._sub_query
+            query._on_duplicate_update_fields.append(ColumnUpdating(key, val))
+        return query
 
     def on_duplicate_key_update(self, *updating, **kwargs):
+        query = self._derive()
         for each in updating:
             assert isinstance(each, ColumnUpdating)
-            self._on_duplicate_update_fields.append(each)
+            query._on_duplicate_update_fields.append(each)
         for col, val in kwargs.items():
             assert isinstance(val, Column)
-            up = ColumnUpdating(Column(self._tables, col), val)
-            self._on_duplicate_update_fields.append(up)
-        return self
-
-    def sql(self, placeholder="%s"):
-        if isinstance(self._sub_query, Select):
-            sub_query_sql, sub_query_args = self._sub_query.sql(placeholder)
+            up = ColumnUpdating(Column(query._tables, col), val)
+            query._on_duplicate_update_fields.append(up)
+        return query
+
+    def on_conflict(self, *columns):
+        """
+        The unique columns the ON DUPLICATE KEY UPDATE is about, PostgreSQL and SQLite render it as
+        `ON CONFLICT (columns) DO UPDATE`. MySQL ignores them.
+        """
+        query = self._derive()
+        query._conflict_target = _conflict_target(query._tables, columns)
+        return query
+
+    def _compile(self, c):
+        parts = c.parts
+        parts.append("INSERT INTO {table}({fields}) ".format(
+            table=self._tables._raw(c), fields=", ".join(c.ident(field.name) for field in self._fields)))
+        if c.dialect is not None:
+            c.dialect._compile_insert_source(c, self)
+        elif isinstance(self._sub_query, Select):
+            self._sub_query._compile(c)
         elif isinstance(self._sub_query, _SubQueryTable):
-            sub_query_sql, sub_query_args = self._sub_query.from_view(placeholder)
+            self._sub_query._compile_from(c)
         else:
             raise ValueError("Unknown")
-        sql_pieces = ["INSERT INTO {table}({fields}) {sub_query}".format(table=self._tables.raw_view,
-                                                                         fields=", ".join(field.insert_view for field in
-                                                                                          self._fields),
-                                                                         sub_query=sub_query_sql)]
         if self._on_duplicate_update_fields:
-            # sql_pieces.append("ON DUPLICATE KEY UPDATE {}".format(
-            #     ", ".join("{}={}".format(pair.field.insert_view, pair.value.where_view) for pair in self._on_duplicate_update_fields)))
-            ts = []
-            update_args = []
-            for each in self._on_duplicate_update_fields:
-                s, a = each.sql(placeholder)
-                ts.append(s)
-                update_args.extend(a)
-            sql_pieces.append("ON DUPLICATE KEY UPDATE {}".format(
-                ", ".join(ts)
-            ))
-            sub_query_args.extend(update_args)
-        return " ".join(sql_pieces), sub_query_args
+            _compile_upsert(c, self)
+
+    def _shape(self):
+        return ("insert_select", self._tables._shape(), tuple(field.name for field in self._fields),
+                self._sub_query._shape(), tuple(each._shape() for each in self._on_duplicate_update_fields)) + \
+            _conflict_shape(self)
+
+    def _collect_args(self, args):
+        self._sub_query._collect_args(args)
+        for each in self._on_duplicate_update_fields:
+            each._collect_args(args)
 
 
 class Update(_Query):
+    _mutables = ("_pairs",)
+
     def __init__(self, table, *pairs, **pairs_kwargs):
         assert isinstance(table, Table)
         super(Update, self).__init__(tables=table)
@@ -855,44 +2052,205 @@ class Update(_Query):
             self._pairs.append(ColumnUpdating(getattr(table, key), val))
 
     def where(self, cond):
+        query = self._derive()
         assert cond is None or isinstance(cond, _Where)
-        self._where = cond
-        return self
+        query._where = cond
+        return query
 
     def add_fields(self, *pairs, **pairs_kwargs):
+        query = self._derive()
         assert len(pairs) % 2 == 0
         for cursor in range(0, len(pairs), 2):
             key, val = pairs[cursor:cursor + 2]
             assert isinstance(key, Column)
-            assert key.table is None or key.table is self._tables
-            self._pairs.append(ColumnUpdating(key, val))
+            assert key.table is None or key.table is query._tables
+            query._pairs.append(ColumnUpdating(key, val))
         for key, val in pairs_kwargs.items():
-            self._pairs.append(ColumnUpdating(getattr(self._tables, key), val))
-        return self
+            query._pairs.append(ColumnUpdating(getattr(query._tables, key), val))
+        return query
 
     def update(self, *updating):
+        query = self._derive()
         for each in updating:
             assert isinstance(each, ColumnUpdating)
-            self._pairs.append(each)
-        return self
+            query._pairs.append(each)
+        return query
+
+    def _compile(self, c):
+        parts = c.parts
+        parts.append("UPDATE {} SET ".format(self._tables._raw(c)))
+        for i, each in enumerate(self._pairs):
+            if i:
+                parts.append(", ")
+            each._compile(c)
+        if self._where and not self._where.is_empty():
+            parts.append(" WHERE ")
+            self._where._compile(c)
 
-    def sql(self, placeholder="%s"):
-        args = []
-        update_pieces = []
+    def _shape(self):
+        return ("update", self._tables._shape(), tuple(each._shape() for each in self._pairs),
+                self._where._shape() if self._where else None)
+
+    def _collect_args(self, args):
         for each in self._pairs:
-            s, a = each.sql(placeholder)
-            update_pieces.append(s)
-            args.extend(a)
-        sql_pieces = ["UPDATE {} SET {}".format(self._tables.raw_view,
-                                                ", ".join(update_pieces))]
-        if self._where and not self._where.is_empty():
-            where_clause, where_args = self._where.sql(placeholder)
-            sql_pieces.append("WHERE {}".format(where_clause))
-            args.extend(where_args)
-        return " ".join(sql_pieces), args
+            each._collect_args(args)
+        if self._where:
+            self._where._collect_args(args)
+
+
+class UpdateMany(_Query):
+    """
+    UPDATE of many rows with a different value each, rendered as
+    `UPDATE t SET c = CASE id WHEN %s THEN %s ... ELSE c END, ... WHERE id IN (...)`.
+    `rows` maps a key value to the updates of that row: a dict of column (or column name) to a value,
+    or to a ColumnUpdating such as `t.c.inc(2)`.
+    """
+    MAX_ROWS = 500
+    MAX_PACKET_SIZE = InsertMany.MAX_PACKET_SIZE
+    _mutables = ("_rows",)
+    # the text depends on the rows
+    _cacheable = False
+
+    def __init__(self, table, key, rows=None):
+        assert isinstance(table, Table)
+        super(UpdateMany, self).__init__(tables=table)
+        if isinstance(key, basestring):
+            key = getattr(table, key)
+        assert isinstance(key, Column)
+        assert key.table is None or key.table is table
+        self._key = key
+        self._rows = []
+        self._where = None
+        if rows is not None:
+            self.add_rows(rows)
+
+    def add_rows(self, rows):
+        """A mapping of key to updates, or an iterable of (key, updates) pairs."""
+        query = self._derive()
+        if isinstance(rows, dict):
+            rows = rows.items()
+        for key, updates in rows:
+            query._rows.append((key, query._updatings(updates)))
+        return query
+
+    def where(self, cond):
+        """An extra condition, ANDed with the IN list of keys."""
+        query = self._derive()
+        assert cond is None or isinstance(cond, _Where)
+        query._where = cond
+        return query
+
+    def _updatings(self, updates):
+        updatings = []
+        for col, value in updates.items():
+            if isinstance(col, basestring):
+                col = getattr(self._tables, col)
+            assert isinstance(col, Column)
+            if isinstance(value, ColumnUpdating):
+                assert value.column.name == col.name
+                assert value.op != ColumnUpdating.OP_VALUES
+            else:
+                value = ColumnUpdating(col, value)
+            updatings.append(value)
+        return updatings
+
+    def _row_args_size(self, key, updatings):
+        return _estimate_arg_size(key) * (len(updatings) + 1) + sum(
+            _estimate_arg_size(each.value) for each in updatings)
+
+    @staticmethod
+    def _columns(rows):
+        """The (key, ColumnUpdating) pairs of each updated column, in the order the CASEs render them."""
+        columns = collections.OrderedDict()
+        for key, updatings in rows:
+            for each in updatings:
+                columns.setdefault(each.column.name, []).append((key, each))
+        return columns
+
+    def _render_rows(self, rows, placeholder, dialect=None):
+        columns = self._columns(rows)
+        c = _Compiler(placeholder, dialect)
+        key_view = self._key._ref(c)
+        set_pieces = []
+        args = []
+        for name, items in columns.items():
+            col = c.ident(name)
+            whens = []
+            for key, each in items:
+                if isinstance(each.value, Column):
+                    value = each.value._ref(c)
+                else:
+                    value = placeholder
+                if each.op == ColumnUpdating.OP_INC:
+                    value = "{} + {}".format(col, value)
+                elif each.op == ColumnUpdating.OP_DEC:
+                    value = "{} - {}".format(col, value)
+                whens.append("WHEN {} THEN {}".format(placeholder, value))
+                args.append(key)
+                each._collect_args(args)
+            set_pieces.append("{col} = CASE {key} {whens} ELSE {col} END".format(
+                col=col, key=key_view, whens=" ".join(whens)))
+        where = Condition(self._key, Condition.OP_IN, [key for key, _ in rows])
+        if self._where is not None:
+            where = where & self._where
+        where_clause, where_args = _compiled(where, placeholder, dialect)
+        args.extend(where_args)
+        return "UPDATE {} SET {} WHERE {}".format(self._tables._raw(c), ", ".join(set_pieces), where_clause), args
+
+    def statements(self, placeholder="%s", max_rows=MAX_ROWS, max_packet_size=MAX_PACKET_SIZE, dialect=None):
+        """Yield (sql, args) updating at most `max_rows` rows each, within an estimated `max_packet_size`."""
+        assert max_rows > 0
+        if dialect is not None:
+            placeholder = dialect.placeholder
+
+        def render(rows):
+            sql, args = self._render_rows(rows, placeholder, dialect)
+            return (sql if dialect is None else dialect._finish(sql)), args
+
+        # the SQL text of a row is about the same size as its args
+        chunk = []
+        size = 0
+        for key, updatings in self._rows:
+            row_size = 2 * self._row_args_size(key, updatings) + 32 * (len(updatings) + 1)
+            if chunk and (len(chunk) >= max_rows or size + row_size > max_packet_size):
+                yield render(chunk)
+                chunk = []
+                size = 0
+            chunk.append((key, updatings))
+            size += row_size
+        if chunk:
+            yield render(chunk)
+
+    def _render(self, placeholder="%s", dialect=None):
+        assert self._rows
+        return self._render_rows(self._rows, placeholder, dialect)
+
+    def _shape(self):
+        columns = sorted(set(each.column.name for _, updatings in self._rows for each in updatings))
+        return ("update_many", self._tables._shape(), self._key._shape(), tuple(columns), len(self._rows),
+                self._where._shape() if self._where else None)
+
+    def _identity(self):
+        # the shape only has the updated columns, the CASEs also depend on the columns and ops of every row
+        cls, shape, args = super(UpdateMany, self)._identity()
+        rows = tuple(tuple(each._shape() for each in updatings) for _, updatings in self._rows)
+        return cls, (shape, rows), args
+
+    def _collect_args(self, args):
+        for items in self._columns(self._rows).values():
+            for key, each in items:
+                args.append(key)
+                each._collect_args(args)
+        args.extend(key for key, _ in self._rows)
+        if self._where is not None:
+            self._where._collect_args(args)
 
 
 class Select(_Query):
+    _mutables = ("_sort",)
+    # forced to the primary by use_primary()
+    _primary = False
+
     def __init__(self, tables, fields=None, where=None, sort=None, group=None, offset=0, count=0):
         super(Select, self).__init__(tables)
         assert fields is None or (isinstance(fields, (list, tuple)))
@@ -914,17 +2272,20 @@ class Select(_Query):
         self._group = group
         self._offset = offset
         self._count = count
+        self._seek = None
 
     def __getitem__(self, item):
+        query = self._derive()
         if not isinstance(item, slice):
             raise TypeError("select doesn't support")
         assert item.start >= 0
         assert item.stop > item.start
-        self._offset = item.start
-        self._count = item.stop - item.start
-        return self
+        query._offset = item.start
+        query._count = item.stop - item.start
+        return query
 
     def select(self, *fields):
+        query = self._derive()
         _fields = []
         for field in fields:
             if isinstance(field, basestring):
@@ -932,62 +2293,218 @@ class Select(_Query):
             else:
                 assert isinstance(field, _Column)
                 _fields.append(field)
-        self._fields = _fields
-        return self
+        query._fields = _fields
+        return query
 
     def where(self, cond):
+        query = self._derive()
         assert isinstance(cond, _Where)
-        self._where = cond
-        return self
+        query._where = cond
+        return query
 
     def group(self, *cols):
+        query = self._derive()
         assert len(cols) > 0
         if len(cols) == 1 and isinstance(cols[0], GroupBy):
-            self._group = cols[0]
+            query._group = cols[0]
         else:
-            self._group = GroupBy(*cols)
-        return self
+            query._group = GroupBy(*cols)
+        return query
 
     def asc(self, column):
+        query = self._derive()
         assert isinstance(column, Column)
-        assert column.table in self._tables
-        if not self._sort:
-            self._sort = Sort(column)
+        assert column.table in query._tables
+        if not query._sort:
+            query._sort = Sort(column)
         else:
-            self._sort.asc(column)
-        return self
+            query._sort.asc(column)
+        return query
 
     def desc(self, column):
+        query = self._derive()
         assert isinstance(column, Column)
-        assert column.table in self._tables
-        if not self._sort:
-            self._sort = Sort(column, Sort.DESC)
+        assert column.table in query._tables
+        if not query._sort:
+            query._sort = Sort(column, Sort.DESC)
         else:
-            self._sort.desc(column)
-        return self
+            query._sort.desc(column)
+        return query
 
     def as_table(self, alias):
         return _SubQueryTable(alias, self)
 
-    def sql(self, placeholder="%s"):
-        sql_pieces = []
-        args = []
-        fields = self._fields and ", ".join(
-            field.field_view for field in self._fields) or "*"
-        from_sql, from_args = self._tables.from_view(placeholder)
-        sql_pieces.append("SELECT {fields} FROM {tables}".format(fields=fields, tables=from_sql))
-        args.extend(from_args)
-        if self._where and not self._where.is_empty():
-            where_clause, where_args = self._where.sql(placeholder)
-            sql_pieces.append("WHERE {where}".format(where=where_clause))
-            args.extend(where_args)
+    def stream(self, connection, batch_size=1000, placeholder=None, cursor=None):
+        """
+        Generator over the rows of the query on a DB-API connection, with a server-side / unbuffered
+        cursor when the driver has one and `fetchmany` batches otherwise, so memory stays bounded.
+        Leaving the loop early closes the cursor.
+        """
+        from .executor import paramstyle_of, placeholder_for, stream
+        if placeholder is None:
+            placeholder = placeholder_for(paramstyle_of(connection))
+        sql, args = self.sql(placeholder)
+        return stream(connection, sql, args, batch_size, cursor)
+
+    def fetch_columns(self, connection, batch_size=10000, types=None, as_numpy=False, placeholder=None):
+        """
+        Run the query on a DB-API connection and return an OrderedDict of field name (alias or name of
+        the selected column) to an `array.array` or list of its values, or NumPy arrays with `as_numpy`.
+        See `sql_builder.columnar.fetch_columns`.
+        """
+        from .columnar import fetch_columns
+        return fetch_columns(self, connection, batch_size, types, as_numpy, placeholder)
+
+    def iterate(self, pool, batch_size=100):
+        """`async for row in query.iterate(pool)` with an asyncio pool from `sql_builder.aio`."""
+        return pool.iterate(self, batch_size)
+
+    def use_primary(self, enabled=True):
+        """Run the query on the primary with a `sql_builder.routing.Router`, instead of on a replica."""
+        query = self._derive()
+        query._primary = enabled
+        return query
+
+    def seek(self, values, expand=False):
+        """
+        Keyset pagination, only keep the rows after `values`, the ORDER BY values of the last row read.
+        Renders `(a, b) > (%s, %s)` when all the ORDER BY columns go the same way, and the expanded
+        `a > %s OR (a = %s AND b > %s)` form for mixed directions or when `expand` is set.
+        The ORDER BY columns must be NOT NULL, nothing compares greater than NULL: a None value raises
+        ValueError. The last one should be unique, e.g. the primary key, or rows tied with the last row
+        read are skipped.
+        """
+        query = self._derive()
+        assert query._sort, "seek needs ORDER BY columns"
+        if values is None:
+            query._seek = None
+            return query
+        values = tuple(values)
+        assert len(values) == len(query._sort._tuples)
+        for (col, _), value in zip(query._sort._tuples, values):
+            if value is None:
+                raise ValueError("can't seek past a NULL {}, keyset pagination needs NOT NULL ORDER BY columns".format(
+                    col.raw_view))
+        query._seek = (values, expand)
+        return query
+
+    def _seek_condition(self):
+        values, expand = self._seek
+        cols = [col for col, _ in self._sort._tuples]
+        ops = [Condition.OP_GT if method == Sort.ASC else Condition.OP_LT for _, method in self._sort._tuples]
+        if len(cols) == 1:
+            return Condition(cols[0], ops[0], values[0])
+        if not expand and len(set(ops)) == 1:
+            return RowCondition(cols, ops[0], values)
+        terms = []
+        for i in range(len(cols)):
+            term = [Condition(cols[j], Condition.OP_EQ, values[j]) for j in range(i)]
+            term.append(Condition(cols[i], ops[i], values[i]))
+            terms.append(term[0] if len(term) == 1 else ConditionUnion._from_list(term, ConditionUnion.OP_AND))
+        return ConditionUnion._from_list(terms, ConditionUnion.OP_OR)
+
+    def never_matches(self):
+        # without GROUP BY, aggregates return a row even when nothing matches
+        return super(Select, self).never_matches() and \
+            (bool(self._group) or all(isinstance(field, Column) for field in self._fields))
+
+    def _effective_where(self):
+        where = self._where
+        if where is not None and where.is_empty():
+            where = None
+        if self._seek is None:
+            return where
+        seek = self._seek_condition()
+        return seek if where is None else where & seek
+
+    def _seek_key(self):
+        positions = []
+        for col, _ in self._sort._tuples:
+            for i, field in enumerate(self._fields):
+                if isinstance(field, Column) and field.name and field.raw_view == col.raw_view:
+                    positions.append((i, field.alias or field.name))
+                    break
+            else:
+                raise ValueError("ORDER BY column {} is not selected, pass `key`".format(col.raw_view))
+
+        def key(row):
+            if isinstance(row, dict):
+                return tuple(row[name] for _, name in positions)
+            return tuple(row[i] for i, _ in positions)
+
+        return key
+
+    def pages(self, connection, page_size, placeholder=None, key=None, expand=False):
+        """
+        Walk the whole result set with keyset pagination on a DB-API connection, yielding a list of rows
+        per page. `key` extracts the ORDER BY values from a row, by default they're read from the
+        selected ORDER BY columns. They must be NOT NULL and end with a unique one, see `seek`: a page
+        ending with a NULL raises ValueError.
+        """
+        assert self._sort, "pages needs ORDER BY columns"
+        assert page_size > 0
+        if placeholder is None:
+            from .executor import paramstyle_of, placeholder_for
+            placeholder = placeholder_for(paramstyle_of(connection))
+        if key is None:
+            key = self._seek_key()
+        query = copy.copy(self)
+        query._offset = 0
+        query._count = page_size
+        query._seek = None
+        while True:
+            sql, args = query.sql(placeholder)
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql, args)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            query = query.seek(key(rows[-1]), expand)
+
+    def _compile(self, c):
+        parts = c.parts
+        parts.append("SELECT {} FROM ".format(self._fields and ", ".join(
+            field._field(c) for field in self._fields) or "*"))
+        self._tables._compile_from(c)
+        where = self._effective_where()
+        if where is not None:
+            parts.append(" WHERE ")
+            where._compile(c)
         if self._group:
-            sql_pieces.append("GROUP BY {}".format(self._group.sql))
+            parts.append(" GROUP BY ")
+            self._group._compile(c)
         if self._sort:
-            sql_pieces.append("ORDER BY {}".format(self._sort.sql))
+            parts.append(" ORDER BY ")
+            self._sort._compile(c)
         if self._count > 0:
-            sql_pieces.append("LIMIT {:d}, {:d}".format(self._offset, self._count))
-        return " ".join(sql_pieces), args
+            if c.dialect is not None:
+                c.dialect._compile_limit(c, self._offset, self._count)
+            else:
+                parts.append(" LIMIT {:d}, {:d}".format(self._offset, self._count))
+
+    def _shape(self):
+        return ("select", tuple(field._shape() for field in self._fields), self._tables._shape(),
+                self._where._shape() if self._where else None,
+                self._group._shape() if self._group else None,
+                self._sort._shape() if self._sort else None,
+                self._offset if self._count > 0 else 0, self._count,
+                self._seek and (tuple(value is None for value in self._seek[0]), self._seek[1]))
+
+    def _identity(self):
+        # the same SQL, but a use_primary() query isn't routed to the replicas
+        cls, shape, args = super(Select, self)._identity()
+        return cls, (shape, self._primary), args
+
+    def _collect_args(self, args):
+        self._tables._collect_args(args)
+        where = self._effective_where()
+        if where is not None:
+            where._collect_args(args)
 
 
 class Delete(_Query):
@@ -997,20 +2514,25 @@ class Delete(_Query):
         self.where(where)
 
     def where(self, cond):
+        query = self._derive()
         assert cond is None or isinstance(cond, _Where)
-        self._where = cond
-        return self
+        query._where = cond
+        return query
 
-    def sql(self, placeholder="%s"):
-        args = []
-        from_sql, from_args = self._tables.from_view(placeholder)
-        args.extend(from_args)
-        sql_pieces = ["DELETE FROM {table}".format(table=from_sql)]
+    def _compile(self, c):
+        c.parts.append("DELETE FROM ")
+        self._tables._compile_from(c)
         if self._where and not self._where.is_empty():
-            where_clause, where_args = self._where.sql(placeholder)
-            sql_pieces.append("WHERE {}".format(where_clause))
-            args.extend(where_args)
-        return " ".join(sql_pieces), args
+            c.parts.append(" WHERE ")
+            self._where._compile(c)
+
+    def _shape(self):
+        return "delete", self._tables._shape(), self._where._shape() if self._where else None
+
+    def _collect_args(self, args):
+        self._tables._collect_args(args)
+        if self._where:
+            self._where._collect_args(args)
 
 
 if __name__ == "__main__":
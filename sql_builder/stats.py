@@ -0,0 +1,94 @@
+# coding: utf-8
+"""
+Client-side statement statistics, in the spirit of pg_stat_statements.
+
+    stats = StatementStats(max_statements=5000)
+    stats.install()  # record every execution by an Executor or an asyncio pool
+    ...
+    push_metrics(stats.export(reset=True))
+
+Statements are grouped by `query.fingerprint()`, so the same statement with other values, another IN
+list length or another LIMIT counts as one.
+"""
+import collections
+import threading
+
+from . import profiling
+
+StatementStat = collections.namedtuple("StatementStat", ["fingerprint", "statement", "sql", "calls", "total_time",
+                                                         "mean_time", "max_time", "rows"])
+
+
+class StatementStats(object):
+    """
+    A thread-safe registry of execution statistics per fingerprint. When `max_statements` fingerprints
+    are tracked, the least called 5% are dropped to make room for new ones, see `evicted`.
+    """
+
+    def __init__(self, max_statements=5000, sql_length=1000):
+        assert max_statements > 0
+        self.max_statements = max_statements
+        self.sql_length = sql_length
+        self.evicted = 0
+        self._lock = threading.Lock()
+        # fingerprint -> [statement, sql, calls, total time, max time, rows]
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def record(self, query, duration, rows=None, sql=None):
+        """Account one execution of `query` that took `duration` seconds and returned / affected `rows`."""
+        fingerprint = query.fingerprint()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                if len(self._entries) >= self.max_statements:
+                    self._evict()
+                if sql is None:
+                    sql = query.sql()[0]
+                entry = self._entries[fingerprint] = [type(query).__name__, sql[:self.sql_length], 0, 0.0, 0.0, 0]
+            entry[2] += 1
+            entry[3] += duration
+            if duration > entry[4]:
+                entry[4] = duration
+            if rows is not None and rows > 0:
+                entry[5] += rows
+
+    def _evict(self):
+        count = max(1, self.max_statements // 20)
+        least_called = sorted(self._entries.items(), key=lambda item: (item[1][2], item[1][3]))[:count]
+        for fingerprint, _ in least_called:
+            del self._entries[fingerprint]
+        self.evicted += len(least_called)
+
+    def __call__(self, event):
+        self.record(event.query, event.duration, event.rows, event.sql)
+
+    def install(self):
+        """Record the executions of all executors, through `sql_builder.profiling`."""
+        profiling.add_hook(self, build=False)
+
+    def uninstall(self):
+        profiling.remove_hook(self)
+
+    def snapshot(self, reset=False):
+        """The statistics as StatementStat tuples, by decreasing total time."""
+        with self._lock:
+            items = list(self._entries.items())
+            if reset:
+                self._entries = {}
+                self.evicted = 0
+        stats = [StatementStat(fingerprint, entry[0], entry[1], entry[2], entry[3], entry[3] / entry[2], entry[4],
+                               entry[5]) for fingerprint, entry in items]
+        stats.sort(key=lambda each: each.total_time, reverse=True)
+        return stats
+
+    def export(self, reset=False):
+        """The statistics as a list of plain dicts, e.g. to be serialized to JSON."""
+        return [dict(each._asdict()) for each in self.snapshot(reset)]
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+            self.evicted = 0
@@ -0,0 +1,141 @@
+# coding: utf-8
+import gc
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+from sql_builder import ConnectionPool, Table, ValuesTable
+from sql_builder.dialects import SQLITE
+
+
+@unittest.skipIf(sys.version_info < (3, 6), "asyncio pools need Python 3.6+")
+class ThreadedIterateTest(unittest.TestCase):
+    def setUp(self):
+        import asyncio
+        from sql_builder.aio import ThreadedAsyncPool
+        self.directory = tempfile.mkdtemp()
+        self.pool = ConnectionPool(sqlite3, min_size=0, max_size=2, database=os.path.join(self.directory, "t.db"),
+                                   check_same_thread=False)
+        with self.pool.connection() as connection:
+            connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY)")
+            connection.executemany("INSERT INTO student VALUES (?)", [(i,) for i in range(50)])
+            connection.commit()
+        self.loop = asyncio.new_event_loop()
+        self.async_pool = ThreadedAsyncPool(self.pool)
+        self.student = Table("student")
+
+    def tearDown(self):
+        self.async_pool.close()
+        self.loop.close()
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def read(self, rows, count):
+        return [self.run_async(rows.__anext__()) for _ in range(count)]
+
+    def test_exhausted(self):
+        rows = self.student.select(self.student.id).iterate(self.async_pool, batch_size=7)
+        read = []
+        while True:
+            try:
+                read.append(self.run_async(rows.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(len(read), 50)
+        self.assertEqual(self.pool.idle, 1)
+
+    def test_context_manager(self):
+        rows = self.student.select(self.student.id).iterate(self.async_pool, batch_size=7)
+        self.assertIs(self.run_async(rows.__aenter__()), rows)
+        self.assertEqual(self.read(rows, 3), [(0,), (1,), (2,)])
+        self.assertEqual(self.pool.idle, 0)
+        self.run_async(rows.__aexit__(None, None, None))
+        self.assertEqual(self.pool.idle, 1)
+
+    def test_close_pool_first(self):
+        query = self.student.select(self.student.id)
+        dropped = query.iterate(self.async_pool, batch_size=7)
+        closed = query.iterate(self.async_pool, batch_size=7)
+        self.read(dropped, 3)
+        self.read(closed, 3)
+        self.assertEqual(self.pool.idle, 0)
+        self.async_pool.close()
+        self.assertEqual(self.pool.idle, 2)
+        # nothing left to schedule on the stopped workers
+        self.run_async(closed.aclose())
+        unraisable = []
+        hook = getattr(sys, "unraisablehook", None)
+        sys.unraisablehook = unraisable.append
+        try:
+            del dropped
+            gc.collect()
+        finally:
+            if hook is not None:
+                sys.unraisablehook = hook
+        self.assertEqual(unraisable, [])
+
+
+@unittest.skipIf(sys.version_info < (3, 6), "asyncio pools need Python 3.6+")
+class DialectTest(unittest.TestCase):
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.student = Table("student")
+        # a VALUES derived table only runs on SQLite when rendered for it
+        values = ValuesTable("v", [(1,), (3,)])
+        self.query = self.student.join(values, self.student.id == values.column_0).select(self.student.id)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def fill(self, connection):
+        connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT)")
+        connection.executemany("INSERT INTO student VALUES (?, ?)", [(i, "a") for i in range(5)])
+        connection.commit()
+
+    def upsert(self):
+        s = self.student
+        return s.insert(id=1, name="b").on_duplicate_key_update(s.name.values()).on_conflict("id")
+
+    def test_async_pool(self):
+        from sql_builder.aio import AsyncConnectionPool
+        connection = sqlite3.connect(":memory:")
+        self.fill(connection)
+        pool = AsyncConnectionPool(lambda: connection, "qmark", max_size=1, dialect=SQLITE)
+        self.assertEqual(self.run_async(pool.fetch_all(self.query)), [(1,), (3,)])
+        self.run_async(pool.execute(self.upsert()))
+        self.assertEqual(connection.execute("SELECT name FROM student WHERE id = 1").fetchone(), ("b",))
+        rows = pool.iterate(self.query).__aiter__()
+        self.assertEqual([self.run_async(rows.__anext__()) for _ in range(2)], [(1,), (3,)])
+        self.assertRaises(StopAsyncIteration, self.run_async, rows.__anext__())
+        self.run_async(pool.close())
+        connection.close()
+
+    def test_threaded_pool(self):
+        from sql_builder.aio import ThreadedAsyncPool
+        pool = ConnectionPool(sqlite3, min_size=1, max_size=1, database=":memory:", check_same_thread=False)
+        with pool.connection() as connection:
+            self.fill(connection)
+        async_pool = ThreadedAsyncPool(pool, dialect=SQLITE)
+        self.assertEqual(self.run_async(async_pool.fetch_all(self.query)), [(1,), (3,)])
+        self.run_async(async_pool.execute(self.upsert()))
+        self.assertEqual(self.run_async(async_pool.fetch_one(self.student.select(self.student.name)
+                                                              .where(self.student.id == 1))), ("b",))
+        rows = async_pool.iterate(self.query)
+        self.assertEqual([self.run_async(rows.__anext__()) for _ in range(2)], [(1,), (3,)])
+        self.run_async(rows.aclose())
+        async_pool.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
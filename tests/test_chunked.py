@@ -0,0 +1,79 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import ChunkedRunner, ConnectionPool, Delete, Executor, Table
+from sql_builder.dialects import SQLITE
+
+
+class ChunkedRunnerTest(unittest.TestCase):
+    def setUp(self):
+        # one connection, the in-memory database lives as long as it does
+        self.pool = ConnectionPool(sqlite3, min_size=1, max_size=1, max_idle_time=3600, database=":memory:")
+        self.executor = Executor(self.pool, dialect=SQLITE)
+        with self.pool.connection() as connection:
+            connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT, age INTEGER)")
+            connection.execute("CREATE TABLE archive (id INTEGER PRIMARY KEY, name TEXT)")
+            connection.executemany("INSERT INTO student VALUES (?, ?, ?)",
+                                   [(i, "s{:d}".format(i), i % 2) for i in range(1, 101)])
+            connection.executemany("INSERT INTO archive VALUES (?, ?)", [(i, "old") for i in range(1, 101, 10)])
+            connection.commit()
+        self.student = Table("student")
+        self.archive = Table("archive")
+
+    def tearDown(self):
+        self.pool.close()
+
+    def rows(self, sql):
+        with self.pool.connection() as connection:
+            return connection.execute(sql).fetchall()
+
+    def run_chunks(self, query, **options):
+        progress = []
+        runner = ChunkedRunner(self.executor, query, self.student.id, chunk_size=10, checkpoint=progress.append,
+                               **options)
+        return runner.run(), progress
+
+    def test_delete(self):
+        s = self.student
+        total, progress = self.run_chunks(Delete(s).where(s.age == 1))
+        self.assertEqual(total, 50)
+        self.assertEqual(self.rows("SELECT COUNT(*) FROM student WHERE age = 1"), [(0,)])
+        self.assertEqual(self.rows("SELECT COUNT(*) FROM student"), [(50,)])
+        # the ranges follow each other from the first to the last key
+        self.assertEqual((progress[0].lower, progress[-1].upper), (1, 100))
+        for before, after in zip(progress, progress[1:]):
+            self.assertEqual(before.next_key, after.lower)
+
+    def test_update_resumed(self):
+        s = self.student
+        total, progress = self.run_chunks(s.update(name="x").where(s.age == 0), resume_from=51)
+        self.assertEqual(total, 25)
+        self.assertEqual(progress[0].lower, 51)
+        self.assertEqual(self.rows("SELECT MIN(id), MAX(id), COUNT(*) FROM student WHERE name = 'x'"), [(52, 100, 25)])
+
+    def test_chunk_query(self):
+        s = self.student
+        runner = ChunkedRunner(self.executor, Delete(s).where(s.age == 1), s.id)
+        self.assertEqual(runner.chunk_query(1, 11).sql(),
+                         ("DELETE FROM `student` WHERE `student`.`age` = %s AND `student`.`id` >= %s AND "
+                          "`student`.`id` < %s", [1, 1, 11]))
+        self.assertEqual(runner.bounds(), (1, 99))
+        # the statement itself is left alone
+        self.assertEqual(runner.query.sql()[1], [1])
+
+    def test_insert_from_select_upsert(self):
+        s, a = self.student, self.archive
+        sub = s.select(s.id, s.name).where(s.age == 0).as_table("t")
+        query = a.insert_from_select([a.id, a.name], sub).on_duplicate_key_fields(a.name, sub.name).on_conflict(a.id)
+        chunk = ChunkedRunner(self.executor, query, s.id).chunk_query(1, 11)
+        self.assertTrue(chunk.sql(dialect=SQLITE)[0].endswith('DO UPDATE SET "name" = excluded."name"'))
+        self.run_chunks(query)
+        self.assertEqual(self.rows("SELECT id, name FROM archive WHERE id % 2 = 0 ORDER BY id"),
+                         [(i, "s{:d}".format(i)) for i in range(2, 101, 2)])
+        # the odd ids archived before aren't selected
+        self.assertEqual(self.rows("SELECT DISTINCT name FROM archive WHERE id % 2 = 1"), [("old",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# coding: utf-8
+import array
+import collections
+import sqlite3
+import unittest
+
+from sql_builder import Table, columnar
+from sql_builder.columnar import ColumnarBatch
+from sql_builder.sql import bindparam
+
+
+class _NoQArray(object):
+    """The array module of Python 2, without the "q" typecode."""
+
+    @staticmethod
+    def array(typecode, *args):
+        if typecode == "q":
+            raise ValueError("bad typecode (must be c, b, B, u, h, H, i, I, l, L, f or d)")
+        return array.array(typecode, *args)
+
+
+class IntTypecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.execute("CREATE TABLE student (id INTEGER, age REAL)")
+        self.connection.executemany("INSERT INTO student VALUES (?, ?)", [(1, 10.5), (2, 11.0)])
+        self.student = Table("student")
+
+    def tearDown(self):
+        columnar._INT_TYPECODE = columnar._int_typecode()
+        self.connection.close()
+
+    def test_without_q(self):
+        saved = columnar.array
+        columnar.array = _NoQArray
+        try:
+            typecode = columnar._int_typecode()
+        finally:
+            columnar.array = saved
+        self.assertIn(typecode, ("l", None))
+        if array.array("l").itemsize == 8:
+            self.assertEqual(typecode, "l")
+
+    def test_fetch_with_fallback(self):
+        for typecode in ("l", None):
+            columnar._INT_TYPECODE = typecode
+            columns = columnar.fetch_columns(self.student.select(self.student.id, self.student.age),
+                                             self.connection)
+            self.assertEqual(list(columns["id"]), [1, 2])
+            self.assertEqual(getattr(columns["id"], "typecode", None), typecode)
+            self.assertEqual(columns["age"].typecode, "d")
+
+
+class ColumnarBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT, age REAL)")
+        self.student = Table("student")
+
+    def tearDown(self):
+        self.connection.close()
+
+    def fetch(self):
+        return self.connection.execute("SELECT id, name, age FROM student ORDER BY id").fetchall()
+
+    def test_insert(self):
+        s = self.student
+        columns = collections.OrderedDict([("id", [1, 2, 3]), (s.name, ("a", "b", "c")), ("age", iter([1.5, 2, 3]))])
+        batch = s.insert_columns(columns, chunk_size=2, placeholder="?")
+        self.assertEqual(batch.sql, "INSERT INTO `student`(`id`, `name`, `age`) VALUES(?, ?, ?)")
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(list(batch.chunks()), [[(1, "a", 1.5), (2, "b", 2)], [(3, "c", 3)]])
+        self.assertEqual(batch.executemany(self.connection.cursor()), 3)
+        self.assertEqual(self.fetch(), [(1, "a", 1.5), (2, "b", 2.0), (3, "c", 3.0)])
+
+    def test_update(self):
+        s = self.student
+        self.connection.executemany("INSERT INTO student VALUES (?, ?, ?)", [(1, "a", 10), (2, "b", 20), (3, "c", 30)])
+        columns = collections.OrderedDict([("id", [1, 2, 3]), ("name", ["x", "y", "z"])])
+        batch = s.update_columns(columns, key=s.id, where=s.age > 15, placeholder="?")
+        self.assertEqual(batch.sql, "UPDATE `student` SET `name` = ? WHERE `student`.`age` > ? AND `student`.`id` = ?")
+        # the constant of the where condition is in every row
+        self.assertEqual(list(batch.rows()), [("x", 15, 1), ("y", 15, 2), ("z", 15, 3)])
+        self.assertEqual(batch.executemany(self.connection.cursor()), 2)
+        self.assertEqual(self.fetch(), [(1, "a", 10.0), (2, "y", 20.0), (3, "z", 30.0)])
+
+    def test_query(self):
+        s = self.student
+        query = s.insert(id=bindparam("id"), name=bindparam("name")).on_duplicate_key_fields(name="z")
+        batch = ColumnarBatch(query, {"id": [1, 2], "name": ["a", "b"]})
+        self.assertEqual(list(batch.rows()), [(1, "a", "z"), (2, "b", "z")])
+        self.assertRaises(ValueError, ColumnarBatch, query, {"id": [1, 2]})
+        self.assertRaises(ValueError, ColumnarBatch, query, {"id": [1, 2], "name": ["a"]})
+
+    @unittest.skipIf(columnar.numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        numpy = columnar.numpy
+        s = self.student
+        columns = collections.OrderedDict([("id", numpy.arange(1, 4)), ("age", numpy.array([1.5, numpy.nan, 3.0]))])
+        batch = s.insert_columns(columns, nan_as_null=True, chunk_size=2, placeholder="?")
+        rows = list(batch.rows())
+        self.assertEqual(rows, [(1, 1.5), (2, None), (3, 3.0)])
+        # native values, not NumPy scalars
+        self.assertEqual([type(value) for value in rows[0]], [int, float])
+        batch.executemany(self.connection.cursor())
+        self.assertEqual(self.fetch(), [(1, None, 1.5), (2, None, None), (3, None, 3.0)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+# coding: utf-8
+import unittest
+
+from sql_builder import Column, Condition, Table
+
+
+class InternedColumnTest(unittest.TestCase):
+    def test_interned(self):
+        student = Table("student")
+        self.assertIs(student.id, student.id)
+        self.assertIs(student["id"], student.id)
+        self.assertIs(student.id.as_("sid"), student.id.as_("sid"))
+        self.assertIsNot(student.id.as_("sid"), student.id)
+        self.assertIsNot(Table("student").id, student.id)
+        self.assertEqual(student.select(student.id, student.id.as_("sid"), student.builtin_all).sql(),
+                         ("SELECT `student`.`id`, `student`.`id` AS `sid`, `student`.* FROM `student`", []))
+
+    def test_bound(self):
+        student = Table("student")
+        student.MAX_INTERNED_COLUMNS = 3
+        names = ["c{:d}".format(i) for i in range(10)]
+        columns = [getattr(student, name) for name in names]
+        self.assertEqual(len(student._columns()), 3)
+        self.assertIs(student.c0, columns[0])
+        # the others are built again, and render the same
+        self.assertIsNot(student.c9, columns[9])
+        self.assertEqual(student.select(*columns).sql()[0],
+                         "SELECT {} FROM `student`".format(", ".join("`student`.`{}`".format(name) for name in names)))
+        self.assertEqual(student.c9._shape(), columns[9]._shape())
+
+    def test_slots(self):
+        student = Table("student")
+        for node in (student.id, student.id == 1, Column(None, "id")):
+            self.assertFalse(hasattr(node, "__dict__"))
+        self.assertRaises(AttributeError, setattr, student.id, "extra", 1)
+        self.assertEqual(Condition.__slots__, ("column", "op", "value", "_pattern"))
+
+    def test_alias_recomputed(self):
+        student = Table("student")
+        column = student.id
+        self.assertEqual(column.raw_view, "`student`.`id`")
+        student.as_("s")
+        self.assertEqual(column.raw_view, "`s`.`id`")
+        aliased = Table("student", alias="s")
+        self.assertEqual(column._shape(), aliased.id._shape())
+        self.assertEqual(student.select(column).where(column == 1).sql(),
+                         ("SELECT `s`.`id` FROM `student` AS `s` WHERE `s`.`id` = %s", [1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
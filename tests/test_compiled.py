@@ -0,0 +1,68 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import Table
+from sql_builder.dialects import SQLITE
+from sql_builder.sql import bindparam
+
+
+class CompiledQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def assertBinds(self, build, values):
+        """`build` makes the query from bind params or from the literal values."""
+        compiled = build(lambda name, size=None: bindparam(name, size)).compile()
+        expected = build(lambda name, size=None: values[name]).sql()
+        self.assertEqual(compiled.sql, expected[0])
+        self.assertEqual(compiled.args(values), expected[1])
+        self.assertEqual(compiled.args(**values), expected[1])
+        self.assertEqual(compiled.args(tuple(values[name] for name in compiled.params)), expected[1])
+        return compiled
+
+    def test_select(self):
+        s = self.student
+        compiled = self.assertBinds(
+            lambda p: s.select(s.id).where((s.id == p("id")) & (s.name != "x") & s.age.in_(p("ages", 3))),
+            {"id": 3, "ages": [10, 11, 12]})
+        self.assertEqual(compiled.params, ["id", "ages"])
+
+    def test_update(self):
+        s = self.student
+        self.assertBinds(lambda p: s.update(name=p("name")).update(s.age.inc(p("step"))).where(s.id == p("id")),
+                         {"name": "a", "step": 2, "id": 3})
+
+    def test_repeated(self):
+        s = self.student
+        compiled = self.assertBinds(lambda p: s.select(s.id).where((s.id == p("id")) | (s.age == p("id"))),
+                                    {"id": 3})
+        self.assertEqual(compiled.params, ["id"])
+        self.assertEqual(compiled.args(id=4), [4, 4])
+
+    def test_missing(self):
+        s = self.student
+        compiled = s.select(s.id).where((s.id == bindparam("id")) & (s.age == bindparam("age"))).compile()
+        self.assertRaises(KeyError, compiled.args, id=3)
+        self.assertRaises(ValueError, compiled.args, (3,))
+
+    def test_sizes(self):
+        s = self.student
+        compiled = s.select(s.id).where(s.id.in_(bindparam("ids", 2))).compile()
+        self.assertRaises(ValueError, compiled.args, ids=[1, 2, 3])
+        self.assertRaises(ValueError, s.select(s.id).where(s.id.in_(bindparam("id", 2)) | (s.age == bindparam("id")))
+                          .compile)
+
+    def test_executemany(self):
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT)")
+        s = self.student
+        insert = s.insert(id=bindparam("id"), name=bindparam("name")).compile(dialect=SQLITE)
+        insert.executemany(connection.cursor(), [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+        select = s.select(s.name).where(s.id == bindparam("id")).compile(dialect=SQLITE)
+        self.assertEqual(select.execute(connection.cursor(), id=2).fetchall(), [("b",)])
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# coding: utf-8
+import unittest
+
+from sql_builder import ColumnUpdating, Table
+from sql_builder.dialects import POSTGRESQL
+from sql_builder.sql import _compiled, _Compiler
+
+
+class CompilerTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+        self.teacher = Table("teacher")
+
+    def query(self):
+        s, t = self.student, self.teacher
+        young = t.select(t.id, t.name).where(t.age < 30).as_table("y")
+        old = t.select(t.id).where(t.age > 40)
+        cond = ((s.age == 1) | (s.name == "b")) & s.teacher_id.in_(old) & s.class_id.in_([7, 8])
+        return s.join(young, s.teacher_id == young.id).select(s.id, young.name).where(cond).group(s.class_id)[5:10]
+
+    def test_args_in_text_order(self):
+        self.assertEqual(self.query().sql(), (
+            "SELECT `student`.`id`, `y`.`name` FROM `student` INNER JOIN "
+            "(SELECT `teacher`.`id`, `teacher`.`name` FROM `teacher` WHERE `teacher`.`age` < %s) AS `y` "
+            "ON `student`.`teacher_id` = `y`.`id` "
+            "WHERE (`student`.`age` = %s OR `student`.`name` = %s) "
+            "AND `student`.`teacher_id` IN (SELECT `teacher`.`id` FROM `teacher` WHERE `teacher`.`age` > %s) "
+            "AND `student`.`class_id` IN (%s,%s) GROUP BY `student`.`class_id` LIMIT 5, 5",
+            [30, 1, "b", 40, 7, 8]))
+
+    def test_collected_args(self):
+        query = self.query()
+        args = []
+        query._collect_args(args)
+        self.assertEqual(args, query._render()[1])
+
+    def test_dialect(self):
+        self.assertEqual(self.query().sql(dialect=POSTGRESQL), (
+            'SELECT "student"."id", "y"."name" FROM "student" INNER JOIN '
+            '(SELECT "teacher"."id", "teacher"."name" FROM "teacher" WHERE "teacher"."age" < %s) AS "y" '
+            'ON "student"."teacher_id" = "y"."id" '
+            'WHERE ("student"."age" = %s OR "student"."name" = %s) '
+            'AND "student"."teacher_id" IN (SELECT "teacher"."id" FROM "teacher" WHERE "teacher"."age" > %s) '
+            'AND "student"."class_id" IN (%s,%s) GROUP BY "student"."class_id" LIMIT 5 OFFSET 5',
+            [30, 1, "b", 40, 7, 8]))
+
+    def test_nodes(self):
+        s = self.student
+        cond = (s.age == 1) & ((s.name == "x") | s.id.in_([2, 3]))
+        self.assertEqual(_compiled(cond, "?"),
+                         ("`student`.`age` = ? AND (`student`.`name` = ? OR `student`.`id` IN (?,?))", [1, "x", 2, 3]))
+        self.assertEqual(s.age.inc(2).sql(), ("`age` = `age` + %s", [2]))
+        self.assertEqual(ColumnUpdating(s.name, s.nick).sql("?"), ("`name` = `student`.`nick`", []))
+        young = self.teacher.select(self.teacher.id).where(self.teacher.age < 30).as_table("y")
+        self.assertEqual(s.join(young, s.teacher_id == young.id).from_view(), (
+            "`student` INNER JOIN (SELECT `teacher`.`id` FROM `teacher` WHERE `teacher`.`age` < %s) AS `y` "
+            "ON `student`.`teacher_id` = `y`.`id`", [30]))
+
+    def test_compiler(self):
+        c = _Compiler("?")
+        self.assertEqual((c.ident("a"), c.aliased("x", "b"), c.aliased("x", None)), ("`a`", "x AS `b`", "x"))
+        c = _Compiler("%s", POSTGRESQL)
+        self.assertEqual((c.ident("a"), c.aliased("x", "b")), ('"a"', 'x AS "b"'))
+        c.parts.extend(["a = ", c.placeholder])
+        c.args.append(1)
+        self.assertEqual(c.result(), ("a = %s", [1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
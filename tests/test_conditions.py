@@ -0,0 +1,95 @@
+# coding: utf-8
+import unittest
+
+from sql_builder import ConditionUnion, EmptyCond, FalseCond, Table, TrueCond
+
+
+class ConstantCondTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def where(self, cond):
+        return self.student.select(self.student.id).where(cond).sql()
+
+    def test_invert(self):
+        s = self.student
+        self.assertIsInstance(~FalseCond(), TrueCond)
+        self.assertIsInstance(~TrueCond(), FalseCond)
+        self.assertEqual(self.where(~FalseCond() | (s.id == 3)),
+                         ("SELECT `student`.`id` FROM `student` WHERE 1 = 1", []))
+
+    def test_absorbed(self):
+        s = self.student
+        both = (s.id == 1) & (s.age == 2)
+        for cond in (s.id == 3, both):
+            self.assertIs(cond | FalseCond(), cond)
+            self.assertIs(cond & TrueCond(), cond)
+            self.assertIs(TrueCond() & cond, cond)
+            self.assertIsInstance(cond & FalseCond(), FalseCond)
+            self.assertIsInstance(cond | TrueCond(), TrueCond)
+        self.assertEqual(self.where(~((s.id == 3) | FalseCond())),
+                         ("SELECT `student`.`id` FROM `student` WHERE `student`.`id` != %s", [3]))
+
+    def test_invert_union_of_constant(self):
+        union = ConditionUnion._from_list([self.student.id == 3, FalseCond()], ConditionUnion.OP_OR)
+        self.assertEqual(self.where(~union),
+                         ("SELECT `student`.`id` FROM `student` WHERE `student`.`id` != %s AND 1 = 1", [3]))
+
+
+
+class ConditionUnionTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def where(self, cond):
+        sql, args = self.student.select(self.student.id).where(cond).sql()
+        return sql[len("SELECT `student`.`id` FROM `student` WHERE "):], args
+
+    def test_flattened(self):
+        s = self.student
+        cond = (s.id == 1) & (s.age == 2) & ((s.name == 3) & (s.class_id == 4))
+        self.assertIsInstance(cond, ConditionUnion)
+        self.assertEqual(len(cond.conds), 4)
+        self.assertEqual(self.where(cond), (
+            "`student`.`id` = %s AND `student`.`age` = %s AND `student`.`name` = %s AND `student`.`class_id` = %s",
+            [1, 2, 3, 4]))
+
+    def test_parentheses(self):
+        s = self.student
+        cond = ((s.id == 1) | (s.id == 2)) & (s.age == 3) & ((s.name == 4) | ((s.name == 5) & (s.age == 6)))
+        self.assertEqual(self.where(cond), (
+            "(`student`.`id` = %s OR `student`.`id` = %s) AND `student`.`age` = %s AND "
+            "(`student`.`name` = %s OR (`student`.`name` = %s AND `student`.`age` = %s))", [1, 2, 3, 4, 5, 6]))
+
+    def test_invert(self):
+        s = self.student
+        cond = ~(((s.id == 1) | s.id.in_([2, 3])) & (s.age > 4))
+        self.assertEqual(self.where(cond), (
+            "(`student`.`id` != %s AND `student`.`id` NOT IN (%s,%s)) OR `student`.`age` <= %s", [1, 2, 3, 4]))
+
+    def test_shared_prefix(self):
+        s = self.student
+        base = (s.id == 1) & (s.age == 2)
+        first = base & (s.name == "a")
+        second = base & (s.name == "b")
+        third = first & (s.class_id == 5)
+        self.assertEqual(self.where(base)[1], [1, 2])
+        self.assertEqual(self.where(first)[1], [1, 2, "a"])
+        self.assertEqual(self.where(second)[1], [1, 2, "b"])
+        self.assertEqual(self.where(third)[1], [1, 2, "a", 5])
+
+    def test_thousands_of_terms(self):
+        s = self.student
+        cond = EmptyCond()
+        for i in range(5000):
+            cond |= (s.id == i) & (s.age == i)
+        sql, args = self.where(cond)
+        self.assertEqual(len(cond.conds), 5000)
+        self.assertEqual(args, [i for i in range(5000) for _ in range(2)])
+        self.assertEqual(sql.count(" OR "), 4999)
+        self.assertTrue(sql.startswith("(`student`.`id` = %s AND `student`.`age` = %s) OR ("))
+        self.assertEqual(len(self.where(~cond)[1]), 10000)
+
+
+if __name__ == "__main__":
+    unittest.main()
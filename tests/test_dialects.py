@@ -0,0 +1,36 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import RawSQLField, Table
+from sql_builder.dialects import POSTGRESQL, SQLITE
+
+
+class QuoteIdentTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def test_raw_sql_untouched(self):
+        s = self.student
+        query = s.select(s.id, RawSQLField("'`' || name AS quoted")).where(s.name == "a")
+        self.assertEqual(query.sql(dialect=POSTGRESQL),
+                         ('SELECT "student"."id", \'`\' || name AS quoted FROM "student" WHERE "student"."name" = %s',
+                          ["a"]))
+
+    def test_quotes_doubled(self):
+        table = Table('odd"name').as_("o")
+        self.assertEqual(table.select(table['c"1'].as_("c")).sql(dialect=SQLITE),
+                         ('SELECT "o"."c""1" AS "c" FROM "odd""name" AS "o"', []))
+
+    def test_run_on_sqlite(self):
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE student (id INTEGER, name TEXT)")
+        connection.execute("INSERT INTO student VALUES (1, 'a')")
+        s = self.student
+        sql, args = s.select(s.id, RawSQLField("'`' || name")).where(s.name == "a").sql(dialect=SQLITE)
+        self.assertEqual(connection.execute(sql, args).fetchall(), [(1, "`a")])
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
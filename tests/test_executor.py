@@ -0,0 +1,115 @@
+# coding: utf-8
+import sqlite3
+import threading
+import time
+import unittest
+
+from sql_builder import ConnectionPool, Executor, PoolClosed, PoolTimeout, Table
+
+
+def _is_open(connection):
+    try:
+        connection.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return False
+    return True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def pool(self, **options):
+        pool = ConnectionPool(sqlite3, database=":memory:", check_same_thread=False, **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_timeout(self):
+        pool = self.pool(min_size=0, max_size=1, timeout=0.05)
+        connection = pool.acquire()
+        started = time.time()
+        self.assertRaises(PoolTimeout, pool.acquire)
+        self.assertGreaterEqual(time.time() - started, 0.05)
+        pool.release(connection)
+        self.assertIs(pool.acquire(), connection)
+
+    def test_waiter_served(self):
+        pool = self.pool(min_size=1, max_size=1)
+        connection = pool.acquire()
+        got = []
+        thread = threading.Thread(target=lambda: got.append(pool.acquire(timeout=5)))
+        thread.start()
+        time.sleep(0.05)
+        pool.release(connection)
+        thread.join()
+        self.assertEqual(got, [connection])
+
+    def test_idle_eviction(self):
+        pool = self.pool(min_size=1, max_size=3, max_idle_time=0.05)
+        connections = [pool.acquire() for _ in range(3)]
+        for connection in connections:
+            pool.release(connection)
+        self.assertEqual((pool.size, pool.idle), (3, 3))
+        time.sleep(0.1)
+        kept = pool.acquire()
+        # the oldest ones are closed, min_size stay open
+        self.assertEqual(pool.size, 1)
+        self.assertIs(kept, connections[-1])
+        self.assertEqual([_is_open(each) for each in connections], [False, False, True])
+
+    def test_failed_health_check(self):
+        broken = []
+
+        def check(connection):
+            if connection in broken:
+                raise sqlite3.OperationalError("gone away")
+
+        pool = self.pool(min_size=1, max_size=1, health_check=check, health_check_interval=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        broken.append(connection)
+        replaced = pool.acquire()
+        self.assertIsNot(replaced, connection)
+        self.assertFalse(_is_open(connection))
+        self.assertEqual(pool.size, 1)
+
+    def test_failed_connect(self):
+        calls = []
+
+        def connect():
+            calls.append(None)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("refused")
+            return sqlite3.connect(":memory:")
+
+        pool = ConnectionPool(connect, min_size=0, max_size=1, paramstyle="qmark")
+        self.assertRaises(sqlite3.OperationalError, pool.acquire)
+        # the failed connection doesn't hold a slot
+        self.assertEqual(pool.size, 0)
+        pool.release(pool.acquire())
+        self.assertEqual(pool.size, 1)
+        pool.close()
+
+    def test_closed(self):
+        pool = self.pool(min_size=1, max_size=2)
+        connection = pool.acquire()
+        pool.close()
+        self.assertRaises(PoolClosed, pool.acquire)
+        pool.release(connection)
+        self.assertFalse(_is_open(connection))
+        self.assertEqual(pool.size, 0)
+
+    def test_executor(self):
+        pool = self.pool(min_size=1, max_size=1)
+        self.assertEqual(pool.placeholder, "?")
+        with pool.connection() as connection:
+            connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT)")
+        student = Table("student")
+        executor = Executor(pool)
+        self.assertEqual(executor.execute(student.insert(id=1, name="a")), 1)
+        self.assertEqual(executor.fetch_all(student.select(student.id, student.name)), [(1, "a")])
+        self.assertEqual(executor.fetch_one(student.select(student.name).where(student.id == 2)), None)
+        # released connections are rolled back, writes without autocommit are gone
+        Executor(pool, autocommit=False).execute(student.delete())
+        self.assertEqual(executor.fetch_one(student.select(student.name)), ("a",))
+
+
+if __name__ == "__main__":
+    unittest.main()
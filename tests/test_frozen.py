@@ -0,0 +1,70 @@
+# coding: utf-8
+import unittest
+
+from sql_builder import Table
+
+
+class FrozenManyTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def test_insert_many(self):
+        s = self.student
+        a = s.insert_many([s.id, s.name], [(1, "a"), (2, "b")]).on_duplicate_key_fields(name="c").frozen()
+        b = s.insert_many([s.id, s.name], ((i, name) for i, name in [(1, "a"), (2, "b")]))
+        b = b.on_duplicate_key_fields(name="c").frozen()
+        other = s.insert_many([s.id, s.name], [(1, "a"), (2, "x")]).on_duplicate_key_fields(name="c").frozen()
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, other)
+        self.assertEqual({a: 1}[b], 1)
+        args = []
+        a._collect_args(args)
+        self.assertEqual(args, a.sql()[1])
+
+    def test_update_many(self):
+        s = self.student
+        a = s.update_many(s.id, [(1, {"name": "a"}), (2, {"age": 3})]).where(s.deleted == 0).frozen()
+        b = s.update_many(s.id, [(1, {"name": "a"}), (2, {"age": 3})]).where(s.deleted == 0).frozen()
+        # same columns, keys and values, in other CASEs
+        swapped = s.update_many(s.id, [(1, {"age": "a"}), (2, {"name": 3})]).where(s.deleted == 0).frozen()
+        incremented = s.update_many(s.id, [(1, {"name": "a"}), (2, {"age": s.age.inc(3)})])
+        incremented = incremented.where(s.deleted == 0).frozen()
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, swapped)
+        self.assertNotEqual(a, incremented)
+        self.assertEqual(len(set([a, b, swapped, incremented])), 3)
+        args = []
+        a._collect_args(args)
+        self.assertEqual(args, a.sql()[1])
+
+    def test_use_primary(self):
+        s = self.student
+        replica = s.select(s.id).where(s.id == 1).frozen()
+        primary = s.select(s.id).where(s.id == 1).use_primary().frozen()
+        self.assertEqual(replica.sql(), primary.sql())
+        self.assertNotEqual(replica, primary)
+        self.assertEqual(primary, s.select(s.id).where(s.id == 1).use_primary().frozen())
+        self.assertEqual(replica, s.select(s.id).where(s.id == 1).use_primary(False).frozen())
+        self.assertEqual(len(set([replica, primary])), 2)
+
+
+class TableAliasTest(unittest.TestCase):
+    def test_alias_in_place(self):
+        teacher = Table("teacher")
+        column = teacher.id
+        self.assertIs(teacher.as_("t"), teacher)
+        self.assertEqual(column.raw_view, "`t`.`id`")
+
+    def test_alias_of_frozen(self):
+        teacher = Table("teacher").frozen()
+        aliased = teacher.as_("t")
+        self.assertIsNot(aliased, teacher)
+        self.assertEqual(teacher.id.raw_view, "`teacher`.`id`")
+        self.assertEqual(aliased.select(aliased.id).sql(), ("SELECT `t`.`id` FROM `teacher` AS `t`", []))
+        self.assertIsNot(aliased.as_("u"), aliased)
+
+
+if __name__ == "__main__":
+    unittest.main()
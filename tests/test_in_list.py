@@ -0,0 +1,58 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import InListStrategy, Table
+from sql_builder.dialects import SQLITE
+
+
+class InListPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT)")
+        self.connection.executemany("INSERT INTO student VALUES (?, ?)", [(i, str(i)) for i in range(300)])
+        self.student = Table("student")
+        self.ids = list(range(0, 600, 3))
+        self.strategy = InListStrategy(chunk_size=20, join_threshold=50, insert_rows=30)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def temp_tables(self):
+        return self.connection.execute("SELECT name FROM sqlite_temp_master").fetchall()
+
+    def test_strategies(self):
+        s = self.student
+        for strategy in InListStrategy.strategies:
+            plan = self.strategy.plan(s.select(s.id, s.name).where(s.id.in_(self.ids)), strategy=strategy,
+                                      dialect=SQLITE)
+            self.assertEqual(sorted(row[0] for row in plan.run(self.connection.cursor())), self.ids[:100])
+        self.assertEqual(self.temp_tables(), [])
+
+    def test_unique_temp_tables(self):
+        s = self.student
+        query = s.select(s.id).where(s.id.in_(self.ids))
+        first = self.strategy.plan(query, strategy=InListStrategy.TEMP_TABLE, dialect=SQLITE)
+        second = self.strategy.plan(query, strategy=InListStrategy.TEMP_TABLE, dialect=SQLITE)
+        self.assertNotEqual(first.statements[0].sql, second.statements[0].sql)
+
+    def test_cleanup_on_failure(self):
+        missing = Table("missing")
+        plan = self.strategy.plan(missing.select(missing.id).where(missing.id.in_(self.ids)),
+                                  strategy=InListStrategy.TEMP_TABLE, dialect=SQLITE)
+        self.assertRaises(sqlite3.OperationalError, plan.run, self.connection.cursor())
+        self.assertEqual(self.temp_tables(), [])
+
+    def test_write(self):
+        s = self.student
+        plan = self.strategy.plan(s.delete().where(s.id.in_(self.ids)), strategy=InListStrategy.TEMP_TABLE,
+                                  dialect=SQLITE)
+        self.assertEqual(plan.run(self.connection.cursor()), 100)
+
+    def test_not_a_dialect(self):
+        s = self.student
+        self.assertRaises(ValueError, self.strategy.plan, s.select().where(s.id.in_(self.ids)), dialect="sqlite")
+
+
+if __name__ == "__main__":
+    unittest.main()
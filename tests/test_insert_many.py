@@ -0,0 +1,73 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import Table
+from sql_builder.dialects import SQLITE
+from sql_builder.sql import _estimate_arg_size
+
+
+class InsertManyTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def test_sql(self):
+        s = self.student
+        self.assertEqual(s.insert_many([s.id, "name"], [(1, "a"), {"id": 2, "name": "b"}]).sql(),
+                         ("INSERT INTO `student`(`id`, `name`) VALUES(%s, %s), (%s, %s)", [1, "a", 2, "b"]))
+        self.assertEqual(s.insert_many(["id", "name"], [(1, "a")]).on_duplicate_key_values("name").sql(),
+                         ("INSERT INTO `student`(`id`, `name`) VALUES(%s, %s) ON DUPLICATE KEY UPDATE "
+                          "`name` = VALUES(`name`)", [1, "a"]))
+        self.assertEqual(s.insert_many(["id"], [(1,)]).on_duplicate_key_fields(name="x").sql(),
+                         ("INSERT INTO `student`(`id`) VALUES(%s) ON DUPLICATE KEY UPDATE `name` = %s", [1, "x"]))
+
+    def test_max_rows(self):
+        s = self.student
+        statements = list(s.insert_many(["id", "name"], [(i, "n") for i in range(7)])
+                          .on_duplicate_key_fields(name="x").statements(max_rows=3))
+        self.assertEqual([sql.count("(%s, %s)") for sql, _ in statements], [3, 3, 1])
+        self.assertEqual([args for _, args in statements],
+                         [[0, "n", 1, "n", 2, "n", "x"], [3, "n", 4, "n", 5, "n", "x"], [6, "n", "x"]])
+        self.assertIs(statements[0][0], statements[1][0])
+
+    def test_max_packet_size(self):
+        s = self.student
+        rows = [(i, "x" * (10 * i)) for i in range(1, 30)]
+        statements = list(s.insert_many(["id", "name"], rows).statements(max_packet_size=600))
+        self.assertGreater(len(statements), 1)
+        for sql, args in statements:
+            self.assertLessEqual(len(sql) + sum(_estimate_arg_size(arg) for arg in args), 600)
+        self.assertEqual(sum((args for _, args in statements), []), [value for row in rows for value in row])
+        self.assertRaises(ValueError, list, s.insert_many(["id", "name"], [(1, "x" * 600)]).statements(
+            max_packet_size=600))
+
+    def test_lazy_rows(self):
+        s = self.student
+        produced = []
+
+        def rows():
+            for i in range(10):
+                produced.append(i)
+                yield i, "n"
+
+        statements = s.insert_many(["id", "name"], rows()).statements(max_rows=4)
+        next(statements)
+        self.assertEqual(len(produced), 5)
+        self.assertEqual(len(list(statements)), 2)
+
+    def test_run_on_sqlite(self):
+        s = self.student
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT)")
+        connection.execute("INSERT INTO student VALUES (3, 'old')")
+        query = s.insert_many(["id", "name"], [(i, u"学生{:d}".format(i)) for i in range(1, 11)])
+        query = query.on_duplicate_key_values("name").on_conflict("id")
+        for sql, args in query.statements(max_rows=4, dialect=SQLITE):
+            connection.execute(sql, args)
+        self.assertEqual(connection.execute("SELECT id, name FROM student ORDER BY id").fetchall(),
+                         [(i, u"学生{:d}".format(i)) for i in range(1, 11)])
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# coding: utf-8
+import datetime
+import sqlite3
+import unittest
+
+from sql_builder import ConnectionPool, EmptyCond, Executor, FalseCond, Max, Table, optimize
+from sql_builder.optimizer import CONTRADICTION, DEDUPE, IN_MERGE, RANGE
+from sql_builder.sql import _compiled
+
+
+class OptimizerTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def assertOptimized(self, cond, expected, kinds=()):
+        where, report = optimize(cond)
+        self.assertEqual(_compiled(where, "%s"), expected)
+        self.assertEqual([each.kind for each in report.rewrites], list(kinds))
+        return report
+
+    def test_flatten(self):
+        s = self.student
+        self.assertOptimized(((s.a == 1) & (s.b == 2)) & (((s.c == 3) & EmptyCond()) | FalseCond()),
+                             ("`student`.`a` = %s AND `student`.`b` = %s AND `student`.`c` = %s", [1, 2, 3]))
+        self.assertTrue(optimize(EmptyCond() & EmptyCond())[0].is_empty())
+
+    def test_dedupe(self):
+        s = self.student
+        report = self.assertOptimized((s.a == 1) & (s.a == 1) & s.b.in_([1, 1, 2]),
+                                      ("`student`.`a` = %s AND `student`.`b` IN (%s,%s)", [1, 1, 2]),
+                                      [DEDUPE, DEDUPE])
+        self.assertEqual((report.terms_before, report.terms_after), (3, 2))
+        # 1 and "1" are different values
+        self.assertOptimized(s.b.in_([1, "1"]), ("`student`.`b` IN (%s,%s)", [1, "1"]))
+
+    def test_in_merge(self):
+        s = self.student
+        self.assertOptimized((s.a == 1) | (s.a == 2) | s.a.in_([3, 4, 1]) | (s.b == 1),
+                             ("`student`.`a` IN (%s,%s,%s,%s) OR `student`.`b` = %s", [1, 2, 3, 4, 1]), [IN_MERGE])
+        # a column isn't a literal
+        self.assertOptimized((s.a == 1) | (s.a == s.b),
+                             ("`student`.`a` = %s OR `student`.`a` = `student`.`b`", [1]))
+
+    def test_range(self):
+        s = self.student
+        self.assertOptimized((s.age >= 20) & (s.age >= 18), ("`student`.`age` >= %s", [20]), [RANGE])
+        self.assertOptimized(s.a.in_([1, 5, 9]) & (s.a > 3) & (s.a != 9), ("`student`.`a` = %s", [5]), [RANGE])
+        self.assertOptimized((s.age > 1) & (s.age < 9) & (s.age != 20) & (s.age != 5),
+                             ("`student`.`age` > %s AND `student`.`age` < %s AND `student`.`age` != %s", [1, 9, 5]),
+                             [RANGE])
+        day = datetime.date(2020, 1, 1)
+        self.assertOptimized((s.day >= day) & (s.day > day), ("`student`.`day` > %s", [day]), [RANGE])
+
+    def test_contradiction(self):
+        s = self.student
+        for cond in ((s.a == 1) & (s.a == 2), (s.age > 30) & (s.age < 20), (s.age > 3) & (s.age <= 3),
+                     s.a.in_([1, 2]) & s.a.nin([1, 2]), (s.b == 1) & ((s.a == 1) & (s.a == 2) | FalseCond())):
+            report = self.assertOptimized(cond, ("1 = 0", []), [CONTRADICTION])
+            self.assertTrue(report.contradiction)
+        # strings compare by collation, mixed types aren't ordered
+        self.assertOptimized((s.name > "b") & (s.name < "a"),
+                             ("`student`.`name` > %s AND `student`.`name` < %s", ["b", "a"]))
+        day = datetime.date(2020, 1, 1)
+        self.assertOptimized((s.a > 1) & (s.a < day), ("`student`.`a` > %s AND `student`.`a` < %s", [1, day]))
+
+    def test_query(self):
+        s = self.student
+        query = s.select(s.id).where((s.a == 1) & (s.a == 2))
+        self.assertFalse(query.never_matches())
+        optimized = query.optimized()
+        self.assertTrue(optimized.never_matches())
+        self.assertEqual(optimized.sql(), ("SELECT `student`.`id` FROM `student` WHERE 1 = 0", []))
+        # the original is untouched
+        self.assertEqual(query.sql()[1], [1, 2])
+        unchanged = s.select(s.id).where(s.a == 1)
+        self.assertIs(unchanged.optimized(), unchanged)
+        # an aggregate returns a row even when nothing matches
+        self.assertFalse(s.select(Max(s.id)).where((s.a == 1) & (s.a == 2)).optimized().never_matches())
+        self.assertTrue(s.update(a=3).where((s.a == 1) & (s.a == 2)).optimized().never_matches())
+
+    def test_executor(self):
+        pool = ConnectionPool(sqlite3, database=":memory:", min_size=1, max_size=1, check_same_thread=False)
+        self.addCleanup(pool.close)
+        with pool.connection() as connection:
+            connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, a INTEGER)")
+            connection.execute("INSERT INTO student VALUES (1, 1)")
+            connection.commit()
+        s = self.student
+        executor = Executor(pool, optimize=True)
+        # the contradictions run no statement, not even on a table that doesn't exist
+        missing = Table("missing")
+        self.assertEqual(executor.fetch_all(missing.select(missing.id).where((missing.a == 1) & (missing.a == 2))), [])
+        self.assertEqual(executor.fetch_one(missing.select(missing.id).where((missing.a > 1) & (missing.a < 1))), None)
+        self.assertEqual(executor.execute(missing.delete().where((missing.a == 1) & (missing.a == 2))), 0)
+        self.assertEqual(executor.fetch_all(s.select(s.id).where((s.a == 1) | (s.a == 2) | (s.a == 1))), [(1,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import Table
+from sql_builder.dialects import SQLITE
+from sql_builder.sql import set_prefix_range_scan
+
+
+class PrefixRangeScanTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT)")
+        self.connection.execute("CREATE INDEX ix_name ON student (name)")
+        names = ["n{:04d}".format(i) for i in range(200)] + ["a%b", "a_b", "axb", "azb"]
+        self.connection.executemany("INSERT INTO student (name) VALUES (?)", [(name,) for name in names])
+        self.student = Table("student")
+
+    def tearDown(self):
+        set_prefix_range_scan(False)
+        self.connection.close()
+
+    def plan(self, query):
+        sql, args = query.sql(dialect=SQLITE)
+        return " ".join(row[-1] for row in self.connection.execute("EXPLAIN QUERY PLAN " + sql, args))
+
+    def names(self, cond):
+        s = self.student
+        sql, args = s.select(s.name).where(cond).sql(dialect=SQLITE)
+        return sorted(row[0] for row in self.connection.execute(sql, args))
+
+    def test_index_search(self):
+        s = self.student
+        query = s.select(s.id).where(s.name.startswith("n001"))
+        self.assertIn("SCAN", self.plan(query))
+        set_prefix_range_scan(True)
+        query = s.select(s.id).where(s.name.startswith("n001"))
+        self.assertIn("SEARCH", self.plan(query))
+        self.assertIn("ix_name", self.plan(query))
+        self.assertEqual(len(self.names(s.name.startswith("n001"))), 10)
+
+    def test_literal_wildcards(self):
+        s = self.student
+        self.assertEqual(self.names(s.name.startswith("a_", range_scan=True)), ["a_b"])
+        self.assertEqual(self.names(s.name.startswith("a%", range_scan=True)), ["a%b"])
+        self.assertEqual(self.names(~s.name.startswith("n", range_scan=True)), ["a%b", "a_b", "axb", "azb"])
+
+    def test_like_by_default(self):
+        s = self.student
+        # the values stay LIKE patterns, rendered as they always were
+        self.assertEqual(s.select(s.id).where(s.name.startswith("a_") | s.name.endswith("%b")).sql(),
+                         ("SELECT `student`.`id` FROM `student` WHERE `student`.`name` LIKE %s OR "
+                          "`student`.`name` LIKE %s", ["a_%", "%%b"]))
+        self.assertEqual(self.names(s.name.startswith("a_")), ["a%b", "a_b", "axb", "azb"])
+        self.assertEqual(s.select(s.id).where(s.name.startswith("ab", range_scan=True)).sql(),
+                         ("SELECT `student`.`id` FROM `student` WHERE `student`.`name` >= %s AND "
+                          "`student`.`name` < %s", ["ab", "ac"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
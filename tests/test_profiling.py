@@ -0,0 +1,82 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import ConnectionPool, Executor, Table, profiling
+from sql_builder.profiling import BUILD, EXECUTE, QueryProfiler
+
+
+class _Events(list):
+    __hash__ = object.__hash__
+
+    def __call__(self, event):
+        self.append(event)
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+        self.events = _Events()
+
+    def tearDown(self):
+        profiling.remove_hook(self.events)
+
+    def pool(self):
+        pool = ConnectionPool(sqlite3, database=":memory:", min_size=1, max_size=1, check_same_thread=False)
+        self.addCleanup(pool.close)
+        with pool.connection() as connection:
+            connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, age INTEGER)")
+            connection.executemany("INSERT INTO student VALUES (?, ?)", [(1, 10), (2, 20), (3, 20)])
+            connection.commit()
+        return pool
+
+    def test_build(self):
+        s = self.student
+        with profiling.hooked(self.events, execute=False):
+            s.select(s.id).where(s.age.in_([1, 2])).sql()
+            s.select(s.id).where(s.age.in_([3, 4])).sql()
+            s.select(s.id).where(s.age == 1).sql()
+        s.select(s.id).sql()
+        self.assertEqual([(each.phase, each.statement, each.arg_count, each.rows) for each in self.events],
+                         [(BUILD, "Select", 2, None)] * 2 + [(BUILD, "Select", 1, None)])
+        self.assertEqual(self.events[0].shape_id, self.events[1].shape_id)
+        self.assertNotEqual(self.events[0].shape_id, self.events[2].shape_id)
+        self.assertEqual(self.events[0].sql_length, len(self.events[0].sql))
+        self.assertGreaterEqual(self.events[0].duration, 0)
+
+    def test_execute(self):
+        s = self.student
+        executor = Executor(self.pool())
+        profiling.add_hook(self.events, build=False)
+        self.assertRaises(AssertionError, profiling.add_hook, self.events)
+        executor.fetch_all(s.select(s.id).where(s.age == 20))
+        executor.execute(s.update(age=30).where(s.age == 20))
+        self.assertEqual([(each.phase, each.statement, each.rows) for each in self.events],
+                         [(EXECUTE, "Select", 2), (EXECUTE, "Update", 2)])
+        self.assertIn("?", self.events[0].sql)
+        profiling.remove_hook(self.events)
+        executor.fetch_all(s.select(s.id))
+        self.assertEqual(len(self.events), 2)
+
+    def test_profiler(self):
+        s = self.student
+        profiler = QueryProfiler(max_shapes=2, sql_length=10)
+        executor = Executor(self.pool())
+        with profiling.hooked(profiler, build=False):
+            for age in (10, 20, 30):
+                executor.fetch_all(s.select(s.id).where(s.age == age))
+            executor.fetch_all(s.select(s.age))
+            executor.fetch_all(s.select(s.id, s.age))
+        self.assertEqual(profiler.dropped, 1)
+        top = profiler.top(phase=EXECUTE, by="calls")
+        self.assertEqual([(each.calls, each.rows, each.statement) for each in top], [(3, 3, "Select"), (1, 3, "Select")])
+        self.assertEqual(top[0].sql, "SELECT `st")
+        self.assertEqual(top[0].mean, top[0].total / 3)
+        self.assertEqual(profiler.stats(BUILD), [])
+        self.assertIn("execute (top 2 by total)", profiler.report())
+        profiler.reset()
+        self.assertEqual((profiler.stats(), profiler.dropped), ([], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+# coding: utf-8
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from sql_builder import ConnectionPool, Executor, ResultCache, Table
+from sql_builder.dialects import SQLITE
+from sql_builder.result_cache import _size_of, read_tables
+
+
+class _Connection(object):
+    """A sqlite connection calling `on(event)` before it runs a statement, commits or rolls back."""
+
+    def __init__(self, connection, on):
+        self.connection = connection
+        self.on = on
+
+    def cursor(self):
+        return _Cursor(self.connection.cursor(), self.on)
+
+    def commit(self):
+        self.on("commit")
+        self.connection.commit()
+
+    def rollback(self):
+        self.on("rollback")
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+class _Cursor(object):
+    def __init__(self, cursor, on):
+        self.cursor = cursor
+        self.on = on
+
+    def execute(self, sql, args):
+        self.on("execute " + sql.split()[0])
+        return self.cursor.execute(sql, args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class ExecutorInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, "t.db")
+        connection = sqlite3.connect(self.database)
+        connection.execute("CREATE TABLE teacher (id INTEGER PRIMARY KEY, name TEXT)")
+        connection.execute("INSERT INTO teacher VALUES (1, 'old')")
+        connection.commit()
+        connection.close()
+        self.events = []
+        self.hooks = {}
+        self.teacher = Table("teacher")
+        self.cache = ResultCache()
+        invalidate = self.cache.invalidate
+
+        def logged(*tables):
+            self.events.append("invalidate")
+            return invalidate(*tables)
+
+        self.cache.invalidate = logged
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+        shutil.rmtree(self.directory)
+
+    def on(self, event):
+        self.events.append(event)
+        hook = self.hooks.pop(event, None)
+        if hook is not None:
+            hook()
+
+    def executor(self, autocommit=True, isolation_level=""):
+        pool = ConnectionPool(lambda: _Connection(sqlite3.connect(self.database, isolation_level=isolation_level,
+                                                                  check_same_thread=False), self.on),
+                              min_size=0, max_size=2, paramstyle="qmark")
+        self.pools.append(pool)
+        return Executor(pool, autocommit=autocommit, dialect=SQLITE, result_cache=self.cache)
+
+    def name(self, executor):
+        return executor.fetch_one(self.teacher.select(self.teacher.name))[0]
+
+    def test_reader_during_commit(self):
+        executor = self.executor()
+        self.assertEqual(self.name(executor), "old")
+        self.cache.clear()
+        # the rows read before the write is committed are cached, the invalidation comes after
+        self.hooks["commit"] = lambda: self.assertEqual(self.name(executor), "old")
+        executor.execute(self.teacher.update(name="new").where(self.teacher.id == 1))
+        self.assertEqual(self.events[-1], "invalidate")
+        self.assertNotIn("invalidate", self.events[:self.events.index("commit")])
+        self.assertEqual(self.name(executor), "new")
+
+    def test_reader_without_autocommit(self):
+        # writes are committed by the connection itself
+        executor = self.executor(autocommit=False, isolation_level=None)
+        self.hooks["execute UPDATE"] = lambda: self.assertEqual(self.name(executor), "old")
+        executor.execute(self.teacher.update(name="new").where(self.teacher.id == 1))
+        self.assertNotIn("commit", self.events)
+        # after the rollback of the connection given back, its transaction is over
+        self.assertEqual(self.events[-2:], ["rollback", "invalidate"])
+        self.assertEqual(self.name(executor), "new")
+
+    def test_failed_commit(self):
+        executor = self.executor()
+        self.assertEqual(self.name(executor), "old")
+
+        def fail():
+            raise sqlite3.OperationalError("disk I/O error")
+
+        self.hooks["commit"] = fail
+        self.assertRaises(sqlite3.OperationalError, executor.execute,
+                          self.teacher.update(name="new").where(self.teacher.id == 1))
+        self.assertEqual(self.events[-1], "invalidate")
+        self.assertEqual(len(self.cache), 0)
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = ResultCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(cache.info().evictions, 1)
+
+    def test_bytes(self):
+        rows = [(i, "x" * 10) for i in range(5)]
+        cache = ResultCache(max_bytes=_size_of(rows) * 3 // 2)
+        cache.put("a", rows)
+        cache.put("b", rows)
+        self.assertEqual(cache.bytes, _size_of(rows))
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("b"), rows)
+        # too large to be cached at all
+        cache.put("c", [(i, "x" * 10) for i in range(50)])
+        self.assertEqual(cache.get("c"), None)
+        self.assertEqual(cache.get("b"), rows)
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.05)
+        cache.put("a", 1)
+        cache.put("b", 2, ttl=10)
+        time.sleep(0.1)
+        self.assertEqual((cache.get("a"), cache.get("b")), (None, 2))
+        self.assertEqual(cache.info().expirations, 1)
+
+    def test_tags(self):
+        student, teacher, klass = Table("student"), Table("teacher"), Table("class")
+        query = student.join(klass, student.class_id == klass.id).select(student.id).where(
+            student.teacher_id.in_(teacher.select(teacher.id).where(teacher.name == "a")))
+        self.assertEqual(read_tables(query), frozenset(["student", "class", "teacher"]))
+        cache = ResultCache()
+        cache.put("q", 1, read_tables(query))
+        cache.put("other", 2, ["student"])
+        self.assertEqual(cache.invalidate_query(teacher.delete().where(teacher.id == 1)), 1)
+        self.assertEqual((cache.get("q"), cache.get("other")), (None, 2))
+
+    def test_single_flight(self):
+        cache = ResultCache()
+        loads = []
+        release = threading.Event()
+        results = []
+
+        def load():
+            loads.append(None)
+            release.wait()
+            return [(1,)]
+
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", ["t"], load)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while cache.info().misses + cache.info().waits < 8:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, [[(1,)]] * 8)
+        self.assertEqual(cache.info().waits, 7)
+
+    def test_stale_flight(self):
+        cache = ResultCache()
+        started = threading.Event()
+        release = threading.Event()
+
+        def load():
+            started.set()
+            release.wait()
+            return "old"
+
+        thread = threading.Thread(target=cache.get_or_load, args=("k", ["t"], load))
+        thread.start()
+        started.wait()
+        cache.invalidate("t")
+        # a caller after the write loads again instead of waiting for the old rows
+        self.assertEqual(cache.get_or_load("k", ["t"], lambda: "new"), "new")
+        release.set()
+        thread.join()
+        self.assertEqual(cache.get("k"), "new")
+
+
+if __name__ == "__main__":
+    unittest.main()
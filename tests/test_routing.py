@@ -0,0 +1,90 @@
+# coding: utf-8
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from sql_builder import ConnectionPool, Table
+from sql_builder.dialects import SQLITE
+from sql_builder.routing import Replica, Router
+
+
+class RouterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.primary = self.pool("primary")
+        self.replicas = [self.pool("replica1"), self.pool("replica2")]
+        self.student = Table("student")
+        self.teacher = Table("teacher")
+
+    def tearDown(self):
+        for pool in [self.primary] + self.replicas:
+            pool.close()
+        shutil.rmtree(self.directory)
+
+    def pool(self, name):
+        """A database whose only student is named after it."""
+        pool = ConnectionPool(sqlite3, min_size=0, max_size=2, database=os.path.join(self.directory, name),
+                              check_same_thread=False)
+        with pool.connection() as connection:
+            connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT)")
+            connection.execute("CREATE TABLE teacher (id INTEGER PRIMARY KEY, name TEXT)")
+            connection.execute("INSERT INTO student VALUES (1, ?)", (name,))
+            connection.execute("INSERT INTO teacher VALUES (1, ?)", (name,))
+            connection.commit()
+        return pool
+
+    def router(self, **options):
+        return Router(self.primary, self.replicas, dialect=SQLITE, **options)
+
+    def read(self, router, table=None, primary=False):
+        table = table or self.student
+        query = table.select(table.name)
+        if primary:
+            query = query.use_primary()
+        return router.fetch_one(query)[0]
+
+    def test_reads_on_replicas(self):
+        router = self.router()
+        self.assertEqual(set(self.read(router) for _ in range(50)), set(["replica1", "replica2"]))
+        self.assertEqual(self.read(router, primary=True), "primary")
+        self.assertEqual(sum(replica.reads for replica in router.replicas), 50)
+
+    def test_sticky_after_write(self):
+        router = self.router(sticky_window=0.2)
+        s = self.student
+        self.assertEqual(router.execute(s.update(name="written").where(s.id == 1)), 1)
+        self.assertEqual(self.read(router), "written")
+        # other tables and other sessions still read on the replicas
+        self.assertIn(self.read(router, self.teacher), ("replica1", "replica2"))
+        self.assertIn(router.session().fetch_one(s.select(s.name))[0], ("replica1", "replica2"))
+        time.sleep(0.3)
+        self.assertIn(self.read(router), ("replica1", "replica2"))
+
+    def test_not_sticky(self):
+        router = self.router(sticky_window=0)
+        s = self.student
+        router.execute(s.update(name="written").where(s.id == 1))
+        self.assertIn(self.read(router), ("replica1", "replica2"))
+
+    def test_failover(self):
+        router = Router(self.primary, [self.replicas[0], Replica(self.replicas[1], 100)], dialect=SQLITE)
+        self.replicas[1].close()
+        self.assertEqual(set(self.read(router) for _ in range(20)), set(["replica1"]))
+        self.assertEqual(router.replicas[1].failures, 1)
+        self.assertEqual([replica.in_flight for replica in router.replicas], [0, 0])
+
+    def test_fallback_to_primary(self):
+        for retry_interval in (5.0, 0):
+            router = self.router(retry_interval=retry_interval)
+            for pool in self.replicas:
+                pool.close()
+            self.assertEqual(self.read(router), "primary")
+            # every replica is tried once per read, also when none is left out
+            self.assertEqual([replica.failures for replica in router.replicas], [1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import Table
+
+
+class SeekTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, class_id INTEGER)")
+        self.connection.executemany("INSERT INTO student VALUES (?, ?)",
+                                    [(i, None if i > 6 else i % 3) for i in range(10)])
+        self.student = Table("student")
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_null_value(self):
+        s = self.student
+        query = s.select(s.id).asc(s.class_id).asc(s.id)
+        self.assertRaises(ValueError, query.seek, (None, 3))
+        self.assertRaises(ValueError, query.seek, (None, 3), True)
+
+    def test_pages(self):
+        s = self.student
+        query = s.select(s.class_id, s.id).where(s.class_id != None).asc(s.class_id).asc(s.id)
+        rows = [row for page in query.pages(self.connection, 2) for row in page]
+        self.assertEqual([row[1] for row in rows], [0, 3, 6, 1, 4, 2, 5])
+
+    def test_pages_past_null(self):
+        s = self.student
+        query = s.select(s.class_id, s.id).asc(s.class_id).asc(s.id)
+        pages = query.pages(self.connection, 2)
+        with self.assertRaises(ValueError):
+            list(pages)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# coding: utf-8
+import multiprocessing.pool
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from sql_builder import ConnectionPool, Executor, ShardedTable, ShardRouter
+from sql_builder.dialects import SQLITE
+
+
+class ShardRouterTest(unittest.TestCase):
+    shards = 3
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pools = [self.pool(str(i)) for i in range(self.shards)]
+        # every row, to compare the merged results with
+        self.everything = self.pool("all")
+        self.orders = ShardedTable("orders", key="user_id", shards=self.shards)
+        self.router = ShardRouter([Executor(pool, dialect=SQLITE) for pool in self.pools])
+        self.reference = Executor(self.everything, dialect=SQLITE)
+        rows = random.Random(7).sample(range(1000), 60)
+        o = self.orders
+        for i, total in enumerate(rows):
+            insert = o.insert(id=i, user_id=i % 10, total=total if i % 7 else None)
+            self.router.execute(insert)
+            self.reference.execute(insert)
+
+    def tearDown(self):
+        self.router.close()
+        for pool in self.pools + [self.everything]:
+            pool.close()
+        shutil.rmtree(self.directory)
+
+    def pool(self, name):
+        pool = ConnectionPool(sqlite3, min_size=0, max_size=2, database=os.path.join(self.directory, name),
+                              check_same_thread=False)
+        with pool.connection() as connection:
+            connection.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total INTEGER)")
+            connection.commit()
+        return pool
+
+    def on_shard(self, shard):
+        with self.pools[shard].connection() as connection:
+            return sorted(row[0] for row in connection.execute("SELECT DISTINCT user_id FROM orders"))
+
+    def assertSame(self, query):
+        self.assertEqual(self.router.fetch_all(query), self.reference.fetch_all(query))
+
+    def test_routing(self):
+        o = self.orders
+        for shard in range(self.shards):
+            self.assertEqual(self.on_shard(shard), [user for user in range(10) if user % self.shards == shard])
+        self.assertEqual(self.router.shards_for(o.select().where(o.user_id == 4)), [1])
+        self.assertEqual(self.router.shards_for(o.select().where(o.user_id.in_([1, 4, 5]))), [1, 2])
+        self.assertEqual(self.router.shards_for(o.select().where(o.user_id.in_([1, 4, 5]) & (o.user_id != 4))),
+                         [1, 2])
+        self.assertEqual(self.router.shards_for(o.select().where(o.user_id.in_([1, 4]) & (o.user_id == 5))), [])
+        self.assertEqual(self.router.shards_for(o.select().where((o.user_id == 3) | (o.user_id == 5))), [0, 2])
+        self.assertEqual(self.router.shards_for(o.select().where((o.user_id == 3) | (o.total > 5))), [0, 1, 2])
+        self.assertEqual(self.router.shards_for(o.select().where(o.total > 5)), [0, 1, 2])
+        # every shard only gets its own values
+        query = o.select(o.id).where(o.user_id.in_([1, 4, 5]))
+        self.assertEqual(self.router._on_shard(query, 1).sql(dialect=SQLITE)[1], [1, 4])
+        self.assertSame(query.asc(o.id))
+
+    def test_merge(self):
+        o = self.orders
+        self.assertSame(o.select(o.id, o.total).desc(o.total).asc(o.id))
+        self.assertSame(o.select(o.id, o.total).asc(o.total).asc(o.id)[5:25])
+        self.assertSame(o.select(o.id, o.total).where(o.user_id.in_([2, 3, 7])).desc(o.total).desc(o.id)[0:7])
+        self.assertEqual(len(self.router.fetch_all(o.select(o.id))), 60)
+        self.assertEqual(self.router.fetch_one(o.select(o.id, o.total).asc(o.total).asc(o.id)),
+                         self.reference.fetch_one(o.select(o.id, o.total).asc(o.total).asc(o.id)))
+        self.assertRaises(ValueError, self.router.fetch_all, o.select(o.id).asc(o.total)[0:5])
+
+    def test_aggregates(self):
+        o = self.orders
+        query = o.select(o.id.count(), o.total.max_(), o.total.min_(), o.total.count())
+        self.assertSame(query)
+        self.assertSame(query.where(o.user_id.in_([1, 2])))
+        self.assertSame(query.where(o.user_id.in_([1, 2]) & (o.user_id == 3)))
+        self.assertEqual(self.router.fetch_one(query), self.reference.fetch_one(query))
+        self.assertRaises(ValueError, self.router.fetch_all, o.select(o.user_id, o.id.count()).group(o.user_id))
+        self.assertRaises(ValueError, self.router.fetch_all, o.select(o.user_id, o.id.count()))
+
+    def test_writes(self):
+        o = self.orders
+        self.assertEqual(self.router.execute(o.update(total=0).where(o.user_id.in_([1, 2]))),
+                         self.reference.execute(o.update(total=0).where(o.user_id.in_([1, 2]))))
+        self.assertEqual(self.router.execute(o.delete().where(o.total == 0)),
+                         self.reference.execute(o.delete().where(o.total == 0)))
+        self.assertSame(o.select(o.id, o.user_id, o.total).asc(o.id))
+        self.assertRaises(ValueError, self.router.execute, o.update(user_id=1).where(o.id == 1))
+        self.assertRaises(ValueError, self.router.execute, o.insert(id=100, total=1))
+
+    def test_one_thread_pool(self):
+        started = []
+        thread_pool = multiprocessing.pool.ThreadPool
+
+        def slow_pool(*args):
+            started.append(None)
+            threading.Event().wait(0.05)
+            return thread_pool(*args)
+
+        o = self.orders
+        multiprocessing.pool.ThreadPool = slow_pool
+        try:
+            threads = [threading.Thread(target=self.router.fetch_all, args=(o.select(o.id),)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            multiprocessing.pool.ThreadPool = thread_pool
+        self.assertEqual(len(started), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# coding: utf-8
+import unittest
+
+import sql_builder
+from sql_builder import Delete, Table, sql_cache
+from sql_builder.dialects import POSTGRESQL
+
+
+class SQLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.maxsize = sql_cache.maxsize
+        sql_cache.clear()
+        self.student = Table("student")
+        self.teacher = Table("teacher")
+
+    def tearDown(self):
+        sql_builder.set_sql_cache_size(self.maxsize)
+        sql_cache.clear()
+
+    def queries(self, value):
+        s, t = self.student, self.teacher
+        return [
+            s.select(s.id, s.name).where((s.age > value) & s.class_id.in_([value, value + 1])).desc(s.id)[10:20],
+            s.join(t, s.teacher_id == t.id).select(s.id, t.name.as_("teacher")).where(t.name != str(value)),
+            s.select(s.id).where(s.id.in_(t.select(t.id).where(t.age == value))).group(s.class_id),
+            s.update(name=str(value)).where(s.id == value),
+            s.insert(id=value, name="a").on_duplicate_key_fields(name="b"),
+            Delete(s).where((s.id == value) | s.name.startswith("a")),
+        ]
+
+    def test_hits_render_the_same(self):
+        first = [query.sql() for query in self.queries(1)]
+        self.assertEqual(sql_cache.info().misses, len(first))
+        # other values, the same shapes
+        second = [query.sql() for query in self.queries(2)]
+        self.assertEqual(sql_cache.info().hits, len(first))
+        self.assertEqual([sql for sql, _ in first], [sql for sql, _ in second])
+        for query, (sql, args) in zip(self.queries(2), second):
+            self.assertEqual((sql, args), query._render())
+        self.assertEqual(second[0][1], [2, 2, 3])
+
+    def test_shapes(self):
+        s = self.student
+        self.assertNotEqual(s.select(s.id).where(s.id.in_([1, 2])).sql()[0],
+                            s.select(s.id).where(s.id.in_([1, 2, 3])).sql()[0])
+        self.assertEqual(s.select(s.id).where(s.id == None).sql(),
+                         ("SELECT `student`.`id` FROM `student` WHERE `student`.`id` IS NULL", []))
+        self.assertEqual(s.select(s.id).where(s.id == 1).sql(),
+                         ("SELECT `student`.`id` FROM `student` WHERE `student`.`id` = %s", [1]))
+        self.assertEqual(s.select(s.id).where(s.id == 1).sql("?")[0],
+                         "SELECT `student`.`id` FROM `student` WHERE `student`.`id` = ?")
+        aliased = Table("student").as_("s")
+        self.assertEqual(aliased.select(aliased.id).sql()[0], "SELECT `s`.`id` FROM `student` AS `s`")
+        self.assertEqual(sql_cache.info().hits, 0)
+
+    def test_dialect_cache(self):
+        query = self.queries(1)[0]
+        self.assertEqual(query.sql(dialect=POSTGRESQL), query.sql(dialect=POSTGRESQL))
+        self.assertNotEqual(query.sql()[0], query.sql(dialect=POSTGRESQL)[0])
+
+    def test_lru(self):
+        sql_builder.set_sql_cache_size(2)
+        s = self.student
+        for name in ("a", "b", "a", "c"):
+            s.select(getattr(s, name)).sql()
+        self.assertEqual(sql_cache.info(), sql_cache.CacheInfo(1, 3, 1, 2, 2))
+        s.select(s.a).sql()
+        self.assertEqual(sql_cache.info().hits, 2)
+        s.select(s.b).sql()
+        self.assertEqual(sql_cache.info().misses, 4)
+
+    def test_disabled(self):
+        sql_builder.set_sql_cache_size(0)
+        for query in self.queries(1):
+            self.assertEqual(query.sql(), query._render())
+        self.assertEqual(len(sql_cache), 0)
+        self.assertEqual(sql_cache.info().misses, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
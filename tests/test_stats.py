@@ -0,0 +1,98 @@
+# coding: utf-8
+import sqlite3
+import unittest
+
+from sql_builder import ConnectionPool, Executor, Table
+from sql_builder.stats import StatementStats
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def query(self, value, ids, limit):
+        s = self.student
+        return s.select(s.id, s.name).where((s.age > value) & s.class_id.in_(ids)).desc(s.id)[limit:limit + 10]
+
+    def test_values(self):
+        self.assertEqual(self.query(1, [1, 2], 10).fingerprint(), self.query(5, [1, 2, 3, 4], 30).fingerprint())
+        s = self.student
+        self.assertEqual(s.insert_many(["id", "name"], [(1, "a")]).fingerprint(),
+                         s.insert_many(["id", "name"], [(i, "b") for i in range(9)]).fingerprint())
+        self.assertEqual(s.update_many(s.id, {1: {"name": "a"}}).fingerprint(),
+                         s.update_many(s.id, {2: {"name": "b"}, 3: {"name": "c"}}).fingerprint())
+
+    def test_shapes(self):
+        s = self.student
+        fingerprints = set([
+            self.query(1, [1, 2], 10).fingerprint(),
+            s.select(s.id, s.name).where((s.age < 1) & s.class_id.in_([1, 2])).desc(s.id)[10:20].fingerprint(),
+            s.select(s.id, s.name).where((s.age > 1) & s.class_id.in_([1, 2])).desc(s.id).fingerprint(),
+            s.select(s.id).where((s.age > 1) & s.class_id.in_([1, 2])).desc(s.id)[10:20].fingerprint(),
+            s.select(s.id).where(s.age == None).fingerprint(),
+            s.select(s.id).where(s.age == 1).fingerprint(),
+            s.update(name="a").where(s.id == 1).fingerprint(),
+        ])
+        self.assertEqual(len(fingerprints), 7)
+
+    def test_stable(self):
+        # the same in every process and on Python 2 and 3
+        self.assertEqual(self.query(1, [1, 2], 10).fingerprint(), "4a89f010a6f384d3")
+        self.assertEqual(self.student.insert_many(["id", "name"], [(1, "a")]).fingerprint(), "73b3bcbcfbb2d247")
+
+
+class StatementStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def test_record(self):
+        s = self.student
+        stats = StatementStats()
+        stats.record(s.select(s.id).where(s.id == 1), 0.5, 1)
+        stats.record(s.select(s.id).where(s.id == 2), 1.5, 0)
+        stats.record(s.update(name="a").where(s.id == 1), 0.25, 3, sql="UPDATE")
+        snapshot = stats.snapshot()
+        self.assertEqual([(each.statement, each.calls, each.total_time, each.mean_time, each.max_time, each.rows)
+                          for each in snapshot], [("Select", 2, 2.0, 1.0, 1.5, 1), ("Update", 1, 0.25, 0.25, 0.25, 3)])
+        self.assertEqual(snapshot[0].sql, "SELECT `student`.`id` FROM `student` WHERE `student`.`id` = %s")
+        self.assertEqual(snapshot[1].sql, "UPDATE")
+        self.assertEqual(stats.export(reset=True)[0]["fingerprint"], s.select(s.id).where(s.id == 5).fingerprint())
+        self.assertEqual(len(stats), 0)
+
+    def test_evict(self):
+        s = self.student
+        stats = StatementStats(max_statements=3)
+        for name, calls in (("a", 3), ("b", 1), ("c", 2)):
+            for _ in range(calls):
+                stats.record(s.select(getattr(s, name)), 0.1)
+        stats.record(s.select(s.d), 0.1)
+        self.assertEqual(stats.evicted, 1)
+        # the least called one is gone
+        self.assertEqual(sorted(each.sql for each in stats.snapshot()),
+                         ["SELECT `student`.`{}` FROM `student`".format(name) for name in "acd"])
+
+    def test_install(self):
+        pool = ConnectionPool(sqlite3, database=":memory:", min_size=1, max_size=1, check_same_thread=False)
+        self.addCleanup(pool.close)
+        with pool.connection() as connection:
+            connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, age INTEGER)")
+            connection.commit()
+        s = self.student
+        executor = Executor(pool)
+        stats = StatementStats()
+        stats.install()
+        try:
+            for i in range(3):
+                executor.execute(s.insert(id=i, age=i))
+            executor.fetch_all(s.select(s.id).where(s.id.in_([0, 1])))
+        finally:
+            stats.uninstall()
+        executor.fetch_all(s.select(s.id))
+        self.assertEqual([(each.statement, each.calls, each.rows) for each in stats.snapshot()
+                          if each.statement == "Insert"], [("Insert", 3, 3)])
+        self.assertEqual(len(stats), 2)
+        self.assertIn("?", stats.snapshot()[0].sql)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# coding: utf-8
+import sqlite3
+import sys
+import types
+import unittest
+
+from sql_builder import ConnectionPool, Executor, Table
+from sql_builder.executor import server_side_cursor
+
+
+class _Cursor(object):
+    """A sqlite cursor counting its fetchmany calls and telling when it's closed."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.batches = []
+        self.closed = False
+
+    def execute(self, sql, args):
+        return self.cursor.execute(sql, args)
+
+    def fetchmany(self, size):
+        rows = self.cursor.fetchmany(size)
+        self.batches.append(len(rows))
+        return rows
+
+    def close(self):
+        self.closed = True
+        self.cursor.close()
+
+
+class _Driver(object):
+    """The connection of a fake driver module, recording the cursors asked for."""
+    __module__ = "sql_builder_fake_driver.connections"
+
+    def __init__(self):
+        self.requested = []
+
+    def cursor(self, *args, **kwargs):
+        self.requested.append((args, kwargs))
+        return object()
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, age INTEGER)")
+        self.connection.executemany("INSERT INTO student VALUES (?, ?)", [(i, i % 5) for i in range(25)])
+        self.connection.commit()
+        self.student = Table("student")
+
+    def tearDown(self):
+        self.connection.close()
+        sys.modules.pop("sql_builder_fake_driver", None)
+
+    def test_batches(self):
+        s = self.student
+        cursor = _Cursor(self.connection.cursor())
+        rows = s.select(s.id).where(s.age == 1).asc(s.id).stream(self.connection, batch_size=2, cursor=cursor)
+        self.assertEqual(list(rows), [(1,), (6,), (11,), (16,), (21,)])
+        self.assertEqual(cursor.batches, [2, 2, 1, 0])
+        self.assertTrue(cursor.closed)
+
+    def test_closed_early(self):
+        s = self.student
+        cursor = _Cursor(self.connection.cursor())
+        rows = s.select(s.id).asc(s.id).stream(self.connection, batch_size=10, cursor=cursor)
+        self.assertEqual([next(rows) for _ in range(3)], [(0,), (1,), (2,)])
+        rows.close()
+        self.assertTrue(cursor.closed)
+        self.assertEqual(cursor.batches, [10])
+
+    def test_server_side_cursor(self):
+        module = sys.modules["sql_builder_fake_driver"] = types.ModuleType("sql_builder_fake_driver")
+        module.cursors = types.ModuleType("sql_builder_fake_driver.cursors")
+        module.cursors.SSCursor = object()
+        connection = _Driver()
+        server_side_cursor(connection)
+        self.assertEqual(connection.requested, [((module.cursors.SSCursor,), {})])
+        # plain cursors without a server-side one
+        del module.cursors
+        server_side_cursor(connection)
+        self.assertEqual(connection.requested[-1], ((), {}))
+
+    def test_executor(self):
+        pool = ConnectionPool(lambda: self.connection, min_size=0, max_size=1, paramstyle="qmark")
+        s = self.student
+        executor = Executor(pool)
+        self.assertEqual(len(list(executor.stream(s.select(s.id), batch_size=4))), 25)
+        self.assertEqual(pool.idle, 1)
+        rows = executor.stream(s.select(s.id), batch_size=4)
+        next(rows)
+        self.assertEqual(pool.idle, 0)
+        rows.close()
+        self.assertEqual(pool.idle, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
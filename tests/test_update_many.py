@@ -0,0 +1,69 @@
+# coding: utf-8
+import collections
+import sqlite3
+import unittest
+
+from sql_builder import Table
+from sql_builder.dialects import SQLITE
+
+
+class UpdateManyTest(unittest.TestCase):
+    def setUp(self):
+        self.student = Table("student")
+
+    def query(self):
+        s = self.student
+        first = collections.OrderedDict([("name", "a"), (s.age, s.age.inc(2))])
+        return s.update_many(s.id, [(1, first), (2, {"name": "b"})])
+
+    def test_sql(self):
+        self.assertEqual(self.query().sql(), (
+            "UPDATE `student` SET "
+            "`name` = CASE `student`.`id` WHEN %s THEN %s WHEN %s THEN %s ELSE `name` END, "
+            "`age` = CASE `student`.`id` WHEN %s THEN `age` + %s ELSE `age` END "
+            "WHERE `student`.`id` IN (%s,%s)", [1, "a", 2, "b", 1, 2, 1, 2]))
+
+    def test_where(self):
+        s = self.student
+        sql, args = self.query().where(s.class_id == 3).sql()
+        self.assertTrue(sql.endswith("WHERE `student`.`id` IN (%s,%s) AND `student`.`class_id` = %s"))
+        self.assertEqual(args, [1, "a", 2, "b", 1, 2, 1, 2, 3])
+
+    def test_args_match_render(self):
+        s = self.student
+        query = s.update_many("id", {3: {"age": s.age.dec(1)}, 4: {s.name: "d"}})
+        args = []
+        query._collect_args(args)
+        self.assertEqual(args, query._render()[1])
+
+    def test_statements(self):
+        s = self.student
+        statements = list(self.query().where(s.class_id == 3).statements(max_rows=1))
+        self.assertEqual(statements, [
+            ("UPDATE `student` SET `name` = CASE `student`.`id` WHEN %s THEN %s ELSE `name` END, "
+             "`age` = CASE `student`.`id` WHEN %s THEN `age` + %s ELSE `age` END "
+             "WHERE `student`.`id` IN (%s) AND `student`.`class_id` = %s", [1, "a", 1, 2, 1, 3]),
+            ("UPDATE `student` SET `name` = CASE `student`.`id` WHEN %s THEN %s ELSE `name` END "
+             "WHERE `student`.`id` IN (%s) AND `student`.`class_id` = %s", [2, "b", 2, 3]),
+        ])
+
+    def test_max_packet_size(self):
+        s = self.student
+        rows = [(i, {"name": "x" * 100}) for i in range(20)]
+        statements = list(s.update_many(s.id, rows).statements(max_packet_size=1000))
+        self.assertGreater(len(statements), 1)
+        self.assertEqual(sum(sql.count("WHEN") for sql, _ in statements), 20)
+
+    def test_run_on_sqlite(self):
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT, age INTEGER)")
+        connection.executemany("INSERT INTO student VALUES (?, ?, ?)", [(1, "x", 10), (2, "y", 20), (3, "z", 30)])
+        for sql, args in self.query().statements(max_rows=1, dialect=SQLITE):
+            connection.execute(sql, args)
+        self.assertEqual(connection.execute("SELECT id, name, age FROM student ORDER BY id").fetchall(),
+                         [(1, "a", 12), (2, "b", 20), (3, "z", 30)])
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()